@@ -0,0 +1,116 @@
+import gzip
+import json
+import re
+import time
+import zlib
+import discord
+
+# Whole-guild structure archives for /snapshot and /restore. An archive is gzipped JSON holding the
+# roles (bottom to top, with colour, permissions and members), the categories and channels in
+# position order, and every permission overwrite. Restoring compiles it into a regular plan (see
+# reorg.compileRestore), so it is diffed against the guild, journaled and resumable.
+
+FORMAT = 1
+MAX_SIZE = 64 * 1024 * 1024  # Decompressed bytes accepted by /restore
+
+
+class ArchiveError(Exception):
+    pass
+
+
+# Value types of each row, checked on decode so a damaged file never reaches reorg.compileRestore
+ROWS = {
+    'roles': (int, str, int, int, bool, bool, list),
+    'categories': (int, str, list),
+    'channels': (int, str, str, (int, type(None)), (str, type(None)), list),
+}
+OVERWRITE = (str, int, int, int)
+
+
+# Overwrites as [kind, target ID, allow, deny] rows, kind is 'role' or 'member'
+def _overwrites(channel):
+    rows = []
+    for target, overwrite in channel.overwrites.items():
+        allow, deny = overwrite.pair()
+        kind = "member" if isinstance(target, (discord.Member, discord.User)) else "role"
+        rows.append([kind, target.id, allow.value, deny.value])
+    return rows
+
+
+# The guild's structure, members must be chunked for role membership to be complete
+def capture(guild:discord.Guild):
+    roles = [role for role in guild.roles if not role.is_default() and not role.managed]
+    categories = sorted(guild.categories, key=lambda category: (category.position, category.id))
+    order = {category.id: index for index, category in enumerate(categories)}
+    channels = sorted(
+        (channel for channel in guild.channels if str(channel.type) != "category"),
+        key=lambda channel: (order.get(channel.category_id, -1), channel.position, channel.id)
+    )
+    return {
+        'format': FORMAT,
+        'guild': guild.id,
+        'name': guild.name,
+        'created_at': time.time(),
+        'everyone': guild.default_role.permissions.value,
+        # id, name, colour, permissions, hoist, mentionable, member IDs
+        'roles': [
+            [role.id, role.name, role.color.value, role.permissions.value, role.hoist, role.mentionable, [member.id for member in role.members]]
+            for role in roles
+        ],
+        # id, name, overwrites
+        'categories': [[category.id, category.name, _overwrites(category)] for category in categories],
+        # id, name, kind, category ID, topic, overwrites
+        'channels': [
+            [channel.id, channel.name, str(channel.type), channel.category_id, getattr(channel, 'topic', None), _overwrites(channel)]
+            for channel in channels
+        ],
+    }
+
+
+def encode(state:dict):
+    return gzip.compress(json.dumps(state, separators=(",", ":"), ensure_ascii=False).encode(), compresslevel=9)
+
+
+def filename(guild:discord.Guild):
+    slug = re.sub(r'[^\w-]+', '-', guild.name).strip('-').lower() or str(guild.id)
+    return f"{slug}-snapshot-{time.strftime('%Y%m%d-%H%M')}.json.gz"
+
+
+def decode(raw:bytes):
+    try:
+        if raw[:2] == b"\x1f\x8b":
+            inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            data = inflater.decompress(raw, MAX_SIZE)
+            if inflater.unconsumed_tail:
+                raise ArchiveError(f"The snapshot is larger than {MAX_SIZE // 1024 // 1024} MB uncompressed")
+        else:
+            data = raw
+        state = json.loads(data)
+    except (zlib.error, UnicodeDecodeError, ValueError) as e:
+        raise ArchiveError(f"Not a snapshot file: {e}")
+    if not isinstance(state, dict) or state.get('format') != FORMAT:
+        raise ArchiveError("Not a snapshot file, or one written by an incompatible version")
+    if not isinstance(state.get('guild'), int) or not isinstance(state.get('everyone'), (int, type(None))):
+        raise ArchiveError("The snapshot is damaged: its server ID or @everyone permissions are missing")
+    for key, types in ROWS.items():
+        if not isinstance(state.get(key), list):
+            raise ArchiveError(f"The snapshot has no {key}")
+        for number, row in enumerate(state[key], start=1):
+            if not _matches(row, types):
+                raise ArchiveError(f"The snapshot is damaged: {key} entry {number} is malformed")
+            if key == 'roles':
+                valid = all(isinstance(memberId, int) for memberId in row[6])
+            else:
+                valid = all(_matches(overwrite, OVERWRITE) and overwrite[0] in ("role", "member") for overwrite in row[-1])
+            if not valid:
+                raise ArchiveError(f"The snapshot is damaged: {key} entry {number} is malformed")
+    return state
+
+
+def _matches(row, types:tuple):
+    return isinstance(row, list) and len(row) == len(types) and all(isinstance(value, kind) for value, kind in zip(row, types))
+
+
+def summary(state:dict):
+    memberships = sum(len(role[6]) for role in state['roles'])
+    return f"{len(state['roles'])} roles, {memberships} role memberships, {len(state['categories'])} categories, {len(state['channels'])} channels"
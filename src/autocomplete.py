@@ -0,0 +1,143 @@
+import bisect
+import re
+from collections import Counter
+import discord
+from discord import app_commands
+
+# Name indexes behind the slash command autocomplete. Each guild gets one index per kind of name
+# (roles, text channels, categories), built lazily on the first lookup and then kept in sync by
+# gateway events. Prefix matches come from a sorted list, typos and partial words from a trigram index,
+# e.g. '4348 kim' finds 'cs-4348✎kim-khah-mukherjee'.
+
+MAX_CHOICES = 25  # Discord's limit per autocomplete response
+MIN_SCORE = 0.4  # Share of the query's trigrams a fuzzy match must contain
+
+_WORD = re.compile(r'\w+')
+_indexes = {}
+
+
+def _grams(folded:str):
+    grams = set()
+    for word in _WORD.findall(folded):
+        padded = f" {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class NameIndex:
+    def __init__(self, items=()):
+        self.names = {}  # id -> name
+        self._sorted = []  # sorted (casefolded name, id) pairs for prefix lookups
+        self._grams = {}  # trigram -> ids
+        for itemId, name in items:
+            self.add(itemId, name)
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, itemId:int, name:str):
+        if self.names.get(itemId) == name:
+            return
+        self.remove(itemId)
+        folded = name.casefold()
+        self.names[itemId] = name
+        bisect.insort(self._sorted, (folded, itemId))
+        for gram in _grams(folded):
+            self._grams.setdefault(gram, set()).add(itemId)
+
+    def remove(self, itemId:int):
+        name = self.names.pop(itemId, None)
+        if name is None:
+            return
+        folded = name.casefold()
+        position = bisect.bisect_left(self._sorted, (folded, itemId))
+        if position < len(self._sorted) and self._sorted[position] == (folded, itemId):
+            del self._sorted[position]
+        for gram in _grams(folded):
+            ids = self._grams.get(gram)
+            if ids is not None:
+                ids.discard(itemId)
+                if not ids:
+                    del self._grams[gram]
+
+    # Names starting with the query first, then names containing it, then the closest fuzzy matches
+    def search(self, query:str, limit:int=MAX_CHOICES):
+        folded = query.strip().casefold()
+        matches = []
+        position = bisect.bisect_left(self._sorted, (folded,))
+        while position < len(self._sorted) and len(matches) < limit:
+            name, itemId = self._sorted[position]
+            if not name.startswith(folded):
+                break
+            matches.append(itemId)
+            position += 1
+        if len(matches) >= limit or not folded:
+            return [self.names[itemId] for itemId in matches]
+
+        queryGrams = _grams(folded)
+        hits = Counter()
+        for gram in queryGrams:
+            hits.update(self._grams.get(gram, ()))
+        seen = set(matches)
+        contains, fuzzy = [], []
+        for itemId, count in hits.items():
+            if itemId in seen:
+                continue
+            if folded in self.names[itemId].casefold():
+                contains.append((-count, self.names[itemId], itemId))
+            elif count >= MIN_SCORE * len(queryGrams):
+                fuzzy.append((-count, self.names[itemId], itemId))
+        matches += [itemId for _, _, itemId in sorted(contains)] + [itemId for _, _, itemId in sorted(fuzzy)]
+        return [self.names[itemId] for itemId in matches[:limit]]
+
+
+class GuildNames:
+    def __init__(self, guild:discord.Guild):
+        self.roles = NameIndex((role.id, role.name) for role in guild.roles if not role.is_default())
+        self.channels = NameIndex((channel.id, channel.name) for channel in guild.text_channels)
+        self.categories = NameIndex((category.id, category.name) for category in guild.categories)
+
+
+def forGuild(guild:discord.Guild):
+    names = _indexes.get(guild.id)
+    if names is None:
+        names = _indexes[guild.id] = GuildNames(guild)
+    return names
+
+
+def dropGuild(guild:discord.Guild):
+    _indexes.pop(guild.id, None)
+
+
+def choices(names):
+    return [app_commands.Choice(name=name[:100], value=name) for name in names]
+
+
+# Gateway event hooks, only touch guilds whose index has already been built
+def onChannelChange(channel:discord.abc.GuildChannel):
+    names = _indexes.get(channel.guild.id)
+    if names is None:
+        return
+    if isinstance(channel, discord.CategoryChannel):
+        names.categories.add(channel.id, channel.name)
+    elif isinstance(channel, discord.TextChannel):
+        names.channels.add(channel.id, channel.name)
+
+
+def onChannelDelete(channel:discord.abc.GuildChannel):
+    names = _indexes.get(channel.guild.id)
+    if names is not None:
+        names.categories.remove(channel.id)
+        names.channels.remove(channel.id)
+
+
+def onRoleChange(role:discord.Role):
+    names = _indexes.get(role.guild.id)
+    if names is not None and not role.is_default():
+        names.roles.add(role.id, role.name)
+
+
+def onRoleDelete(role:discord.Role):
+    names = _indexes.get(role.guild.id)
+    if names is not None:
+        names.roles.remove(role.id)
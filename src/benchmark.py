@@ -0,0 +1,226 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+# Keep the benchmark's plan journal away from the bot's database
+os.environ.setdefault('VALLEY_DB', os.path.join(tempfile.mkdtemp(prefix="valley-bench-"), "benchmark.db"))
+
+import archive
+import broadcast
+import export
+import fakediscord
+import memberindex
+import overwrites
+import plans
+import reorg
+
+# Offline benchmarks for the bulk commands against the fakediscord stand-in.
+#   python benchmark.py                  run the small profile and print the report
+#   python benchmark.py --profile full   10k members, 500 roles, 1,000 channels
+#   python benchmark.py --check          fail if request counts or wall time regress against the baseline
+#   python benchmark.py --update         record the current results as the baseline
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+PROFILES = {
+    'small': {'members': 1000, 'roles': 50, 'channels': 100, 'categories': 5},
+    'full': {'members': 10000, 'roles': 500, 'channels': 1000, 'categories': 20},
+}
+WALL_TOLERANCE = 0.5  # Wall time may grow 50% before it counts as a regression, request counts may not grow
+WALL_SLACK = 0.05  # Seconds of timer noise ignored on top, for scenarios that finish in milliseconds
+
+
+# Every scenario receives a freshly generated guild and returns how many plan operations it ran
+async def benchAssign(guild, rng:random.Random):
+    courses = [role.name for role in guild.roles[1:41]] + [f"new-course-{index}" for index in range(5)]
+    rows = {name: [] for name in courses}
+    for member in guild.members[1:]:
+        for name in rng.sample(courses, rng.randint(1, 4)):
+            rows[name].append(member.name)
+    plan, _ = reorg.compileAssign(guild, rows, memberindex.MemberIndex(guild.members))
+    await plans.runPlan(plan, guild)
+    return len(plan.operations)
+
+
+async def benchRole(guild, rng:random.Random):
+    names = [role.name for role in guild.roles if not role.is_default() and role.name != "Valley"]
+    rng.shuffle(names)
+    names += [f"new-role-{index}" for index in range(20)]
+    plan, _ = reorg.compileRole(guild, names)
+    await plans.runPlan(plan, guild)
+    return len(plan.operations)
+
+
+async def benchChannel(guild, rng:random.Random):
+    category = guild.categories[0]
+    names = [channel.name for channel in category.channels][::-1] + [f"new-channel-{index}" for index in range(10)]
+    plan = reorg.compileChannel(guild, category, names)
+    await plans.runPlan(plan, guild)
+    return len(plan.operations)
+
+
+async def benchRename(guild, rng:random.Random):
+    pairs = [(channel.name, f"renamed-{channel.name}") for channel in guild.channels if channel.type == "text"][:200]
+    pairs += [(role.name, f"renamed-{role.name}") for role in guild.roles[1:101] if role.name != "Valley"]
+    plan, _, _ = reorg.compileRename(guild, pairs)
+    await plans.runPlan(plan, guild)
+    return len(plan.operations)
+
+
+# A 20-change membership patch, applied without diffing the rest of the guild
+async def benchPatch(guild, rng:random.Random):
+    roleNames = [role.name for role in guild.roles if not role.is_default() and role.name != "Valley"]
+    entries = [
+        {'kind': "member", 'change': "added", 'id': member.id, 'name': member.name, 'target': rng.choice(roleNames), 'position': "", 'line': line}
+        for line, member in enumerate(rng.sample(guild.members[1:], 20), 2)
+    ]
+    plan, _ = reorg.compilePatch(guild, entries, memberindex.MemberIndex(guild.members))
+    await plans.runPlan(plan, guild)
+    return len(plan.operations)
+
+
+async def benchPermissions(guild, rng:random.Random):
+    channels = [channel for channel in guild.channels if channel.type == "text"][:100]
+    roles = [role for role in guild.roles if not role.is_default() and role.name != "Valley"]
+    rules, _ = overwrites.parseTemplate("private")
+    plan, _ = reorg.compileOverwrites(guild, [(channel, roles[index % len(roles)]) for index, channel in enumerate(channels)], rules)
+    await plans.runPlan(plan, guild)
+    return len(plan.operations)
+
+
+# A snapshot restored after a category with its channels and ten roles (with their members) were deleted
+async def benchRestore(guild, rng:random.Random):
+    state = archive.decode(archive.encode(archive.capture(guild)))
+    for role in rng.sample([role for role in guild.roles if not role.is_default() and role.name != "Valley"], 10):
+        del guild._roles[role.id]
+    category = guild.categories[-1]
+    for channel in category.channels + [category]:
+        del guild._channels[channel.id]
+    plan, _ = reorg.compileRestore(guild, state)
+    await plans.runPlan(plan, guild)
+    return len(plan.operations)
+
+
+async def benchGet(guild, rng:random.Random):
+    files = export.exportFiles(export.roleRows(guild.roles[1:]), "roles", guild.filesize_limit)
+    files += export.exportFiles(export.memberRows(guild.members), "members", guild.filesize_limit)
+    for file in files:
+        file.fp.close()
+    return len(files)
+
+
+async def benchSend(guild, rng:random.Random):
+    client = SimpleNamespace(get_channel=guild.get_channel)
+    channelIds = [channel.id for channel in guild.channels if channel.type == "text"][:40]
+    result = await broadcast.sendToChannels(client, channelIds, "Benchmark announcement")
+    return result.total
+
+
+SCENARIOS = {
+    'assign': benchAssign,
+    'role': benchRole,
+    'channel': benchChannel,
+    'rename': benchRename,
+    'patch': benchPatch,
+    'permissions': benchPermissions,
+    'restore': benchRestore,
+    'get': benchGet,
+    'send': benchSend,
+}
+
+
+async def runScenario(name:str, profile:dict, timeScale:float, seed:int):
+    backend = fakediscord.FakeBackend(timeScale=timeScale, seed=seed)
+    guild = fakediscord.generateGuild(backend, seed=seed, **profile)
+    rng = random.Random(seed)
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    started = time.perf_counter()
+    operations = await SCENARIOS[name](guild, rng)
+    wall = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    await fakediscord.settle(backend)
+
+    return {
+        'operations': operations,
+        'requests': sum(backend.requests.values()),
+        'routes': dict(backend.requests),
+        'rate_limit_waits': backend.rateLimitWaits,
+        'wall': round(wall, 3),
+        'simulated_seconds': round(wall / timeScale, 1),
+        'peak_mb': round(peak / 1024 / 1024, 2),
+    }
+
+
+def report(results:dict):
+    print(f"{'scenario':<10}{'ops':>8}{'requests':>10}{'waits':>8}{'wall s':>9}{'sim s':>10}{'peak MB':>9}")
+    for name, result in results.items():
+        print(
+            f"{name:<10}{result['operations']:>8}{result['requests']:>10}{result['rate_limit_waits']:>8}"
+            f"{result['wall']:>9.3f}{result['simulated_seconds']:>10.1f}{result['peak_mb']:>9.2f}"
+        )
+        for route, count in sorted(result['routes'].items()):
+            print(f"{'':<10}  {count:>6}  {route}")
+
+
+def check(results:dict, baseline:dict):
+    regressions = []
+    for name, result in results.items():
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+        if result['requests'] > expected['requests']:
+            regressions.append(f"{name}: {result['requests']} requests, baseline {expected['requests']}")
+        if result['wall'] > expected['wall'] * (1 + WALL_TOLERANCE) + WALL_SLACK:
+            regressions.append(f"{name}: {result['wall']:.3f}s wall, baseline {expected['wall']:.3f}s")
+    return regressions
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark the bulk commands against a simulated Discord backend.")
+    parser.add_argument("--profile", choices=PROFILES, default="small")
+    parser.add_argument("--only", choices=SCENARIOS, action="append", help="Run only these scenarios")
+    parser.add_argument("--time-scale", type=float, default=0.001, help="Multiplier for simulated latency and rate-limit windows")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--check", action="store_true", help="Exit non-zero if results regress against the baseline")
+    parser.add_argument("--update", action="store_true", help="Store the results as the new baseline")
+    args = parser.parse_args()
+
+    results = {}
+    for name in args.only or SCENARIOS:
+        results[name] = await runScenario(name, PROFILES[args.profile], args.time_scale, args.seed)
+    report(results)
+
+    baselines = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as file:
+            baselines = json.load(file)
+    key = f"{args.profile}@{args.time_scale}"
+
+    if args.update:
+        baselines.setdefault(key, {}).update({name: {'requests': result['requests'], 'wall': result['wall']} for name, result in results.items()})
+        with open(BASELINE_PATH, "w") as file:
+            json.dump(baselines, file, indent=2, sort_keys=True)
+        print(f"Baseline '{key}' updated")
+
+    if args.check:
+        if key not in baselines:
+            print(f"No baseline for '{key}', run with --update first")
+            return 1
+        regressions = check(results, baselines[key])
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(main()))
@@ -1,42 +1,215 @@
-import csv
-from io import StringIO
+import gateway
+import gzip
+import io
+import itertools
 import discord
 from discord.ext import commands
 from discord import app_commands
 import os
 from dotenv import load_dotenv
 import utils
+import bulk
+import memberindex
+import autocomplete
+import export
+import changes
+import ingest
+import plans
+import reorg
+import guildcache
+import scheduler
+import broadcast
+import metrics
+import onboarding
+import archive
+import overwrites
+import roster
+import shards
+import jobqueue
+from datetime import datetime
 
 # Load the token from the .env file
 load_dotenv()
 TOKEN = os.getenv('DISCORD_TOKEN')
 
-# Create the bot
-intents = discord.Intents.all()
+# Create the bot, INTENTS_PROFILE picks the gateway intents ('lean' by default)
+intents = gateway.intents()
 # intents.messages = True  # Enable to read messages in guilds
 # intents.members = True  # Enable to read members in guilds
 # intents.reactions = True  # Enable to monitor reactions
 # intents.guilds = True  # Enable to monitor guilds
-client = discord.Client(intents=intents)
+# Trace every HTTP request for the metrics endpoint and /stats. Sharded when SHARD_COUNT is set.
+client = shards.createClient(intents, http_trace=metrics.traceConfig(), **gateway.clientOptions())
 tree = app_commands.CommandTree(client)
+# Students run /verify, so every other command is limited with default_permissions to members who can
+# manage the roles, channels or server it changes. Server admins can adjust this under Integrations.
+
+# Warm-load the guild cache from disk before connecting
+@client.event
+async def setup_hook():
+    print(f"Loaded {guildcache.loadAll()} cached guilds")
+    await metrics.serve(client)
 
 # On bot connecting to Discord
 @client.event
 async def on_ready():
     print(f'{client.user} has started')
+    startup = gateway.recordStartup(client)
+    if startup:
+        print(startup)
+    # Bring the guild cache up to date with whatever changed while the bot was offline
+    for guild in client.guilds:
+        print(f"Synced {guild.name}: {guildcache.syncGuild(guild)} cache rows changed")
+    # Start delivering scheduled messages once channels are available
+    scheduler.start(client)
     try:
         await tree.sync()
     except Exception as e:
         print(f"Failed to sync commands: {e}")
 
-# /get <channel | role> <category:string | contains:string>
+# Shard health for /shards and the metrics endpoint, the unsharded client counts as shard 0
+@client.event
+async def on_shard_connect(shard_id: int):
+    shards.onConnect(shard_id)
+
+@client.event
+async def on_shard_disconnect(shard_id: int):
+    shards.onDisconnect(shard_id)
+
+@client.event
+async def on_shard_resumed(shard_id: int):
+    shards.onResumed(shard_id)
+
+@client.event
+async def on_connect():
+    if not shards.isSharded(client):
+        shards.onConnect(0)
+
+@client.event
+async def on_disconnect():
+    if not shards.isSharded(client):
+        shards.onDisconnect(0)
+
+@client.event
+async def on_resumed():
+    if not shards.isSharded(client):
+        shards.onResumed(0)
+
+# Keep the member lookup index, guild cache and autocomplete indexes in sync with the gateway
+@client.event
+async def on_member_join(member: discord.Member):
+    memberindex.onMemberJoin(member)
+    guildcache.onMemberChange(member)
+    onboarding.enqueue(member)
+
+@client.event
+async def on_member_update(before: discord.Member, after: discord.Member):
+    memberindex.onMemberUpdate(before, after)
+    guildcache.onMemberChange(after)
+
+@client.event
+async def on_member_remove(member: discord.Member):
+    memberindex.onMemberRemove(member)
+    guildcache.onMemberRemove(member)
+
+@client.event
+async def on_user_update(before: discord.User, after: discord.User):
+    memberindex.onUserUpdate(before, after)
+
+@client.event
+async def on_guild_remove(guild: discord.Guild):
+    memberindex.dropGuild(guild)
+    autocomplete.dropGuild(guild)
+
+@client.event
+async def on_guild_channel_create(channel: discord.abc.GuildChannel):
+    guildcache.onChannelChange(channel)
+    autocomplete.onChannelChange(channel)
+
+@client.event
+async def on_guild_channel_update(before: discord.abc.GuildChannel, after: discord.abc.GuildChannel):
+    guildcache.onChannelChange(after)
+    autocomplete.onChannelChange(after)
+
+@client.event
+async def on_guild_channel_delete(channel: discord.abc.GuildChannel):
+    guildcache.onChannelDelete(channel)
+    autocomplete.onChannelDelete(channel)
+
+@client.event
+async def on_guild_role_create(role: discord.Role):
+    guildcache.onRoleChange(role)
+    autocomplete.onRoleChange(role)
+
+@client.event
+async def on_guild_role_update(before: discord.Role, after: discord.Role):
+    guildcache.onRoleChange(after)
+    autocomplete.onRoleChange(after)
+
+@client.event
+async def on_guild_role_delete(role: discord.Role):
+    guildcache.onRoleDelete(role)
+    autocomplete.onRoleDelete(role)
+
+# Autocomplete handlers, answered from in-memory indexes well inside Discord's 3 second deadline
+@metrics.timed
+async def role_autocomplete(interaction: discord.Interaction, current: str):
+    if interaction.guild is None:
+        return []
+    return autocomplete.choices(autocomplete.forGuild(interaction.guild).roles.search(current))
+
+@metrics.timed
+async def category_autocomplete(interaction: discord.Interaction, current: str):
+    if interaction.guild is None:
+        return []
+    return autocomplete.choices(autocomplete.forGuild(interaction.guild).categories.search(current))
+
+# Suggests from the members cached so far rather than waiting for a chunk
+def member_choices(guild: discord.Guild, current: str):
+    gateway.prefetchMembers(guild)
+    return [
+        app_commands.Choice(name=f"{member.display_name} ({member.name})"[:100], value=member.name)
+        for member in memberindex.forGuild(guild).prefix(current, autocomplete.MAX_CHOICES)
+    ]
+
+@metrics.timed
+async def member_autocomplete(interaction: discord.Interaction, current: str):
+    if interaction.guild is None:
+        return []
+    return member_choices(interaction.guild, current)
+
+# /get's filter value depends on the item and filter type chosen before it
+@metrics.timed
+async def filter_value_autocomplete(interaction: discord.Interaction, current: str):
+    guild = interaction.guild
+    if guild is None:
+        return []
+    item_type, filter_type = interaction.namespace.item_type, interaction.namespace.filter_type
+    if filter_type == "all" or item_type == "changes":
+        return []
+    if item_type == "members" and filter_type == "contains":
+        return member_choices(guild, current)
+    names = autocomplete.forGuild(guild)
+    if item_type == "channel":
+        index = names.categories if filter_type == "category" else names.channels
+    else:
+        index = names.roles
+    return autocomplete.choices(index.search(current))
+
+
+# /get <channel | role | members> <category | contains | role | all> <value>
 @tree.command(name="get", description="Get channels or roles based on a category or name.")
+@app_commands.default_permissions(manage_guild=True)
 @app_commands.describe(
-    item_type="'channel or 'role' or 'members'",
-    filter_type="'category' then value or 'contains' then value or 'all''",
-    filter_value="The value for the category or substring filter."
+    item_type="'channel or 'role' or 'members', or 'changes' for what changed since a snapshot",
+    filter_type="'category' then value or 'contains' then value or 'all'', for changes 'last' or 'since' then a snapshot number",
+    filter_value="The value for the category or substring filter.",
+    compress="Gzip the exported CSV files.",
+    patch_format="For changes: 'csv' or 'json'."
 )
-async def get(interaction: discord.Interaction, item_type: str, filter_type: str, filter_value: str):
+@app_commands.autocomplete(filter_value=filter_value_autocomplete)
+@metrics.timed
+async def get(interaction: discord.Interaction, item_type: str, filter_type: str, filter_value: str, compress: bool = False, patch_format: str = "csv"):
     guild = interaction.guild
 
     # Check if the command is run in a guild
@@ -47,34 +220,30 @@ async def get(interaction: discord.Interaction, item_type: str, filter_type: str
     # Defer the interaction to give more time for processing
     await interaction.response.defer()
 
+    # Every item type is streamed into CSV attachments, rows are only generated while writing
     if item_type == "channel":
         if filter_type == "category":
             category = discord.utils.get(guild.categories, name=filter_value)
-            if category:
-                channels = sorted(category.channels, key=lambda c: c.position)
-                channel_list = [f"{category.name} -> `#{channel.name}`" for channel in channels]
-                await interaction.followup.send(f"Channels in category {filter_value}:\n```{'\n'.join(channel_list)}```")
-            else:
+            if category is None:
                 await interaction.followup.send(f"Category '{filter_value}' not found.")
+                return
+            channels = sorted(category.channels, key=lambda c: c.position)
+            title = f"Channels in category {filter_value}:"
         elif filter_type == "contains":
-            category_channels = {}
-            for channel in sorted(guild.channels, key=lambda c: c.position):
-                if filter_value in channel.name:
-                    category_name = channel.category.name if channel.category else "No Category"
-                    if category_name not in category_channels:
-                        category_channels[category_name] = []
-                    category_channels[category_name].append(f"{channel.name}")
-
-            output = []
-            for category, channels in category_channels.items():
-                output.append(f"{category}\n```" + '\n'.join(channels) + "```")
-
-            if output:
-                await interaction.followup.send('\n'.join(output))
-            else:
-                await interaction.followup.send(f"No channels found containing '{filter_value}'.")
-                
+            channels = (channel for channel in sorted(guild.channels, key=lambda c: c.position) if filter_value in channel.name)
+            title = f"Channels containing '{filter_value}':"
+        elif filter_type == "all":
+            channels = sorted(guild.channels, key=lambda c: c.position)
+            title = "All channels:"
+        else:
+            await interaction.followup.send("Invalid filter type. Use 'category', 'contains' or 'all'.")
+            return
+
+        if not await export.sendExport(interaction, title, export.channelRows(channels), "channels", compress):
+            await interaction.followup.send(f"No channels found matching '{filter_value}'.")
+
     elif item_type == "role":
+        await gateway.ensureMembers(guild)  # Each role row lists its members
         bot_member = guild.get_member(client.user.id)
         bot_role = bot_member.top_role
 
@@ -83,45 +252,75 @@ async def get(interaction: discord.Interaction, item_type: str, filter_type: str
             roles_below_bot = [role for role in roles_below_bot if filter_value in role.name]
         roles_below_bot = sorted(roles_below_bot, key=lambda r: r.position)
 
-        if roles_below_bot:
-            output = StringIO()
-            writer = csv.writer(output)
-            for role in roles_below_bot:
-                members = [member.name for member in role.members]
-                writer.writerow([role.name] + members)
-            output.seek(0)
-
-            file = discord.File(StringIO(output.getvalue()), filename="roles_below_bot.csv")
-            await interaction.followup.send("Here are the roles below the bot:", file=file)
-        else:
+        if not await export.sendExport(interaction, "Here are the roles below the bot:", export.roleRows(roles_below_bot), "roles_below_bot", compress):
             await interaction.followup.send("No roles found below the bot's role with the specified filter.")
-            
+
     elif item_type == "members":
+        await gateway.ensureMembers(guild)
         if filter_type == "role":
             role = discord.utils.get(guild.roles, name=filter_value)
-            if role:
-                members = {member.name:member.id for member in role.members}
-                await interaction.followup.send("\n".join(f"{name} {user_id}" for name, user_id in {member.name: member.id for member in role.members}.items()))
-            else:
+            if role is None:
                 await interaction.followup.send(f"Role '{filter_value}' not found.")
+                return
+            members = role.members
+            title = f"Members with role '{filter_value}':"
         elif filter_type == "contains":
-            members = {member.name:member.id for member in guild.members if filter_value in member.name}
-            if members:
-                await interaction.followup.send("\n".join(f"{name} {user_id}" for name, user_id in {member.name: member.id for member in role.members}.items()))
-            else:
-                await interaction.followup.send(f"No members found with name containing '{filter_value}'.")
+            members = (member for member in guild.members if filter_value in member.name)
+            title = f"Members with name containing '{filter_value}':"
         elif filter_type == "all":
-            members = {member.name:member.id for member in guild.members}
-            await interaction.followup.send("\n".join(f"{name} {user_id}" for name, user_id in {member.name: member.id for member in role.members}.items()))
+            members = guild.members
+            title = "All members:"
         else:
-            await interaction.followup.send("Invalid filter type. Use 'role' or 'contains'.")
+            await interaction.followup.send("Invalid filter type. Use 'role', 'contains' or 'all'.")
+            return
+
+        if not await export.sendExport(interaction, title, export.memberRows(members), "members", compress):
+            await interaction.followup.send(f"No members found matching '{filter_value}'.")
+    elif item_type == "changes":
+        # Only what changed since a stored snapshot, as a patch that /assign and /rename accept
+        if filter_type not in ("last", "since"):
+            await interaction.followup.send("Invalid filter type. Use 'last' or 'since'.")
+            return
+        try:
+            base_id = int(filter_value) if filter_type == "since" else None
+        except ValueError:
+            await interaction.followup.send("Invalid snapshot number.")
+            return
+
+        await gateway.ensureMembers(guild)
+        state = changes.capture(guildcache.forGuild(guild))
+        base = changes.load(guild.id, base_id)
+        if base is None:
+            if base_id is not None:
+                await interaction.followup.send(f"Snapshot #{base_id} not found.")
+                return
+            version = changes.save(guild.id, state)
+            await interaction.followup.send(f"Saved snapshot #{version}. Next time `/get changes last` exports only what changed since it.")
+            return
+        rows = changes.diff(base.state, state)
+        if not rows:
+            await interaction.followup.send(f"Nothing changed since snapshot #{base.id}.")
+            return
+
+        version = changes.save(guild.id, state)
+        title = f"{len(rows)} changes from snapshot #{base.id} to #{version}:"
+        filename = f"changes-{base.id}-{version}"
+        if patch_format == "json":
+            data = changes.patchJson(guild.id, base, version, rows)
+            extension = ".json.gz" if compress else ".json"
+            await interaction.followup.send(title, file=discord.File(io.BytesIO(gzip.compress(data) if compress else data), filename=filename + extension))
+        else:
+            await export.sendExport(interaction, title, itertools.chain([changes.PATCH_HEADER], rows), filename, compress)
     else:
-        await interaction.followup.send("Invalid item type. Use 'channel' or 'role'.")
+        await interaction.followup.send("Invalid item type. Use 'channel', 'role', 'members' or 'changes'.")
 
 
 # /addrole <roleName:string> <memberName:string>
 @tree.command(name="addrole", description="Add a role to a member.")
+@app_commands.default_permissions(manage_roles=True)
 @app_commands.describe(role_name="The name of the role to add.", member_name="The name of the member to add the role to.")
+@app_commands.autocomplete(role_name=role_autocomplete, member_name=member_autocomplete)
+@metrics.timed
 async def addRole(interaction: discord.Interaction, role_name: str, member_name: str):
     guild = interaction.guild
 
@@ -138,7 +337,8 @@ async def addRole(interaction: discord.Interaction, role_name: str, member_name:
         await interaction.followup.send(f"Role '{role_name}' not found.")
         return
 
-    member = discord.utils.get(guild.members, name=member_name)
+    await gateway.ensureMembers(guild)
+    member = memberindex.forGuild(guild).get(member_name)
     if member is None:
         await interaction.followup.send(f"Member '{member_name}' not found.")
         return
@@ -154,128 +354,170 @@ async def addRole(interaction: discord.Interaction, role_name: str, member_name:
 
 
 
-# Create the /role command
-@tree.command(name="role", description="Reorder roles based on a message ID")
-@app_commands.describe(message_id="The ID of the message containing the ordered list of roles")
-async def role(interaction: discord.Interaction, message_id: str):
-    guild = interaction.guild
-    
-    # Fetch the message by ID
+# Run a journaled plan as a background job on the guild's job queue: plans in one guild run one at a
+# time, other guilds are unaffected. Progress and the final report are posted to the channel, so runs
+# longer than the interaction's 15 minutes still report back. after, if given, is awaited with the
+# result once the plan has run (e.g. to post a results file).
+def start_plan(plan: plans.Plan, guild: discord.Guild, channel: discord.abc.Messageable, title: str, done_title: str, after=None):
+    async def work(job: jobqueue.Job):
+        result = await plans.runPlan(plan, guild, onProgress=job.progress)
+        if after is not None:
+            await after(result)
+        return result
+    return jobqueue.submit(
+        guild.id, f"{title} (plan #{plan.id})", work, key=('plan', plan.id), channel=channel,
+        report=lambda result: plan_report(plan, result, done_title)
+    )
+
+
+# Compile-then-run helper shared by the reorganization commands. A dry run only journals the plan
+# as a draft and previews it, /resume applies it later. Otherwise the plan is started as a job and
+# the command answers with the job ID right away. Returns the job, or None when nothing runs.
+async def run_plan(interaction: discord.Interaction, plan: plans.Plan, dry_run: bool, title: str, done_title: str, after=None):
+    if not plan.operations:
+        await interaction.followup.send(f"{title}: nothing to change.")
+        return None
+    if dry_run:
+        plan_id = plans.journal().save(plan, 'draft')
+        await interaction.followup.send(f"Dry run, nothing was changed. Plan #{plan_id}:\n{plan.preview()}\nRun `/resume {plan_id}` to apply it."[:2000])
+        return None
+    plans.journal().save(plan, 'running')
+    job = start_plan(plan, interaction.guild, interaction.channel, title, done_title, after)
+    await interaction.followup.send(job_started(job, f"{title}: plan #{plan.id} ({len(plan.operations)} operations)"))
+    return job
+
+
+def job_started(job: jobqueue.Job, title: str):
+    ahead = jobqueue.ahead(job)
+    queued = f", queued behind {ahead} other jobs in this server" if ahead else ""
+    return f"{title} is job #{job.id}{queued}. Progress is posted in this channel, `/cancel {job.id}` stops it."
+
+
+# Reads a reorganization command's input from an uploaded file or from a message, and validates all
+# of it before anything is compiled. Replies with the problems and returns None when it is unusable.
+async def read_input(interaction: discord.Interaction, message_id: str, file: discord.Attachment, parse, columns: int = None):
     try:
-        message = await interaction.channel.fetch_message(message_id)
+        if file is not None:
+            rows = await ingest.readAttachment(file)
+        elif message_id is not None:
+            message = await interaction.channel.fetch_message(int(message_id))
+            rows = ingest.readText(message.content, columns)
+        else:
+            await interaction.followup.send("Provide a message_id or attach a file.")
+            return None
+        parsed, errors = parse(rows)
+    except ingest.IngestError as e:
+        await interaction.followup.send(str(e)[:2000])
+        return None
     except discord.NotFound:
-        await interaction.response.send_message("Message not found.", ephemeral=True)
-        return
-    
-    new_positions = message.content.splitlines()  # Assuming each role name is on a new line
+        await interaction.followup.send(f"Message with ID {message_id} not found.")
+        return None
+    except ValueError:
+        await interaction.followup.send("Invalid message ID format. Please provide a valid message ID.")
+        return None
+    except Exception as e:
+        await interaction.followup.send(f"Could not read the input: {e}"[:2000])
+        return None
+    if errors:
+        await interaction.followup.send(f"Nothing was changed, fix these lines and try again:\n{ingest.errorReport(errors)}"[:2000])
+        return None
+    return parsed
 
-    # Get roles below the bot
-    bot_member = guild.get_member(client.user.id)
-    bot_role = bot_member.top_role
-    original_positions = [role for role in guild.roles if role.position < bot_role.position]
 
-    # Create any missing roles
-    for role_name in new_positions:
-        if not discord.utils.get(guild.roles, name=role_name):
-            await guild.create_role(name=role_name)
+# A /get changes patch uploaded to /assign or /rename, applied as-is instead of diffing the whole guild
+async def apply_patch(interaction: discord.Interaction, patch: ingest.Patch, dry_run: bool):
+    guild = interaction.guild
+    await gateway.ensureMembers(guild)
+    plan, skipped = reorg.compilePatch(guild, patch.changes, memberindex.forGuild(guild))
+    if skipped:
+        await interaction.followup.send(f"Skipped {len(skipped)} patch rows:\n{ingest.errorReport(skipped)}"[:2000])
+    await run_plan(interaction, plan, dry_run, "Applying patch", "Patch applied")
 
-    # Fetch the updated roles list after creating missing roles
-    updated_roles = [role for role in guild.roles if role.position < bot_role.position]
 
-    # Map role names to their objects
-    role_map = {role.name: role for role in updated_roles}
+def plan_report(plan: plans.Plan, result: bulk.BulkResult, title: str):
+    report = f"{title}: {result.summary()} operations (plan #{plan.id})."
+    if result.failed:
+        report += f"\nFailures:\n{result.failureReport()}"
+    if plan.status != 'done':
+        report += f"\nRun `/resume {plan.id}` to continue from the last completed operation."
+    return report
+
+
+# Create the /role command
+@tree.command(name="role", description="Reorder roles based on a list in a message or an uploaded file")
+@app_commands.default_permissions(manage_roles=True)
+@app_commands.describe(
+    message_id="The ID of the message containing the ordered list of roles",
+    file="A CSV, TSV or XLSX file with one role name per row, instead of a message.",
+    dry_run="Preview the changes without applying them."
+)
+@metrics.timed
+async def role(interaction: discord.Interaction, message_id: str = None, file: discord.Attachment = None, dry_run: bool = False):
+    guild = interaction.guild
+
+    # Check if the command is run in a guild
+    if guild is None:
+        await interaction.response.send_message("This command can only be used in a server (guild).", ephemeral=True)
+        return
+
+    # Defer the interaction to give more time for processing
+    await interaction.response.defer()
+
+    new_positions = await read_input(interaction, message_id, file, ingest.parseNames, columns=1)  # Each role name is on a new line
+    if new_positions is None:
+        return
+    plan, unmovable = reorg.compileRole(guild, new_positions)
+    if unmovable:
+        await interaction.followup.send(f"Roles at or above the bot's highest role cannot be moved: {', '.join(unmovable)}"[:2000])
+    await run_plan(interaction, plan, dry_run, "Reordering roles", "Roles reordered")
 
-    # Create the final positions list with the roles that need to be moved
-    final_positions = [role_map[role_name] for role_name in new_positions if role_name in role_map]
 
-    # Reorder roles
-    try:
-        # Update the role positions
-        await guild.edit_role_positions(positions={role: index + 1 for index, role in enumerate(final_positions)})
-        await interaction.response.send_message("Roles have been reordered successfully.")
-    except discord.Forbidden:
-        await interaction.response.send_message("I don't have permission to reorder roles.", ephemeral=True)
-    except discord.HTTPException as e:
-        await interaction.response.send_message(f"An error occurred: {str(e)}", ephemeral=True)
-        
-        
-        
 # Create the /assign command
-@tree.command(name="assign", description="Assign roles to users based on a CSV-formatted message")
-@app_commands.describe(message_id="The ID of the message containing the CSV of roles and users")
-async def assign(interaction: discord.Interaction, message_id: str):
+@tree.command(name="assign", description="Assign roles to users based on a CSV message or an uploaded file")
+@app_commands.default_permissions(manage_roles=True)
+@app_commands.describe(
+    message_id="The ID of the message containing the CSV of roles and users",
+    file="A CSV, TSV or XLSX file with a role name followed by its users on each row, or a /get changes patch.",
+    dry_run="Preview the changes without applying them."
+)
+@metrics.timed
+async def assign(interaction: discord.Interaction, message_id: str = None, file: discord.Attachment = None, dry_run: bool = False):
     guild = interaction.guild
-    
-    # Fetch the message by ID
-    try:
-        message = await interaction.channel.fetch_message(message_id)
-    except discord.NotFound:
-        await interaction.response.send_message("Message not found.", ephemeral=True)
-        return
-    
-    csv_content = message.content
-
-    # Parse the CSV content
-    csv_reader = csv.reader(StringIO(csv_content))
-    
-    for row in csv_reader:
-        if len(row) < 2:
-            continue  # Skip any rows that don't have at least one role and one user
-        
-        role_name = row[0]
-        user_identifiers = row[1:]
-        
-        # Find or create the role
-        role = discord.utils.get(guild.roles, name=role_name)
-        if role is None:
-            role = await guild.create_role(name=role_name)
-
-        # Get the list of members who should have this role
-        members_to_have_role = set()
-
-        for user_identifier in user_identifiers:
-            user = None
-            
-            if user_identifier.startswith("<@") and user_identifier.endswith(">"):
-                # It's a mention
-                user_id = int(user_identifier[2:-1].replace('!', ''))  # Remove mention formatting
-                user = guild.get_member(user_id)
-            else:
-                # Search by username (new Discord username system without discriminator)
-                user = discord.utils.find(lambda m: m.name == user_identifier, guild.members)
-            
-            if user:
-                members_to_have_role.add(user)
-
-        # Remove the role from members who shouldn't have it
-        for member in role.members:
-            if member not in members_to_have_role:
-                try:
-                    await member.remove_roles(role)
-                except discord.Forbidden:
-                    await interaction.response.send_message(f"Failed to remove {role_name} from {member.display_name}: Insufficient permissions.", ephemeral=True)
-                except discord.HTTPException as e:
-                    await interaction.response.send_message(f"Failed to remove {role_name} from {member.display_name}: {str(e)}", ephemeral=True)
-
-        # Assign the role to the members who should have it
-        for member in members_to_have_role:
-            if role not in member.roles:
-                try:
-                    await member.add_roles(role)
-                except discord.Forbidden:
-                    await interaction.response.send_message(f"Failed to assign {role_name} to {member.display_name}: Insufficient permissions.", ephemeral=True)
-                except discord.HTTPException as e:
-                    await interaction.response.send_message(f"Failed to assign {role_name} to {member.display_name}: {str(e)}", ephemeral=True)
-    
-    await interaction.response.send_message("Roles have been updated successfully.")
+
+    # Check if the command is run in a guild
+    if guild is None:
+        await interaction.response.send_message("This command can only be used in a server (guild).", ephemeral=True)
+        return
+
+    # Defer the interaction, a large assignment takes far longer than the initial response window
+    await interaction.response.defer()
+
+    # Role name -> user identifiers, the whole roster becomes a single plan
+    rows = await read_input(interaction, message_id, file, ingest.patchOr(ingest.parseAssignments))
+    if rows is None:
+        return
+    if isinstance(rows, ingest.Patch):
+        await apply_patch(interaction, rows, dry_run)
+        return
+
+    await gateway.ensureMembers(guild)
+    plan, unresolved = reorg.compileAssign(guild, rows, memberindex.forGuild(guild))
+    if unresolved:
+        await interaction.followup.send(f"{len(unresolved)} users not found: {', '.join(unresolved[:20])}"[:2000])
+    await run_plan(interaction, plan, dry_run, "Assigning roles", "Role assignment finished")
 
 
 @tree.command(name="channel", description="Reorganize or create channels in a category based on a list.")
+@app_commands.default_permissions(manage_channels=True)
 @app_commands.describe(
     category="The category to reorganize.",
-    message_id="The ID of the message containing the list of channel names."
+    message_id="The ID of the message containing the list of channel names.",
+    file="A CSV, TSV or XLSX file with one channel name per row, instead of a message.",
+    dry_run="Preview the changes without applying them."
 )
-async def channel(interaction: discord.Interaction, category: str, message_id: str):
+@app_commands.autocomplete(category=category_autocomplete)
+@metrics.timed
+async def channel(interaction: discord.Interaction, category: str, message_id: str = None, file: discord.Attachment = None, dry_run: bool = False):
     guild = interaction.guild
 
     # Check if the command is run in a guild
@@ -289,156 +531,309 @@ async def channel(interaction: discord.Interaction, category: str, message_id: s
         await interaction.response.send_message(f"Category '{category}' not found.", ephemeral=True)
         return
 
+    # Defer the interaction to give more time for processing
+    await interaction.response.defer(ephemeral=True)
+
     try:
-        # Convert message_id to an integer if needed (since fetch_message expects an integer)
-        message_id = int(message_id)
-        message = await interaction.channel.fetch_message(message_id)
-        channel_list = message.content.splitlines()  # Split message into channel names list
-
-        # Track existing and missing channels
-        existing_channels = {channel.name: channel for channel in category_obj.channels}
-        new_channels = []
-
-        # Reorder existing channels and track new channels
-        for index, channel_name in enumerate(channel_list):
-            if channel_name in existing_channels:
-                # Reorder existing channels
-                await existing_channels[channel_name].edit(position=index)
-            else:
-                # Track new channels to be created
-                new_channels.append(channel_name)
-
-        # Create new channels and position them
-        for index, channel_name in enumerate(channel_list):
-            if channel_name in new_channels:
-                new_channel = await guild.create_text_channel(channel_name, category=category_obj)
-                await new_channel.edit(position=index)
-
-        await interaction.response.send_message(f"Channels in category '{category}' have been reorganized.", ephemeral=True)
+        channel_list = await read_input(interaction, message_id, file, ingest.parseNames, columns=1)
+        if channel_list is None:
+            return
+
+        plan = reorg.compileChannel(guild, category_obj, channel_list)
+        await run_plan(interaction, plan, dry_run, f"Reorganizing '{category}'", f"Channels in category '{category}' have been reorganized")
 
-    except discord.NotFound:
-        await interaction.response.send_message(f"Message with ID {message_id} not found.", ephemeral=True)
-    except ValueError:
-        await interaction.response.send_message("Invalid message ID format. Please provide a valid message ID.", ephemeral=True)
     except Exception as e:
-        await interaction.response.send_message(f"An error occurred: {e}", ephemeral=True)
+        await interaction.followup.send(f"An error occurred: {e}", ephemeral=True)
 
 # /rename <messageID:string>
-@tree.command(name="rename", description="Rename channels and roles based on message content.")
-@app_commands.describe(message_id="The ID of the message containing the old and new names for renaming.")
-async def rename(interaction: discord.Interaction, message_id: str):
+@tree.command(name="rename", description="Rename channels and roles based on message content or an uploaded file.")
+@app_commands.default_permissions(manage_guild=True)
+@app_commands.describe(
+    message_id="The ID of the message containing the old and new names for renaming.",
+    file="A CSV, TSV or XLSX file with the old and new name on each row, or a /get changes patch.",
+    dry_run="Preview the changes without applying them."
+)
+@metrics.timed
+async def rename(interaction: discord.Interaction, message_id: str = None, file: discord.Attachment = None, dry_run: bool = False):
     guild = interaction.guild
     try:
         # Defer the interaction response to allow time for the renaming process
         await interaction.response.defer()
 
-        # Convert message_id to an integer if needed (since fetch_message expects an integer)
-        message_id = int(message_id)
-        message = await interaction.channel.fetch_message(message_id)
-        lines = message.content.splitlines()  # Split message into lines
-        renamed_items = []  # To keep track of renamed channels and roles
-
-        for line in lines:
-            if ',' in line:
-                old_name, new_name = line.split(',', 1)  # Split into old and new names
-
-                # Rename channels
-                for channel in guild.channels:
-                    if channel.name.strip() == old_name.strip():
-                        await channel.edit(name=new_name.strip())
-                        renamed_items.append(f"Channel '{old_name.strip()}' -> '{new_name.strip()}'")
-
-                # Rename roles
-                for role in guild.roles:
-                    if role.name.strip() == old_name.strip():
-                        await role.edit(name=new_name.strip())
-                        renamed_items.append(f"Role '{old_name.strip()}' -> '{new_name.strip()}'")
-
-        if renamed_items:
-            await interaction.followup.send(f"Renamed the following items:\n" + "\n".join(renamed_items))
-        else:
+        # Old and new names, split on the first comma in a message
+        pairs = await read_input(interaction, message_id, file, ingest.patchOr(ingest.parseRenames), columns=2)
+        if pairs is None:
+            return
+        if isinstance(pairs, ingest.Patch):
+            await apply_patch(interaction, pairs, dry_run)
+            return
+
+        plan, conflicts, chained = reorg.compileRename(guild, pairs)
+        if conflicts:
+            await interaction.followup.send("Rename conflicts:\n" + "\n".join(f"- {conflict}" for conflict in conflicts)[:1900])
+        if chained:
+            await interaction.followup.send("Chained renames:\n" + "\n".join(f"- {rename}" for rename in chained)[:1900])
+        if not plan.operations:
             await interaction.followup.send(f"No matching channels or roles found to rename.")
+            return
+        # Per-item results as an attachment, a few hundred renames do not fit in one message
+        async def post_results(result: bulk.BulkResult):
+            rows = [[label, "renamed", ""] for label, _ in result.succeeded] + [[label, "failed", str(error)] for label, error in result.failed]
+            await export.sendExport(interaction.channel, "Rename results:", rows, "rename_results")
+
+        await run_plan(interaction, plan, dry_run, "Renaming", "Renaming finished", after=post_results)
 
     except discord.Forbidden:
         await interaction.followup.send("Bot lacks the required permissions to rename channels or roles.")
-    except discord.NotFound:
-        await interaction.followup.send(f"Message with ID {message_id} not found.")
-    except ValueError:
-        await interaction.followup.send("Invalid message ID format. Please provide a valid message ID.")
     except Exception as e:
         await interaction.followup.send(f"An error occurred: {e}")
 
+# /permissions <template> [channels] [pairing]
+@tree.command(name="permissions", description="Apply a permission overwrite template to a set of channels and their paired roles.")
+@app_commands.default_permissions(manage_roles=True)
+@app_commands.describe(
+    template="A preset (private, readonly, public) or rules such as '@everyone: -view_channel; {role}: +view_channel'.",
+    channels="The channels: 'class', 'category:<name>', 'pattern:<glob>' or comma-separated names.",
+    pairing="How each channel finds its {role}: 'name', 'normalized' (ignores case and punctuation) or 'course' (code before ✎).",
+    message_id="The ID of a message with 'channel,role' on each line, instead of pairing by name.",
+    file="A CSV, TSV or XLSX file with a channel and its role on each row, instead of pairing by name.",
+    dry_run="Preview the overwrites that would change without applying them."
+)
+@metrics.timed
+async def permissions(interaction: discord.Interaction, template: str, channels: str = "class", pairing: str = "name", message_id: str = None, file: discord.Attachment = None, dry_run: bool = False):
+    guild = interaction.guild
+
+    # Check if the command is run in a guild
+    if guild is None:
+        await interaction.response.send_message("This command can only be used in a server (guild).", ephemeral=True)
+        return
+    if pairing not in overwrites.PAIRINGS:
+        await interaction.response.send_message(f"Invalid pairing. Use one of: {', '.join(overwrites.PAIRINGS)}.", ephemeral=True)
+        return
+
+    await interaction.response.defer()
+    rules, errors = overwrites.parseTemplate(template)
+    if errors:
+        await interaction.followup.send(f"Nothing was changed, fix the template and try again:\n{ingest.errorReport(errors)}"[:2000])
+        return
+
+    if message_id is not None or file is not None:
+        rows = await read_input(interaction, message_id, file, ingest.parseChannelRoles, columns=2)
+        if rows is None:
+            return
+        pairs, missing = overwrites.pairMapping(guild, rows)
+    else:
+        channel_ids, missing = broadcast.resolveChannelSet(guild, channels, CLASS_CHANNELS)
+        targets = [channel for channel in map(guild.get_channel, channel_ids) if channel is not None]
+        if any(rule.target == overwrites.PAIRED for rule in rules):
+            pairs, unpaired = overwrites.pairChannels(targets, guild.roles, pairing)
+            if unpaired:
+                await interaction.followup.send(f"{len(unpaired)} channels have no matching role and are skipped: {', '.join(unpaired[:20])}"[:2000])
+        else:
+            pairs = [(channel, None) for channel in targets]
+    if missing:
+        await interaction.followup.send(f"Not found: {', '.join(missing[:20])}"[:2000])
+    if not pairs:
+        await interaction.followup.send("No channels to apply the template to.")
+        return
+
+    plan, unknown = reorg.compileOverwrites(guild, pairs, rules)
+    if unknown:
+        await interaction.followup.send(f"Template roles not found, their rules are skipped: {', '.join(unknown)}"[:2000])
+    await run_plan(interaction, plan, dry_run, f"Updating overwrites on {len(pairs)} channels", "Permission template applied")
+    if dry_run and len(plan.operations) > plans.PREVIEW_LINES:
+        await export.sendExport(interaction, "Every overwrite that would change:", [[operation.label] for operation in plan.operations], "permissions_diff")
+
+
+# /snapshot
+@tree.command(name="snapshot", description="Save the server's roles, categories, channels, overwrites and role members to a file.")
+@app_commands.default_permissions(manage_guild=True)
+@metrics.timed
+async def snapshot(interaction: discord.Interaction):
+    guild = interaction.guild
+
+    # Check if the command is run in a guild
+    if guild is None:
+        await interaction.response.send_message("This command can only be used in a server (guild).", ephemeral=True)
+        return
+
+    await interaction.response.defer()
+    await gateway.ensureMembers(guild)  # Each role lists its members
+    state = archive.capture(guild)
+    raw = archive.encode(state)
+    if len(raw) > guild.filesize_limit:
+        await interaction.followup.send(f"The snapshot is {len(raw) // 1024} KB, over this server's upload limit.")
+        return
+    await interaction.followup.send(
+        f"Snapshot of {archive.summary(state)}. Upload it to `/restore` to rebuild this structure.",
+        file=discord.File(io.BytesIO(raw), filename=archive.filename(guild))
+    )
+
+
+# /restore <file> [dry_run]
+@tree.command(name="restore", description="Rebuild the server's structure from a /snapshot file, creating or fixing what differs.")
+@app_commands.default_permissions(manage_guild=True)
+@app_commands.describe(
+    file="A snapshot file from /snapshot.",
+    dry_run="Preview the changes without applying them."
+)
+@metrics.timed
+async def restore(interaction: discord.Interaction, file: discord.Attachment, dry_run: bool = False):
+    guild = interaction.guild
+
+    # Check if the command is run in a guild
+    if guild is None:
+        await interaction.response.send_message("This command can only be used in a server (guild).", ephemeral=True)
+        return
+
+    await interaction.response.defer()
+    try:
+        state = archive.decode(await file.read())
+    except archive.ArchiveError as e:
+        await interaction.followup.send(str(e)[:2000])
+        return
+    await gateway.ensureMembers(guild)
+    plan, notes = reorg.compileRestore(guild, state)
+    if notes:
+        await interaction.followup.send(f"Not restored:\n{ingest.errorReport(notes)}"[:2000])
+    await run_plan(interaction, plan, dry_run, f"Restoring snapshot of {state.get('name', 'a server')}", "Snapshot restored")
+
+
+# /resume [planID:int]
+@tree.command(name="resume", description="Continue a dry-run or interrupted reorganization plan.")
+@app_commands.default_permissions(manage_guild=True)
+@app_commands.describe(plan_id="The plan to resume (defaults to the latest unfinished plan).")
+@metrics.timed
+async def resume(interaction: discord.Interaction, plan_id: int = None):
+    guild = interaction.guild
+
+    # Check if the command is run in a guild
+    if guild is None:
+        await interaction.response.send_message("This command can only be used in a server (guild).", ephemeral=True)
+        return
+
+    journal = plans.journal()
+    plan = journal.load(plan_id) if plan_id is not None else journal.latestResumable(guild.id)
+    if plan is None or plan.guildId != guild.id:
+        await interaction.response.send_message("No plan to resume.", ephemeral=True)
+        return
+    busy = plans.isRunning(plan) or jobqueue.contains(guild.id, ('plan', plan.id))
+    if plan.status not in plans.RESUMABLE or busy:
+        await interaction.response.send_message(f"Plan #{plan.id} is {'running' if busy else plan.status} and cannot be resumed.", ephemeral=True)
+        return
+
+    # Defer the interaction to give more time for processing
+    await interaction.response.defer()
+    pending = plan.pending()
+    if any(operation.kind == "member_roles" for operation in pending):
+        # After a restart the guild is unchunked, member edits would each fetch their member first
+        await gateway.ensureMembers(guild)
+    remaining = len(pending)
+    job = start_plan(plan, guild, interaction.channel, f"Resuming /{plan.command}", f"/{plan.command} plan resumed")
+    await interaction.followup.send(job_started(job, f"Resuming /{plan.command} plan #{plan.id} ({remaining} of {len(plan.operations)} operations left)"))
+
+
+# Every per-course channel, used by /send and as the 'class' channel set
+CLASS_CHANNELS = [
+    'ecs-2390✎ryan',
+    'cs-3162✎cole',
+    'cs-3162✎srivastava',
+    'cs-3345✎all',
+    'cs-3354✎narayanasami',
+    'cs-3354✎paulk',
+    'cs-3377✎all',
+    'cs-4141✎becker',
+    'cs-4337✎davis',
+    'cs-4341✎degroot',
+    'cs-4341✎hamdy',
+    'cs-4347✎omer',
+    'cs-4348✎gupta',
+    'cs-4349✎darbari',
+    'cs-4365✎all',
+    'cs-4384✎all',
+    'cs-4390✎all',
+    'math-2418✎all',
+    'cs-3334✎cankaya',
+    'cs-3345✎erbatur',
+    'cs-3345✎hamdy',
+    'cs-3354✎maweu',
+    'cs-3377✎belkoura',
+    'cs-3377✎satpute',
+    'cs-4341✎wang',
+    'cs-4347✎cankaya',
+    'cs-4347✎solanki',
+    'cs-4348✎kim-khah-mukherjee',
+    'cs-4348✎salazar',
+    'cs-4349✎chitturi',
+    'cs-4349✎erbatur',
+    'cs-4365✎guo',
+    'cs-4365✎nguyen-chung-ng',
+    'cs-4375✎yang',
+    'cs-4384✎huynh',
+    'cs-4384✎ntafos',
+    'cs-4390✎ding',
+    'cs-4390✎haas-saadatfar',
+    'cs-4392✎feng',
+    'cs-4485✎razo',
+    'ecs-2390✎montgomery',
+    'govt-2305✎all'
+]
+
 # Define the /send slash command
-@tree.command(name="send", description="Send a literal string to a specific channel")
-@app_commands.describe(channel_id="The ID of the channel to send the message to", message="The message to send (leave blank for a default message)")
-async def send(interaction: discord.Interaction, channel_id: str, message: str = None):
-    
-    class_channel_mapping = {
-        'ecs-2390✎ryan': 0,
-        'cs-3162✎cole': 0,
-        'cs-3162✎srivastava': 0,
-        'cs-3345✎all': 0,
-        'cs-3354✎narayanasami': 0,
-        'cs-3354✎paulk': 0,
-        'cs-3377✎all': 0,
-        'cs-4141✎becker': 0,
-        'cs-4337✎davis': 0,
-        'cs-4341✎degroot': 0,
-        'cs-4341✎hamdy': 0,
-        'cs-4347✎omer': 0,
-        'cs-4348✎gupta': 0,
-        'cs-4349✎darbari': 0,
-        'cs-4365✎all': 0,
-        'cs-4384✎all': 0,
-        'cs-4390✎all': 0,
-        'math-2418✎all': 0,
-        'cs-3334✎cankaya': 0,
-        'cs-3345✎erbatur': 0,
-        'cs-3345✎hamdy': 0,
-        'cs-3354✎maweu': 0,
-        'cs-3377✎belkoura': 0,
-        'cs-3377✎satpute': 0,
-        'cs-4341✎wang': 0,
-        'cs-4347✎cankaya': 0,
-        'cs-4347✎solanki': 0,
-        'cs-4348✎kim-khah-mukherjee': 0,
-        'cs-4348✎salazar': 0,
-        'cs-4349✎chitturi': 0,
-        'cs-4349✎erbatur': 0,
-        'cs-4365✎guo': 0,
-        'cs-4365✎nguyen-chung-ng': 0,
-        'cs-4375✎yang': 0,
-        'cs-4384✎huynh': 0,
-        'cs-4384✎ntafos': 0,
-        'cs-4390✎ding': 0,
-        'cs-4390✎haas-saadatfar': 0,
-        'cs-4392✎feng': 0,
-        'cs-4485✎razo': 0,
-        'ecs-2390✎montgomery': 0,
-        'govt-2305✎all': 0
-    }
-    
+@tree.command(name="send", description="Send a literal string to a channel, or broadcast it to a set of channels")
+@app_commands.default_permissions(manage_guild=True)
+@app_commands.describe(
+    channel_id="The ID of the channel to send the message to",
+    message="The message to send (leave blank for a default message)",
+    channels="Broadcast instead: 'class', 'category:<name>', 'pattern:<glob>', or comma-separated channel names.",
+    mapping="Broadcast instead: a file listing one channel name or ID per line."
+)
+@metrics.timed
+async def send(interaction: discord.Interaction, channel_id: str = None, message: str = None, channels: str = None, mapping: discord.Attachment = None):
+
+    # Check if the message is blank, if so, use the default message
+    if not message:
+        message = f"""
+        """
+
+    # Broadcast to a channel set
+    if channels or mapping:
+        if interaction.guild is None:
+            await interaction.response.send_message("This command can only be used in a server (guild).", ephemeral=True)
+            return
+        await interaction.response.defer(ephemeral=True)
+        if mapping:
+            lines = (await mapping.read()).decode("utf-8-sig").splitlines()
+            channel_ids, missing = broadcast.resolveNames(guildcache.forGuild(interaction.guild), [line.split(",")[0].strip() for line in lines])
+        else:
+            channel_ids, missing = broadcast.resolveChannelSet(interaction.guild, channels, CLASS_CHANNELS)
+        if not channel_ids:
+            await interaction.followup.send("No channels found to send to.", ephemeral=True)
+            return
+
+        status = await interaction.followup.send(f"Broadcasting to {len(channel_ids)} channels...", ephemeral=True, wait=True)
+        result = await broadcast.sendToChannels(client, channel_ids, message, onProgress=bulk.throttledProgress(status, "Broadcasting"))
+        report = f"Broadcast finished: {result.summary()} channels."
+        unknown = broadcast.unknownCount(result)
+        if unknown:
+            report += f"\n{unknown} channels did not confirm delivery ('unknown' in the report), check them before sending again."
+        if missing:
+            report += f"\nChannels not found: {', '.join(missing)}"
+        await status.edit(content=report[:2000])
+        await export.sendExport(interaction, "Delivery report:", broadcast.deliveryRows(result), "delivery_report")
+        return
+
+    if channel_id is None:
+        await interaction.response.send_message("Provide a channel_id, or channels/mapping to broadcast.", ephemeral=True)
+        return
+
     # Try to get the channel by its ID
     try:
-        channels = await interaction.guild.fetch_channels()
-        
         output_channel = client.get_channel(int(channel_id))
         if output_channel is None:
             await interaction.response.send_message("Channel not found.", ephemeral=True)
             return
 
-        # Map each class/professor name to the corresponding channel ID
-        for class_name in class_channel_mapping.keys():
-            for channel in channels:
-                if channel.name == class_name:
-                    class_channel_mapping[class_name] = channel.id
-                    break  # Stop searching once a match is found
-
-        # Check if the message is blank, if so, use the default message
-        if not message:
-            message = f"""
-            """
-
         # Send the message to the specified channel
         await output_channel.send(message)
         await interaction.response.send_message(f"Message sent to <#{channel_id}>", ephemeral=True)
@@ -446,16 +841,257 @@ async def send(interaction: discord.Interaction, channel_id: str, message: str =
         await interaction.response.send_message(f"An error occurred: {e}", ephemeral=True)
 
 
+# /schedule <time:string> <channels:string> <message:string> [repeat]
+@tree.command(name="schedule", description="Schedule a message to one or many channels.")
+@app_commands.default_permissions(manage_guild=True)
+@app_commands.describe(
+    time="When to send, e.g. '9am', '14:30', 'mon 9am', '2024-09-01 9am' or 'in 30m'.",
+    channels="'class', 'category:<name>', 'pattern:<glob>', or comma-separated channel names or mentions.",
+    message="The message to send.",
+    repeat="'none', 'hourly', 'daily' or 'weekly'."
+)
+@metrics.timed
+async def schedule(interaction: discord.Interaction, time: str, channels: str, message: str, repeat: str = "none"):
+    guild = interaction.guild
+
+    # Check if the command is run in a guild
+    if guild is None:
+        await interaction.response.send_message("This command can only be used in a server (guild).", ephemeral=True)
+        return
+    if repeat not in scheduler.REPEATS:
+        await interaction.response.send_message("Invalid repeat. Use 'none', 'hourly', 'daily' or 'weekly'.", ephemeral=True)
+        return
+
+    try:
+        send_time = utils.parseTimeString(datetime.now(), time)
+    except ValueError as e:
+        await interaction.response.send_message(str(e), ephemeral=True)
+        return
+
+    channel_ids, missing = broadcast.resolveChannelSet(guild, channels, CLASS_CHANNELS)
+    if not channel_ids:
+        await interaction.response.send_message("No channels found to send to.", ephemeral=True)
+        return
+
+    job_id = scheduler.start(client).schedule(guild.id, channel_ids, message, send_time.timestamp(), scheduler.REPEATS[repeat])
+    reply = f"Scheduled message #{job_id} to {len(channel_ids)} channels for {send_time:%Y-%m-%d %H:%M}" + (f", repeating {repeat}." if repeat != "none" else ".")
+    if missing:
+        reply += f"\nChannels not found: {', '.join(missing)}"
+    await interaction.response.send_message(reply[:2000], ephemeral=True)
+
+# /scheduled
+@tree.command(name="scheduled", description="List pending scheduled messages.")
+@app_commands.default_permissions(manage_guild=True)
+@metrics.timed
+async def scheduled(interaction: discord.Interaction):
+    if interaction.guild is None:
+        await interaction.response.send_message("This command can only be used in a server (guild).", ephemeral=True)
+        return
+    jobs = scheduler.start(client).pending(interaction.guild.id)
+    if not jobs:
+        await interaction.response.send_message("No scheduled messages.", ephemeral=True)
+        return
+    lines = [
+        f"#{job['id']} {datetime.fromtimestamp(job['due_at']):%Y-%m-%d %H:%M}{' (repeats)' if job['interval_seconds'] else ''}: {job['message'][:50]}"
+        for job in jobs
+    ]
+    await interaction.response.send_message("\n".join(lines)[:2000], ephemeral=True)
+
+# /unschedule <jobID:int>
+@tree.command(name="unschedule", description="Cancel a scheduled message.")
+@app_commands.default_permissions(manage_guild=True)
+@app_commands.describe(job_id="The scheduled message to cancel.")
+@metrics.timed
+async def unschedule(interaction: discord.Interaction, job_id: int):
+    if interaction.guild is None:
+        await interaction.response.send_message("This command can only be used in a server (guild).", ephemeral=True)
+        return
+    if scheduler.start(client).cancel(job_id, interaction.guild.id):
+        await interaction.response.send_message(f"Scheduled message #{job_id} cancelled.", ephemeral=True)
+    else:
+        await interaction.response.send_message(f"No pending scheduled message #{job_id}.", ephemeral=True)
+
+
+# /cache <stats | refresh>
+@tree.command(name="cache", description="Show the local guild cache's staleness or force a refresh.")
+@app_commands.default_permissions(manage_guild=True)
+@app_commands.describe(action="'stats' or 'refresh'")
+@metrics.timed
+async def cache(interaction: discord.Interaction, action: str = "stats"):
+    guild = interaction.guild
+
+    # Check if the command is run in a guild
+    if guild is None:
+        await interaction.response.send_message("This command can only be used in a server (guild).", ephemeral=True)
+        return
+
+    if action == "refresh":
+        # Re-chunk the member list so membership edges are current too
+        await interaction.response.defer(ephemeral=True)
+        await guild.chunk()
+        memberindex.syncGuild(guild)
+        changed = guildcache.syncGuild(guild)
+        await interaction.followup.send(f"Guild cache refreshed, {changed} rows changed.", ephemeral=True)
+    elif action == "stats":
+        stats = guildcache.forGuild(guild).stats()
+        await interaction.response.send_message("\n".join(f"{key}: {value}" for key, value in stats.items()), ephemeral=True)
+    else:
+        await interaction.response.send_message("Invalid action. Use 'stats' or 'refresh'.", ephemeral=True)
+
+
+# /roster [file] [existing]
+@tree.command(name="roster", description="Upload the student roster used to give course roles to joining members.")
+@app_commands.default_permissions(manage_roles=True)
+@app_commands.describe(
+    file="A CSV, TSV or XLSX file: student ID, first name, last name, Discord ID or username, then one course role per column. Omit to show the current roster.",
+    existing="Also give course roles to roster members already in the server."
+)
+@metrics.timed
+async def roster_upload(interaction: discord.Interaction, file: discord.Attachment = None, existing: bool = False):
+    guild = interaction.guild
+
+    # Check if the command is run in a guild
+    if guild is None:
+        await interaction.response.send_message("This command can only be used in a server (guild).", ephemeral=True)
+        return
+
+    if file is None:
+        current = roster.forGuild(guild.id)
+        if current is None:
+            await interaction.response.send_message("No roster uploaded yet.", ephemeral=True)
+        else:
+            await interaction.response.send_message("\n".join(f"{key}: {value}" for key, value in current.stats().items()), ephemeral=True)
+        return
+
+    await interaction.response.defer()
+    entries = await read_input(interaction, None, file, ingest.parseRoster)
+    if entries is None:
+        return
+    current, notes = roster.replace(guild.id, entries)
+    stats = current.stats()
+    reply = f"Roster loaded: {stats['students']} students ({stats['linked']} linked to Discord accounts), {stats['courses']} courses."
+    missing = sorted(name for name in current.courseNames if discord.utils.get(guild.roles, name=name) is None)
+    if missing:
+        reply += f"\nCourse roles not found in this server: {', '.join(missing[:20])}" + (f" and {len(missing) - 20} more" if len(missing) > 20 else "")
+    if existing:
+        # Every current member may need roles, which takes a while in a large server, so it runs as a job
+        async def onboard_existing(job: jobqueue.Job):
+            await gateway.ensureMembers(guild)
+            return await onboarding.assign(guild, guild.members, onProgress=job.progress)
+
+        job = jobqueue.submit(
+            guild.id, "Roster onboarding of existing members", onboard_existing, key=('roster', guild.id), channel=interaction.channel,
+            report=lambda result: f"Roster onboarding of existing members: {result.summary()} role edits."
+        )
+        reply += "\n" + job_started(job, "Onboarding existing members")
+    if notes:
+        reply += f"\nLinks not kept:\n{ingest.errorReport(notes)}"
+    await interaction.followup.send(reply[:2000])
+
+
+# /verify <student_id>
+@tree.command(name="verify", description="Link your account to your student ID and receive your course roles.")
+@app_commands.describe(student_id="Your student ID as it appears on the roster.")
+@metrics.timed
+async def verify(interaction: discord.Interaction, student_id: str):
+    if interaction.guild is None:
+        await interaction.response.send_message("This command can only be used in a server (guild).", ephemeral=True)
+        return
+    await interaction.response.defer(ephemeral=True)
+    try:
+        assignment = await onboarding.verify(interaction.user, student_id)
+    except ValueError as e:
+        await interaction.followup.send(str(e), ephemeral=True)
+        return
+    except discord.HTTPException as e:
+        await interaction.followup.send(f"Verified, but the course roles could not be assigned: {e}", ephemeral=True)
+        return
+    if assignment is None:
+        await interaction.followup.send("That student ID is not on this server's roster.", ephemeral=True)
+        return
+    reply = f"Verified as {assignment.member.display_name}, added {len(assignment.roles)} course roles."
+    if assignment.missing:
+        reply += f" Not set up yet: {', '.join(assignment.missing)}."
+    await interaction.followup.send(reply[:2000], ephemeral=True)
+
+
+# /jobs
+@tree.command(name="jobs", description="List this server's running, queued and recently finished background jobs.")
+@app_commands.default_permissions(manage_guild=True)
+@metrics.timed
+async def jobs(interaction: discord.Interaction):
+    if interaction.guild is None:
+        await interaction.response.send_message("This command can only be used in a server (guild).", ephemeral=True)
+        return
+    listed = jobqueue.jobs(interaction.guild.id)
+    if not listed:
+        await interaction.response.send_message("No background jobs.", ephemeral=True)
+        return
+    await interaction.response.send_message("\n".join(job.describe() for job in listed[:20])[:2000], ephemeral=True)
+
+
+# /cancel <job_id>
+@tree.command(name="cancel", description="Stop a queued or running background job.")
+@app_commands.default_permissions(manage_guild=True)
+@app_commands.describe(job_id="The job to stop, as shown by /jobs.")
+@metrics.timed
+async def cancel(interaction: discord.Interaction, job_id: int):
+    if interaction.guild is None:
+        await interaction.response.send_message("This command can only be used in a server (guild).", ephemeral=True)
+        return
+    job = next((job for job in jobqueue.jobs(interaction.guild.id) if job.id == job_id), None)
+    if job is None or not jobqueue.cancel(interaction.guild.id, job_id):
+        await interaction.response.send_message(f"Job #{job_id} is not queued or running.", ephemeral=True)
+        return
+    reply = f"Cancelling job #{job_id} {job.label}."
+    if job.key is not None and job.key[0] == 'plan':
+        reply += f" Operations already applied stay applied, `/resume {job.key[1]}` continues the plan."
+    await interaction.response.send_message(reply)
+
+
+# /stats
+@tree.command(name="stats", description="Show per-command and per-route latency and rate-limit statistics.")
+@app_commands.default_permissions(manage_guild=True)
+@metrics.timed
+async def stats(interaction: discord.Interaction):
+    await interaction.response.send_message(metrics.summary()[:2000], ephemeral=True)
+
+
+# /shards
+@tree.command(name="shards", description="Show the health of every shard this bot process runs.")
+@app_commands.default_permissions(manage_guild=True)
+@metrics.timed
+async def shards_status(interaction: discord.Interaction):
+    await interaction.response.send_message(shards.summary(client)[:2000], ephemeral=True)
+
+
 # /help command
 @tree.command(name="help", description="Provides help information about the bot's commands.")
+@metrics.timed
 async def help(interaction: discord.Interaction):
     help_text = """
     **Bot Commands:**
-    - `/get <channel | role> <category:string | contains:string>`: Get channels or roles based on a category or name pattern.
-    - `/rename <messageID:int>`: Rename channels and roles based on message content.
+    - `/get <channel | role | members | changes> <filter> <value>`: Export channels, roles or members as CSV, or what changed since a snapshot.
+    - `/addrole <role> <member>`: Add a role to a member.
+    - `/role`, `/assign`, `/rename`: Reorder roles, assign roles to members or rename channels and roles from a message or an uploaded file.
+    - `/channel <category>`: Reorganize or create channels in a category from a message or an uploaded file.
+    - `/permissions <template>`: Apply a permission overwrite template to channels and their paired roles.
+    - `/snapshot`, `/restore <file>`: Save the server's structure to a file and rebuild it from one.
+    - `/resume [plan_id]`: Continue a dry-run or interrupted plan. Plan commands accept `dry_run` to preview first.
+    - `/send`: Send a message to a channel, or broadcast it to a set of channels.
+    - `/schedule <time> <channels> <message>`, `/scheduled`, `/unschedule <job_id>`: Schedule, list and cancel messages.
+    - `/roster [file]`: Upload the student roster used to give course roles.
+    - `/verify <student_id>`: Link your account to your student ID and receive your course roles.
+    - `/jobs`, `/cancel <job_id>`: List and stop background jobs.
+    - `/cache`, `/stats`, `/shards`: Guild cache, latency and shard health.
     - `/help`: Display this help message.
     """
     await interaction.response.send_message(help_text)
 
 # Run the bot
-client.run(TOKEN)
+def run_bot():
+    client.run(TOKEN)
+
+
+if __name__ == '__main__':
+    run_bot()
@@ -0,0 +1,78 @@
+import fnmatch
+import discord
+import bulk
+import guildcache
+
+# Sending one message to many channels. Channel sets are resolved against the guild cache in a
+# single pass, and every send gets its own per-channel rate-limit bucket so they go out concurrently.
+
+# Channel set specs:
+#   class                 every channel in the class list
+#   category:<name>       every text channel in a category
+#   pattern:<glob>        every text channel whose name matches, e.g. pattern:cs-43*
+#   a, b, <#123>          comma-separated channel names or mentions
+def resolveChannelSet(guild:discord.Guild, spec:str, classChannels:list):
+    snapshot = guildcache.forGuild(guild)
+    spec = spec.strip()
+    if spec.startswith("category:") or spec.startswith("pattern:"):
+        kind, _, value = spec.partition(":")
+        value = value.strip()
+        categoryId = snapshot.channelIdsByName("category").get(value) if kind == "category" else None
+        if kind == "category" and categoryId is None:
+            return [], [value]
+        resolved = [
+            channelId for channelId, (name, channelKind, parentId, position) in sorted(snapshot.channels.items(), key=lambda item: item[1][3])
+            if channelKind == "text" and (parentId == categoryId if kind == "category" else fnmatch.fnmatchcase(name, value))
+        ]
+        return resolved, []
+    names = classChannels if spec == "class" else [name.strip() for name in spec.split(",")]
+    return resolveNames(snapshot, names)
+
+
+# Channel names, mentions or IDs, e.g. the first column of an uploaded mapping file
+def resolveNames(snapshot:guildcache.GuildSnapshot, names):
+    channelIds = snapshot.channelIdsByName()
+    resolved, missing = [], []
+    for name in names:
+        if not name:
+            continue
+        if name.startswith("<#") and name.endswith(">"):
+            name = name[2:-1]
+        if name.isdigit() and int(name) in snapshot.channels:
+            resolved.append(int(name))
+        elif name in channelIds:
+            resolved.append(channelIds[name])
+        else:
+            missing.append(name)
+    return list(dict.fromkeys(resolved)), missing
+
+
+# Send the message to every channel concurrently. Only rate limits and errors where Discord did not
+# handle the request are retried, a send that timed out may have been posted and is reported as
+# bulk.UnknownOutcome instead. Succeeded entries are (channel ID, discord.Message), failed ones (channel ID, error).
+async def sendToChannels(client:discord.Client, channelIds:list, message:str, onProgress=None):
+    operations = []
+    for channelId in channelIds:
+        channel = client.get_channel(channelId)
+        if channel is None:
+            operations.append(bulk.BulkOperation(channelId, f"channel:{channelId}", _missing))
+        else:
+            operations.append(bulk.BulkOperation(channelId, f"channel:{channelId}", lambda channel=channel: channel.send(message), repeatable=False))
+    return await bulk.runBulk(operations, onProgress=onProgress)
+
+
+async def _missing():
+    raise LookupError("channel not found")
+
+
+# Delivery report rows for export.sendExport
+def deliveryRows(result:bulk.BulkResult):
+    for channelId, message in result.succeeded:
+        yield [channelId, "sent", message.id, message.jump_url]
+    for channelId, error in result.failed:
+        yield [channelId, "unknown" if isinstance(error, bulk.UnknownOutcome) else "failed", "", str(error)]
+
+
+# Channels that may or may not have received the message
+def unknownCount(result:bulk.BulkResult):
+    return sum(isinstance(error, bulk.UnknownOutcome) for _, error in result.failed)
@@ -0,0 +1,193 @@
+import asyncio
+import time
+import discord
+
+# Discord rate-limits every route per bucket (e.g. all member edits in one guild share a bucket).
+# discord.py already waits out exhausted buckets, so we only keep a few requests in flight per
+# bucket and pause the whole bucket if a 429 still makes it back to us.
+DEFAULT_CONCURRENCY = 8
+BUCKET_CONCURRENCY = 4
+MAX_RETRIES = 3
+UNHANDLED_STATUSES = {502, 503}  # Answered before the API handled the request, nothing took effect
+PROGRESS_INTERVAL = 5  # seconds between progress message edits
+
+
+class BulkOperation:
+    def __init__(self, label:str, bucket:str, action, repeatable:bool=True):
+        self.label = label
+        self.bucket = bucket
+        self.action = action  # Zero-argument coroutine function performing the request
+        self.repeatable = repeatable  # False when sending the request twice does it twice (e.g. posting a message)
+
+
+# Failure of an operation that is not repeatable and may still have taken effect (a timeout, dropped
+# connection or server error), reported instead of retried so nothing is done twice
+class UnknownOutcome(Exception):
+    def __init__(self, error:Exception):
+        super().__init__(f"outcome unknown, not retried: {error!r}")
+        self.error = error
+
+
+class BulkResult:
+    def __init__(self, total:int):
+        self.total = total
+        self.succeeded = []  # (label, return value)
+        self.failed = []  # (label, exception)
+
+    @property
+    def done(self):
+        return len(self.succeeded) + len(self.failed)
+
+    def summary(self):
+        return f"{len(self.succeeded)} succeeded, {len(self.failed)} failed out of {self.total}"
+
+    def failureReport(self, limit:int=10):
+        lines = [f"- {label}: {error}" for label, error in self.failed[:limit]]
+        if len(self.failed) > limit:
+            lines.append(f"- ...and {len(self.failed) - limit} more")
+        return "\n".join(lines)
+
+
+class _Bucket:
+    def __init__(self, concurrency:int):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.resumeAt = 0.0
+
+    async def wait(self):
+        delay = self.resumeAt - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def pause(self, seconds:float):
+        self.resumeAt = max(self.resumeAt, time.monotonic() + seconds)
+
+
+def _retryAfter(error:discord.HTTPException, attempt:int):
+    try:
+        return float(error.response.headers.get('Retry-After'))
+    except (AttributeError, TypeError, ValueError):
+        return 2 ** attempt
+
+
+# Run the operations through a bounded worker pool, limiting how many share a bucket at once
+# Pass an existing result to accumulate several runs (e.g. plan phases) into one tally
+async def runBulk(operations, concurrency:int=DEFAULT_CONCURRENCY, bucketConcurrency:int=BUCKET_CONCURRENCY, onProgress=None, result:BulkResult=None):
+    if result is None:
+        result = BulkResult(len(operations))
+    buckets = {}
+    queue = asyncio.Queue()
+    for operation in operations:
+        queue.put_nowait(operation)
+
+    async def execute(operation:BulkOperation):
+        bucket = buckets.setdefault(operation.bucket, _Bucket(bucketConcurrency))
+        async with bucket.semaphore:
+            for attempt in range(MAX_RETRIES + 1):
+                await bucket.wait()
+                try:
+                    value = await operation.action()
+                except discord.HTTPException as e:
+                    if e.status == 429 and attempt < MAX_RETRIES:
+                        bucket.pause(_retryAfter(e, attempt))
+                        continue
+                    if e.status >= 500 and not operation.repeatable and e.status not in UNHANDLED_STATUSES:
+                        result.failed.append((operation.label, UnknownOutcome(e)))
+                    elif e.status >= 500 and attempt < MAX_RETRIES:
+                        await asyncio.sleep(2 ** attempt)  # Transient server error, back off and retry
+                        continue
+                    else:
+                        result.failed.append((operation.label, e))
+                except (OSError, asyncio.TimeoutError) as e:
+                    if not operation.repeatable:
+                        result.failed.append((operation.label, UnknownOutcome(e)))
+                    elif attempt < MAX_RETRIES:
+                        await asyncio.sleep(2 ** attempt)  # Connection dropped or timed out
+                        continue
+                    else:
+                        result.failed.append((operation.label, e))
+                except Exception as e:
+                    result.failed.append((operation.label, e))
+                else:
+                    result.succeeded.append((operation.label, value))
+                return
+
+    async def worker():
+        while not queue.empty():
+            operation = queue.get_nowait()
+            await execute(operation)
+            if onProgress is not None:
+                await onProgress(result)
+
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, queue.qsize()))))
+    return result
+
+
+# Returns an onProgress callback that edits a status message at most once per interval
+def throttledProgress(message, title:str, interval:float=PROGRESS_INTERVAL):
+    lastEdit = time.monotonic()
+
+    async def onProgress(result:BulkResult):
+        nonlocal lastEdit
+        now = time.monotonic()
+        if now - lastEdit < interval and result.done < result.total:
+            return
+        lastEdit = now
+        try:
+            await message.edit(content=f"{title}: {result.done}/{result.total} ({len(result.failed)} failed)")
+        except discord.HTTPException:
+            pass  # Progress is best-effort, never fail the job over it
+
+    return onProgress
+
+
+# Compute which roles each member gains and loses so that every role holds exactly its desired members
+def planRoleDiff(desired:dict):
+    changes = {}
+    for role, members in desired.items():
+        for member in role.members:
+            if member not in members:
+                changes.setdefault(member, (set(), set()))[1].add(role)
+        for member in members:
+            if role not in member.roles:
+                changes.setdefault(member, (set(), set()))[0].add(role)
+    return changes
+
+
+# The complete role list for a member after applying its diff, for a single member.edit(roles=...)
+def mergeRoles(member:discord.Member, toAdd:set, toRemove:set):
+    roles = [role for role in member.roles if not role.is_default() and role not in toRemove]
+    roles.extend(role for role in toAdd if role not in roles)
+    return roles
+
+
+# Role positions that put the listed roles at the bottom of the hierarchy in the given order, followed
+# by every other role in its current order. The hierarchy keeps the position slots it already occupies,
+# so only roles that actually move are returned, ready for a single guild.edit_role_positions.
+def planRolePositions(hierarchy:list, listed:list):
+    current = sorted(hierarchy, key=lambda role: (role.position, role.id))
+    slots = [role.position for role in current]
+    if len(set(slots)) != len(slots):
+        slots = list(range(1, len(current) + 1))  # Ties (e.g. freshly created roles), renumber everything
+    listedSet = set(listed)
+    ordered = list(listed) + [role for role in current if role not in listedSet]
+    return {role: slot for role, slot in zip(ordered, slots) if role.position != slot}
+
+
+# Position payload that gives the ordered channels consecutive positions, skipping those already in place
+def planChannelPositions(ordered:list):
+    if not ordered:
+        return []
+    base = min(channel.position for channel in ordered)
+    return [
+        {'id': channel.id, 'position': base + index}
+        for index, channel in enumerate(ordered)
+        if channel.position != base + index
+    ]
+
+
+# Apply a whole channel ordering with a single bulk position PATCH, returns how many channels moved
+async def editChannelPositions(guild:discord.Guild, ordered:list, reason:str=None):
+    payload = planChannelPositions(ordered)
+    if payload:
+        await guild._state.http.bulk_channel_update(guild.id, payload, reason=reason)
+    return len(payload)
@@ -0,0 +1,171 @@
+import bisect
+import json
+import time
+import zlib
+import guildcache
+import storage
+
+# Versioned structure snapshots for /get changes. Each export stores the guild's channels, roles and
+# membership edges (taken from the guild cache) as a compressed version, and later exports only list
+# what changed since a stored version. The change list doubles as a patch that /assign and /rename
+# apply directly, so a few edits never mean re-diffing every member.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS export_versions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    guild_id INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS export_versions_guild ON export_versions (guild_id, id);
+"""
+
+KEEP_VERSIONS = 20  # Versions kept per guild, older ones are pruned
+PATCH_HEADER = ["kind", "change", "id", "name", "target", "position"]
+KINDS = ("category", "channel", "role", "member")
+CHANGES = ("added", "removed", "renamed", "moved")
+
+
+class Version:
+    def __init__(self, versionId:int, createdAt:float, state:dict):
+        self.id = versionId
+        self.createdAt = createdAt
+        self.state = state
+
+
+# The parts of a guild a patch can describe:
+#   channels: id -> [name, kind, category id, position]    roles: id -> [name, position]
+#   members: id -> username                                 edges: member id -> sorted role ids
+def capture(snapshot:guildcache.GuildSnapshot):
+    return {
+        'channels': {channelId: list(row) for channelId, row in snapshot.channels.items()},
+        'roles': {roleId: [name, position] for roleId, (name, position, _) in snapshot.roles.items() if roleId != snapshot.guildId},
+        'members': {memberId: name for memberId, (name,) in snapshot.members.items()},
+        'edges': {memberId: sorted(roleIds) for memberId, roleIds in snapshot.memberRoles.items() if roleIds},
+    }
+
+
+def _encode(state:dict):
+    return zlib.compress(json.dumps(state, separators=(",", ":")).encode())
+
+
+def _decode(data:bytes):
+    state = json.loads(zlib.decompress(data))
+    return {table: {int(key): value for key, value in rows.items()} for table, rows in state.items()}
+
+
+def save(guildId:int, state:dict):
+    db = storage.ensureSchema(SCHEMA)
+    cursor = db.execute("INSERT INTO export_versions (guild_id, created_at, data) VALUES (?, ?, ?)", (guildId, time.time(), _encode(state)))
+    db.execute(
+        "DELETE FROM export_versions WHERE guild_id = ? AND id NOT IN (SELECT id FROM export_versions WHERE guild_id = ? ORDER BY id DESC LIMIT ?)",
+        (guildId, guildId, KEEP_VERSIONS)
+    )
+    db.commit()
+    return cursor.lastrowid
+
+
+# A stored version of the guild, the latest one when versionId is None
+def load(guildId:int, versionId:int=None):
+    db = storage.ensureSchema(SCHEMA)
+    if versionId is None:
+        row = db.execute("SELECT * FROM export_versions WHERE guild_id = ? ORDER BY id DESC LIMIT 1", (guildId,)).fetchone()
+    else:
+        row = db.execute("SELECT * FROM export_versions WHERE guild_id = ? AND id = ?", (guildId, versionId)).fetchone()
+    return Version(row['id'], row['created_at'], _decode(row['data'])) if row else None
+
+
+# Items whose relative order changed: everything outside the longest run that kept its order
+def _reordered(before:dict, after:dict):
+    common = [key for key in sorted(after, key=lambda key: (after[key], key)) if key in before]
+    ranks = {key: rank for rank, key in enumerate(sorted(common, key=lambda key: (before[key], key)))}
+    tails, tailKeys, parents = [], [], {}
+    for key in common:
+        rank = ranks[key]
+        index = bisect.bisect_left(tails, rank)
+        parents[key] = tailKeys[index - 1] if index else None
+        if index == len(tails):
+            tails.append(rank)
+            tailKeys.append(key)
+        else:
+            tails[index] = rank
+            tailKeys[index] = key
+    kept = set()
+    key = tailKeys[-1] if tailKeys else None
+    while key is not None:
+        kept.add(key)
+        key = parents[key]
+    return {key for key in common if key not in kept}
+
+
+# Patch rows (PATCH_HEADER columns) turning the old state into the new one
+def diff(old:dict, new:dict):
+    rows = []
+
+    def categoryName(state:dict, categoryId):
+        category = state['channels'].get(categoryId)
+        return category[0] if category else ""
+
+    oldChannels, newChannels = old['channels'], new['channels']
+    # Channels are ordered within their category, only compare channels that stayed in it
+    after, before = {}, {}
+    for channelId, row in newChannels.items():
+        after.setdefault(row[2], {})[channelId] = row[3]
+        previous = oldChannels.get(channelId)
+        if previous is not None and previous[2] == row[2]:
+            before.setdefault(row[2], {})[channelId] = previous[3]
+    moved = set()
+    for categoryId, siblings in after.items():
+        moved |= _reordered(before.get(categoryId, {}), siblings)
+    for channelId, (name, kind, categoryId, position) in sorted(newChannels.items(), key=lambda item: item[1][3]):
+        rowKind = "category" if kind == "category" else "channel"
+        previous = oldChannels.get(channelId)
+        if previous is None:
+            rows.append([rowKind, "added", channelId, name, categoryName(new, categoryId), position])
+            continue
+        if previous[0] != name:
+            rows.append([rowKind, "renamed", channelId, name, previous[0], ""])
+        if previous[2] != categoryId or channelId in moved:
+            rows.append([rowKind, "moved", channelId, name, categoryName(new, categoryId), position])
+    for channelId, (name, kind, _, _) in oldChannels.items():
+        if channelId not in newChannels:
+            rows.append(["category" if kind == "category" else "channel", "removed", channelId, name, "", ""])
+
+    oldRoles, newRoles = old['roles'], new['roles']
+    moved = _reordered({roleId: row[1] for roleId, row in oldRoles.items()}, {roleId: row[1] for roleId, row in newRoles.items()})
+    for roleId, (name, position) in sorted(newRoles.items(), key=lambda item: item[1][1]):
+        previous = oldRoles.get(roleId)
+        if previous is None:
+            rows.append(["role", "added", roleId, name, "", position])
+            continue
+        if previous[0] != name:
+            rows.append(["role", "renamed", roleId, name, previous[0], ""])
+        if roleId in moved:
+            rows.append(["role", "moved", roleId, name, "", position])
+    for roleId, (name, _) in oldRoles.items():
+        if roleId not in newRoles:
+            rows.append(["role", "removed", roleId, name, "", ""])
+
+    # Membership edges, role names as they are in the new state so the patch applies after renames
+    def roleName(roleId:int):
+        role = newRoles.get(roleId) or oldRoles.get(roleId)
+        return role[0] if role else str(roleId)
+
+    oldEdges, newEdges = old['edges'], new['edges']
+    for memberId in sorted(oldEdges.keys() | newEdges.keys()):
+        had, has = set(oldEdges.get(memberId, ())), set(newEdges.get(memberId, ()))
+        if had == has:
+            continue
+        name = new['members'].get(memberId) or old['members'].get(memberId, "")
+        rows += [["member", "added", memberId, name, roleName(roleId), ""] for roleId in sorted(has - had)]
+        rows += [["member", "removed", memberId, name, roleName(roleId), ""] for roleId in sorted(had - has)]
+    return rows
+
+
+def patchJson(guildId:int, base:Version, versionId:int, rows:list):
+    return json.dumps({
+        'guild': guildId,
+        'base': base.id,
+        'version': versionId,
+        'changes': [dict(zip(PATCH_HEADER, row)) for row in rows],
+    }, ensure_ascii=False, indent=1).encode()
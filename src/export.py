@@ -0,0 +1,138 @@
+import csv
+import gzip
+import io
+import tempfile
+import zlib
+import discord
+
+# Exports are streamed row by row into spooled temp files (in memory until SPOOL_SIZE, then on disk)
+# and split into several attachments whenever the next row would take a part past the upload limit
+SPOOL_SIZE = 1024 * 1024
+SIZE_MARGIN = 64 * 1024  # Headroom for the gzip header, trailer and deflate block overhead
+MAX_ATTACHMENTS = 10  # Discord allows 10 attachments per message
+
+
+class ExportError(Exception):
+    pass
+
+
+# Row generators, one per /get item type
+def channelRows(channels):
+    for channel in channels:
+        yield [channel.category.name if channel.category else "No Category", channel.name, channel.id]
+
+
+def roleRows(roles):
+    for role in roles:
+        yield [role.name] + [member.name for member in role.members]
+
+
+def memberRows(members):
+    for member in members:
+        yield [member.name, member.id]
+
+
+class _Part:
+    def __init__(self, compress:bool):
+        self.raw = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE, mode='w+b')
+        self.gzip = gzip.GzipFile(fileobj=self.raw, mode='wb') if compress else None
+        self.pending = 0  # Bytes handed to gzip since its last flush, not yet in raw
+        self.rows = 0
+
+    def write(self, line:bytes):
+        if self.gzip is None:
+            self.raw.write(line)
+        else:
+            self.gzip.write(line)
+            self.pending += len(line)
+        self.rows += 1
+
+    # Whether a line of this many bytes still fits under the limit. zlib holds back compressed output,
+    # so raw.tell() alone lags behind; the unflushed bytes are counted uncompressed, and only when that
+    # estimate reaches the limit is gzip sync-flushed to measure exactly (each flush costs some ratio).
+    def fits(self, size:int, limit:int):
+        if self.raw.tell() + self.pending + size > limit and self.pending:
+            self.gzip.flush(zlib.Z_SYNC_FLUSH)
+            self.pending = 0
+        return self.raw.tell() + self.pending + size <= limit
+
+    # Flush everything down to the spooled file and rewind it for reading
+    def finish(self):
+        if self.gzip is not None:
+            self.gzip.close()
+        self.raw.seek(0)
+        return self.raw
+
+
+# Write rows lazily into one or more CSV parts no larger than sizeLimit, returns discord.File objects.
+# Each row is encoded before it is written so a part is closed before the row that would overflow it.
+def exportFiles(rows, filename:str, sizeLimit:int, compress:bool=False):
+    extension = ".csv.gz" if compress else ".csv"
+    partLimit = max(sizeLimit - SIZE_MARGIN, SIZE_MARGIN)
+    buffer = io.StringIO(newline='')
+    writer = csv.writer(buffer)
+    parts = []
+    part = None
+    try:
+        for number, row in enumerate(rows, 1):
+            writer.writerow(row)
+            line = buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+            if len(line) > partLimit:
+                raise ExportError(f"Row {number} of {filename} is {len(line) / 1024 / 1024:.1f} MB, larger than the {sizeLimit / 1024 / 1024:.0f} MB upload limit")
+            if part is None or not part.fits(len(line), partLimit):
+                if part is not None:
+                    parts.append(part.finish())
+                part = _Part(compress)
+            part.write(line)
+    except ExportError:
+        for raw in parts + ([part.raw] if part is not None else []):
+            raw.close()
+        raise
+    if part is not None:
+        parts.append(part.finish())
+
+    if len(parts) == 1:
+        return [discord.File(parts[0], filename=filename + extension)]
+    return [discord.File(raw, filename=f"{filename}-{index + 1}{extension}") for index, raw in enumerate(parts)]
+
+
+def _size(file:discord.File):
+    size = file.fp.seek(0, io.SEEK_END)
+    file.fp.seek(0)
+    return size
+
+
+# Group files into messages of up to MAX_ATTACHMENTS files whose combined size stays within the upload
+# limit, which Discord applies to the whole request rather than to each attachment
+def batchFiles(files:list, sizeLimit:int):
+    batches, batch, total = [], [], 0
+    for file in files:
+        size = _size(file)
+        if batch and (len(batch) == MAX_ATTACHMENTS or total + size > sizeLimit):
+            batches.append(batch)
+            batch, total = [], 0
+        batch.append(file)
+        total += size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+# Send the export as interaction followups, or as channel messages once the interaction may have
+# expired (background jobs), as many files per message as the upload limit allows
+async def sendExport(target, title:str, rows, filename:str, compress:bool=False):
+    send = target.followup.send if isinstance(target, discord.Interaction) else target.send
+    sizeLimit = target.guild.filesize_limit
+    try:
+        files = exportFiles(rows, filename, sizeLimit, compress)
+    except ExportError as e:
+        await send(str(e)[:2000])
+        return True  # Answered, callers only report an empty export
+    if not files:
+        return False
+    for index, batch in enumerate(batchFiles(files, sizeLimit)):
+        content = title if index == 0 else f"{title} (continued)"
+        await send(content, files=batch)
+    return True
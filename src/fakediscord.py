@@ -0,0 +1,398 @@
+import asyncio
+import random
+import time
+from collections import Counter
+from types import SimpleNamespace
+import discord
+
+# Offline stand-in for the parts of the Discord API the bulk commands use, for benchmark.py.
+# Objects mimic discord.py's Guild/Role/Member/Channel closely enough for the plan executors and
+# exporters. Every mutating call goes through FakeBackend, which charges simulated latency and
+# enforces per-route rate-limit buckets (waiting like discord.py does, or answering 429 when
+# configured to). Changes reach the local cache only after a simulated gateway delay, like real
+# gateway events do. All durations are multiplied by timeScale so large runs finish quickly.
+
+# Route -> (requests per window, window seconds), buckets are per route and major parameter
+ROUTE_LIMITS = {
+    'PATCH /guilds/{guild_id}/members/{user_id}': (10, 10),
+    'POST /guilds/{guild_id}/roles': (10, 10),
+    'GET /guilds/{guild_id}/roles': (50, 1),
+    'PATCH /guilds/{guild_id}/roles': (1, 1),
+    'PATCH /guilds/{guild_id}/roles/{role_id}': (10, 10),
+    'POST /guilds/{guild_id}/channels': (10, 10),
+    'PATCH /guilds/{guild_id}/channels': (1, 1),
+    'PATCH /channels/{channel_id}': (2, 600),
+    'POST /channels/{channel_id}/messages': (5, 5),
+    'PUT /channels/{channel_id}/permissions/{overwrite_id}': (10, 10),
+    'DELETE /channels/{channel_id}/permissions/{overwrite_id}': (10, 10),
+}
+GLOBAL_LIMIT = 50  # Requests per second across every route
+
+
+class Bucket:
+    def __init__(self, limit:int, window:float):
+        self.limit = limit
+        self.window = window
+        self.remaining = limit
+        self.resetAt = 0.0
+
+
+class FakeBackend:
+    def __init__(self, timeScale:float=0.001, latency:float=0.08, gatewayDelay:float=0.05, raise429:bool=False, seed:int=0):
+        self.timeScale = timeScale
+        self.latency = latency
+        self.gatewayDelay = gatewayDelay
+        self.raise429 = raise429
+        self.random = random.Random(seed)
+        self.buckets = {}
+        self.globalBucket = Bucket(GLOBAL_LIMIT, 1)
+        self.requests = Counter()
+        self.rateLimitWaits = 0
+        self.rateLimited = 0
+
+    def reset(self):
+        self.requests.clear()
+        self.rateLimitWaits = 0
+        self.rateLimited = 0
+
+    async def _acquire(self, bucket:Bucket):
+        while True:
+            now = time.monotonic()
+            if now >= bucket.resetAt:
+                bucket.remaining = bucket.limit
+                bucket.resetAt = now + bucket.window * self.timeScale
+            if bucket.remaining > 0:
+                bucket.remaining -= 1
+                return
+            if self.raise429:
+                self.rateLimited += 1
+                response = SimpleNamespace(status=429, reason="Too Many Requests", headers={'Retry-After': str(bucket.resetAt - now)})
+                raise discord.HTTPException(response, "You are being rate limited.")
+            self.rateLimitWaits += 1
+            await asyncio.sleep(bucket.resetAt - now)
+
+    async def request(self, route:str, major:int):
+        limit, window = ROUTE_LIMITS[route]
+        bucket = self.buckets.get((route, major))
+        if bucket is None:
+            bucket = self.buckets[(route, major)] = Bucket(limit, window)
+        await self._acquire(self.globalBucket)
+        await self._acquire(bucket)
+        self.requests[route] += 1
+        await asyncio.sleep(self.random.expovariate(1 / self.latency) * self.timeScale)
+
+    # Apply a change to the local cache after the simulated gateway delay
+    def dispatch(self, apply):
+        asyncio.get_running_loop().call_later(self.gatewayDelay * self.timeScale, apply)
+
+
+class FakeColour:
+    def __init__(self, value:int=0):
+        self.value = value
+
+
+class FakeRole:
+    def __init__(self, guild, roleId:int, name:str, position:int):
+        self.guild = guild
+        self.id = roleId
+        self.name = name
+        self.position = position
+        self.color = FakeColour()
+        self.permissions = discord.Permissions(0)
+        self.hoist = False
+        self.mentionable = False
+        self.managed = False
+
+    def __repr__(self):
+        return f"<FakeRole {self.name}>"
+
+    def is_default(self):
+        return self.id == self.guild.id
+
+    @property
+    def members(self):
+        return [member for member in self.guild.members if self.id in member._roleIds]
+
+    # Role attributes as create_role and Role.edit take them
+    def _apply(self, name:str=None, colour=None, permissions=None, hoist:bool=None, mentionable:bool=None, **fields):
+        for attribute, value in (('name', name), ('color', colour), ('permissions', permissions), ('hoist', hoist), ('mentionable', mentionable)):
+            if value is not None:
+                setattr(self, attribute, value)
+
+    async def edit(self, **fields):
+        await self.guild.backend.request('PATCH /guilds/{guild_id}/roles/{role_id}', self.guild.id)
+        self.guild.backend.dispatch(lambda: self._apply(**fields))
+
+
+class FakeMember:
+    def __init__(self, guild, memberId:int, name:str):
+        self.guild = guild
+        self.id = memberId
+        self.name = name
+        self.global_name = None
+        self.nick = None
+        self._roleIds = set()
+
+    def __repr__(self):
+        return f"<FakeMember {self.name}>"
+
+    @property
+    def display_name(self):
+        return self.nick or self.global_name or self.name
+
+    @property
+    def roles(self):
+        roles = [self.guild.get_role(roleId) for roleId in self._roleIds]
+        return [self.guild.default_role] + sorted((role for role in roles if role is not None), key=lambda role: role.position)
+
+    @property
+    def top_role(self):
+        return self.roles[-1]
+
+    async def edit(self, roles:list=None, **fields):
+        await self.guild.backend.request('PATCH /guilds/{guild_id}/members/{user_id}', self.guild.id)
+        if roles is not None:
+            roleIds = {role.id for role in roles if not role.is_default()}
+            self.guild.backend.dispatch(lambda: setattr(self, '_roleIds', roleIds))
+        return self
+
+
+class FakeMessage:
+    _ids = 10 ** 17
+
+    def __init__(self, channel, content:str):
+        FakeMessage._ids += 1
+        self.id = FakeMessage._ids
+        self.channel = channel
+        self.content = content
+        self.jump_url = f"https://discord.com/channels/{channel.guild.id}/{channel.id}/{self.id}"
+
+
+# Stand-in for discord.PermissionOverwrite holding the raw bits. PermissionOverwrite.from_pair walks
+# every permission flag, which in the permissions scenario cost more CPU than the work being measured
+# and made its wall time depend on the discord.py version.
+class FakeOverwrite:
+    def __init__(self, allow:int, deny:int):
+        self.allow = allow
+        self.deny = deny
+
+    def pair(self):
+        return discord.Permissions(self.allow), discord.Permissions(self.deny)
+
+
+class FakeChannel:
+    def __init__(self, guild, channelId:int, name:str, kind:str, position:int, categoryId:int=None):
+        self.guild = guild
+        self.id = channelId
+        self.name = name
+        self.type = kind
+        self.position = position
+        self.category_id = categoryId
+        self.topic = None
+        self._overwrites = {}  # role ID -> (allow, deny) permission bits
+
+    def __repr__(self):
+        return f"<FakeChannel {self.name}>"
+
+    @property
+    def category(self):
+        return self.guild.get_channel(self.category_id) if self.category_id else None
+
+    @property
+    def channels(self):
+        return [channel for channel in self.guild.channels if channel.category_id == self.id]
+
+    async def edit(self, name:str=None, **fields):
+        await self.guild.backend.request('PATCH /channels/{channel_id}', self.id)
+        if name is not None:
+            self.guild.backend.dispatch(lambda: setattr(self, 'name', name))
+
+    @property
+    def overwrites(self):
+        return {self.guild.get_role(roleId): self.overwrites_for(SimpleNamespace(id=roleId)) for roleId in self._overwrites if self.guild.get_role(roleId)}
+
+    def overwrites_for(self, target):
+        return FakeOverwrite(*self._overwrites.get(target.id, (0, 0)))
+
+    def _setOverwrites(self, overwrites:dict):
+        for target, overwrite in (overwrites or {}).items():
+            allow, deny = overwrite.pair()
+            self._overwrites[target.id] = (allow.value, deny.value)
+
+    async def set_permissions(self, target, overwrite=None, reason:str=None):
+        if overwrite is None:
+            await self.guild.backend.request('DELETE /channels/{channel_id}/permissions/{overwrite_id}', self.id)
+            self.guild.backend.dispatch(lambda: self._overwrites.pop(target.id, None))
+            return
+        await self.guild.backend.request('PUT /channels/{channel_id}/permissions/{overwrite_id}', self.id)
+        allow, deny = overwrite.pair()
+        self.guild.backend.dispatch(lambda: self._overwrites.__setitem__(target.id, (allow.value, deny.value)))
+
+    async def send(self, content:str=None, **fields):
+        await self.guild.backend.request('POST /channels/{channel_id}/messages', self.id)
+        return FakeMessage(self, content)
+
+
+class FakeHTTP:
+    def __init__(self, guild):
+        self.guild = guild
+
+    async def bulk_channel_update(self, guildId:int, payload:list, reason:str=None):
+        await self.guild.backend.request('PATCH /guilds/{guild_id}/channels', guildId)
+
+        def apply():
+            for entry in payload:
+                channel = self.guild.get_channel(entry['id'])
+                if channel is not None:
+                    channel.position = entry['position']
+                    if 'parent_id' in entry:
+                        channel.category_id = entry['parent_id']
+        self.guild.backend.dispatch(apply)
+
+
+class FakeGuild:
+    def __init__(self, backend:FakeBackend, guildId:int=1):
+        self.backend = backend
+        self.id = guildId
+        self.name = "Benchmark Guild"
+        self.chunked = True
+        self.filesize_limit = 25 * 1024 * 1024
+        self._state = SimpleNamespace(http=FakeHTTP(self))
+        self._roles = {guildId: FakeRole(self, guildId, "@everyone", 0)}
+        self._members = {}
+        self._channels = {}
+        self._nextId = guildId + 1
+
+    def nextId(self):
+        self._nextId += 1
+        return self._nextId
+
+    @property
+    def default_role(self):
+        return self._roles[self.id]
+
+    @property
+    def roles(self):
+        return sorted(self._roles.values(), key=lambda role: (role.position, role.id))
+
+    @property
+    def members(self):
+        return list(self._members.values())
+
+    @property
+    def channels(self):
+        return sorted(self._channels.values(), key=lambda channel: (channel.position, channel.id))
+
+    @property
+    def categories(self):
+        return [channel for channel in self.channels if channel.type == "category"]
+
+    @property
+    def me(self):
+        return self._members.get(self.id)
+
+    def get_role(self, roleId:int):
+        return self._roles.get(roleId)
+
+    def get_member(self, memberId:int):
+        return self._members.get(memberId)
+
+    def get_channel(self, channelId:int):
+        return self._channels.get(channelId)
+
+    async def fetch_member(self, memberId:int):
+        member = self._members.get(memberId)
+        if member is None:
+            raise discord.NotFound(SimpleNamespace(status=404, reason="Not Found"), "Unknown Member")
+        return member
+
+    async def chunk(self):
+        return self.members
+
+    async def create_role(self, name:str, **fields):
+        await self.backend.request('POST /guilds/{guild_id}/roles', self.id)
+        role = FakeRole(self, self.nextId(), name, 1)
+        role._apply(**fields)
+
+        def apply():
+            # New roles land at the bottom, pushing every other role up one position
+            for other in self._roles.values():
+                if not other.is_default():
+                    other.position += 1
+            self._roles[role.id] = role
+        self.backend.dispatch(apply)
+        return role
+
+    # Server-side state, modelled as the cache once every change in flight has been delivered
+    async def fetch_roles(self):
+        await self.backend.request('GET /guilds/{guild_id}/roles', self.id)
+        await settle(self.backend)
+        return self.roles
+
+    async def edit_role_positions(self, positions:dict, reason:str=None):
+        await self.backend.request('PATCH /guilds/{guild_id}/roles', self.id)
+
+        def apply():
+            for role, position in positions.items():
+                role.position = position
+            # Discord renumbers the hierarchy so positions stay contiguous
+            for index, role in enumerate(sorted(self._roles.values(), key=lambda role: (role.position, role.id))):
+                role.position = index
+        self.backend.dispatch(apply)
+
+    async def create_text_channel(self, name:str, category=None, overwrites:dict=None, topic:str=None, kind:str="text", **fields):
+        await self.backend.request('POST /guilds/{guild_id}/channels', self.id)
+        siblings = category.channels if category else self.channels
+        channel = FakeChannel(self, self.nextId(), name, kind, max((c.position for c in siblings), default=-1) + 1, category.id if category else None)
+        channel.topic = topic
+        channel._setOverwrites(overwrites)
+        self.backend.dispatch(lambda: self._channels.__setitem__(channel.id, channel))
+        return channel
+
+    async def create_voice_channel(self, name:str, category=None, overwrites:dict=None, **fields):
+        return await self.create_text_channel(name, category, overwrites, kind="voice")
+
+    async def create_category(self, name:str, overwrites:dict=None, **fields):
+        await self.backend.request('POST /guilds/{guild_id}/channels', self.id)
+        channel = FakeChannel(self, self.nextId(), name, "category", len(self.categories))
+        channel._setOverwrites(overwrites)
+        self.backend.dispatch(lambda: self._channels.__setitem__(channel.id, channel))
+        return channel
+
+
+# A synthetic guild: members spread over course roles, channels spread over categories
+def generateGuild(backend:FakeBackend, members:int=10000, roles:int=500, channels:int=1000, categories:int=20, seed:int=0):
+    rng = random.Random(seed)
+    guild = FakeGuild(backend)
+    for index in range(roles):
+        role = FakeRole(guild, guild.nextId(), f"role-{index:04d}", index + 1)
+        guild._roles[role.id] = role
+    # The bot's own member, whose top role sits above every generated role
+    botRole = FakeRole(guild, guild.nextId(), "Valley", roles + 1)
+    guild._roles[botRole.id] = botRole
+    bot = FakeMember(guild, guild.id, "valley")
+    bot._roleIds = {botRole.id}
+    guild._members[bot.id] = bot
+
+    roleIds = [role.id for role in guild.roles if not role.is_default() and role.name != "Valley"]
+    for index in range(members):
+        member = FakeMember(guild, guild.nextId(), f"student{index:05d}")
+        member.global_name = f"Student {index}"
+        member._roleIds = set(rng.sample(roleIds, k=min(len(roleIds), rng.randint(0, 5))))
+        guild._members[member.id] = member
+
+    categoryIds = []
+    for index in range(categories):
+        category = FakeChannel(guild, guild.nextId(), f"category-{index:02d}", "category", index)
+        guild._channels[category.id] = category
+        categoryIds.append(category.id)
+    for index in range(channels):
+        categoryId = categoryIds[index % len(categoryIds)]
+        channel = FakeChannel(guild, guild.nextId(), f"channel-{index:04d}", "text", index // len(categoryIds), categoryId)
+        guild._channels[channel.id] = channel
+    return guild
+
+
+# Let pending simulated gateway events land
+async def settle(backend:FakeBackend):
+    await asyncio.sleep(backend.gatewayDelay * backend.timeScale * 2)
@@ -0,0 +1,105 @@
+import asyncio
+import os
+import sys
+import time
+import discord
+import guildcache
+import memberindex
+try:
+    import resource  # Unix only, memory is not reported on Windows
+except ImportError:
+    resource = None
+
+# Gateway intents and member caching. The 'lean' profile (default) subscribes to guilds, members and
+# message content only, never receives presences and does not chunk members at startup: a guild's
+# member list is requested the first time a command needs it. The 'full' profile restores the old
+# behaviour of every intent and every member cached on connect.
+INTENTS_PROFILE = os.getenv('INTENTS_PROFILE', 'lean')
+
+STARTED = time.perf_counter()  # Startup is measured from when the bot's modules are loaded
+
+_chunkLocks = {}
+_prefetching = set()  # Background chunk tasks, referenced so they are not garbage collected
+startup = {}  # Filled on the first on_ready
+
+
+def intents():
+    if INTENTS_PROFILE == 'full':
+        return discord.Intents.all()
+    if INTENTS_PROFILE != 'lean':
+        raise ValueError(f"Unknown INTENTS_PROFILE '{INTENTS_PROFILE}', use 'lean' or 'full'")
+    selected = discord.Intents.none()
+    selected.guilds = True  # Channels and roles
+    selected.members = True  # Member events and on-demand chunking
+    selected.message_content = True  # Reading the input messages of /role, /assign, /channel and /rename
+    return selected
+
+
+# Client keyword arguments matching the profile
+def clientOptions():
+    return {'chunk_guilds_at_startup': INTENTS_PROFILE == 'full'}
+
+
+# Make sure the guild's member list is complete before a members-dependent command uses it.
+# Chunking happens once per guild (concurrent callers wait for the same request); afterwards the
+# gateway keeps the member cache current, and the member index and guild cache are synced with it.
+async def ensureMembers(guild:discord.Guild):
+    if guild.chunked:
+        return False
+    lock = _chunkLocks.setdefault(guild.id, asyncio.Lock())
+    async with lock:
+        if guild.chunked:
+            return False
+        started = time.perf_counter()
+        await guild.chunk()
+        memberindex.syncGuild(guild)
+        guildcache.syncGuild(guild)
+        print(f"Chunked {guild.name}: {guild.member_count} members in {time.perf_counter() - started:.1f}s")
+        return True
+
+
+# Start chunking in the background, for callers that must answer right away (autocomplete)
+def prefetchMembers(guild:discord.Guild):
+    if guild.chunked or guild.id in _chunkLocks and _chunkLocks[guild.id].locked():
+        return
+    task = asyncio.create_task(ensureMembers(guild))
+    _prefetching.add(task)
+    task.add_done_callback(_prefetching.discard)
+
+
+# Peak resident set size in bytes, None where the resource module is unavailable
+def peakRss():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # Bytes on macOS, kilobytes on Linux
+
+
+# Resident set size in bytes, current where /proc is available, otherwise the peak
+def rss():
+    if resource is None:
+        return None
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        return peakRss()
+
+
+# Called from on_ready, only the first connect counts as startup
+def recordStartup(client:discord.Client):
+    if startup:
+        return None
+    startup.update({
+        'seconds': time.perf_counter() - STARTED,
+        'rss': rss(),
+        'peak_rss': peakRss(),
+        'guilds': len(client.guilds),
+        'members': sum(len(guild.members) for guild in client.guilds),
+        'chunked': sum(guild.chunked for guild in client.guilds),
+    })
+    memory = f"RSS {startup['rss'] / 1024 / 1024:.0f} MB (peak {startup['peak_rss'] / 1024 / 1024:.0f} MB), " if startup['rss'] is not None else ""
+    return (
+        f"Ready in {startup['seconds']:.1f}s with the '{INTENTS_PROFILE}' intents profile: {memory}"
+        f"{startup['guilds']} guilds ({startup['chunked']} chunked), {startup['members']} cached members"
+    )
@@ -0,0 +1,256 @@
+import time
+import discord
+import storage
+
+# Local copy of each guild's structure (channels, categories, roles and role membership edges),
+# persisted to SQLite so it is warm as soon as the bot starts. On (re)connect the live guild is
+# diffed against the cache and only the delta is written, afterwards gateway events keep it current.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache_channels (
+    guild_id INTEGER NOT NULL,
+    id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    category_id INTEGER,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (guild_id, id)
+);
+CREATE TABLE IF NOT EXISTS cache_roles (
+    guild_id INTEGER NOT NULL,
+    id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    color INTEGER NOT NULL,
+    PRIMARY KEY (guild_id, id)
+);
+CREATE TABLE IF NOT EXISTS cache_members (
+    guild_id INTEGER NOT NULL,
+    id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    PRIMARY KEY (guild_id, id)
+);
+CREATE TABLE IF NOT EXISTS cache_role_members (
+    guild_id INTEGER NOT NULL,
+    role_id INTEGER NOT NULL,
+    member_id INTEGER NOT NULL,
+    PRIMARY KEY (guild_id, role_id, member_id)
+);
+CREATE TABLE IF NOT EXISTS cache_meta (
+    guild_id INTEGER PRIMARY KEY,
+    synced_at REAL NOT NULL
+);
+"""
+
+_snapshots = {}
+
+
+class GuildSnapshot:
+    def __init__(self, guildId:int):
+        self.guildId = guildId
+        self.channels = {}  # id -> (name, kind, category id, position)
+        self.roles = {}  # id -> (name, position, color)
+        self.members = {}  # id -> (username,)
+        self.memberRoles = {}  # member id -> role ids, the membership edges
+        self.syncedAt = None
+        self.loadedAt = None
+        self.eventsSinceSync = 0
+        self.lastEventAt = None
+        self.lastDrift = 0  # Rows that differed from the live guild at the last sync
+
+    def channelIdsByName(self, kind:str=None):
+        return {name: channelId for channelId, (name, channelKind, _, _) in self.channels.items() if kind is None or channelKind == kind}
+
+    def roleMembers(self, roleId:int):
+        return [memberId for memberId, roleIds in self.memberRoles.items() if roleId in roleIds]
+
+    def stats(self):
+        now = time.time()
+        return {
+            'channels': len(self.channels),
+            'roles': len(self.roles),
+            'members': len(self.members),
+            'edges': sum(len(roleIds) for roleIds in self.memberRoles.values()),
+            'sync_age_seconds': None if self.syncedAt is None else round(now - self.syncedAt, 1),
+            'events_since_sync': self.eventsSinceSync,
+            'last_event_age_seconds': None if self.lastEventAt is None else round(now - self.lastEventAt, 1),
+            'drift_at_last_sync': self.lastDrift,
+        }
+
+
+def _channelRow(channel):
+    return (channel.name, str(channel.type), channel.category_id, channel.position)
+
+
+def _roleRow(role):
+    return (role.name, role.position, role.color.value)
+
+
+def _memberRoleIds(member):
+    return {role.id for role in member.roles if not role.is_default()}
+
+
+_connection = None
+
+
+def _db():
+    global _connection
+    if _connection is None:
+        _connection = storage.ensureSchema(SCHEMA)
+    return _connection
+
+
+# Persist the difference between a member's cached and live role IDs
+def _writeEdges(db, guildId:int, memberId:int, cached:set, live:set):
+    db.executemany("DELETE FROM cache_role_members WHERE guild_id = ? AND role_id = ? AND member_id = ?", [(guildId, roleId, memberId) for roleId in cached - live])
+    db.executemany("INSERT OR IGNORE INTO cache_role_members (guild_id, role_id, member_id) VALUES (?, ?, ?)", [(guildId, roleId, memberId) for roleId in live - cached])
+    return len(cached ^ live)
+
+
+def get(guildId:int):
+    return _snapshots.get(guildId)
+
+
+# The guild's snapshot, synced from the local discord.py state first if it has never been cached
+def forGuild(guild:discord.Guild):
+    snapshot = _snapshots.get(guild.id)
+    if snapshot is None:
+        syncGuild(guild)
+        snapshot = _snapshots[guild.id]
+    return snapshot
+
+
+# Warm-load every cached guild from disk
+def loadAll():
+    db = _db()
+    for row in db.execute("SELECT guild_id, synced_at FROM cache_meta"):
+        snapshot = _snapshots[row['guild_id']] = GuildSnapshot(row['guild_id'])
+        snapshot.syncedAt = row['synced_at']
+        snapshot.loadedAt = time.time()
+    for row in db.execute("SELECT * FROM cache_channels"):
+        if row['guild_id'] in _snapshots:
+            _snapshots[row['guild_id']].channels[row['id']] = (row['name'], row['kind'], row['category_id'], row['position'])
+    for row in db.execute("SELECT * FROM cache_roles"):
+        if row['guild_id'] in _snapshots:
+            _snapshots[row['guild_id']].roles[row['id']] = (row['name'], row['position'], row['color'])
+    for row in db.execute("SELECT * FROM cache_members"):
+        if row['guild_id'] in _snapshots:
+            _snapshots[row['guild_id']].members[row['id']] = (row['name'],)
+    for row in db.execute("SELECT * FROM cache_role_members"):
+        if row['guild_id'] in _snapshots:
+            _snapshots[row['guild_id']].memberRoles.setdefault(row['member_id'], set()).add(row['role_id'])
+    return len(_snapshots)
+
+
+def _syncTable(db, table:str, columns:tuple, guildId:int, cached:dict, live:dict):
+    removed = [key for key in cached if key not in live]
+    changed = [(key, row) for key, row in live.items() if cached.get(key) != row]
+    db.executemany(f"DELETE FROM {table} WHERE guild_id = ? AND id = ?", [(guildId, key) for key in removed])
+    placeholders = ", ".join("?" * (len(columns) + 2))
+    db.executemany(
+        f"INSERT OR REPLACE INTO {table} (guild_id, id, {', '.join(columns)}) VALUES ({placeholders})",
+        [(guildId, key, *row) for key, row in changed]
+    )
+    cached.clear()
+    cached.update(live)
+    return len(removed) + len(changed)
+
+
+# Diff the live guild against the cache and persist only what changed, returns the number of rows written
+def syncGuild(guild:discord.Guild):
+    db = _db()
+    snapshot = _snapshots.setdefault(guild.id, GuildSnapshot(guild.id))
+    drift = _syncTable(db, "cache_channels", ("name", "kind", "category_id", "position"), guild.id, snapshot.channels, {c.id: _channelRow(c) for c in guild.channels})
+    drift += _syncTable(db, "cache_roles", ("name", "position", "color"), guild.id, snapshot.roles, {r.id: _roleRow(r) for r in guild.roles})
+
+    # Membership is only as complete as the member cache, skip it until the guild has been chunked
+    if guild.chunked:
+        drift += _syncTable(db, "cache_members", ("name",), guild.id, snapshot.members, {m.id: (m.name,) for m in guild.members})
+        live = {member.id: _memberRoleIds(member) for member in guild.members}
+        for memberId in snapshot.memberRoles.keys() | live.keys():
+            drift += _writeEdges(db, guild.id, memberId, snapshot.memberRoles.get(memberId, set()), live.get(memberId, set()))
+        snapshot.memberRoles = live
+
+    snapshot.syncedAt = time.time()
+    snapshot.eventsSinceSync = 0
+    snapshot.lastDrift = drift
+    db.execute("INSERT OR REPLACE INTO cache_meta (guild_id, synced_at) VALUES (?, ?)", (guild.id, snapshot.syncedAt))
+    db.commit()
+    return drift
+
+
+def _touch(snapshot:GuildSnapshot):
+    snapshot.eventsSinceSync += 1
+    snapshot.lastEventAt = time.time()
+
+
+# Gateway event hooks, write-through for guilds that have been synced at least once
+def onChannelChange(channel):
+    snapshot = _snapshots.get(channel.guild.id)
+    if snapshot is None:
+        return
+    snapshot.channels[channel.id] = row = _channelRow(channel)
+    _db().execute("INSERT OR REPLACE INTO cache_channels (guild_id, id, name, kind, category_id, position) VALUES (?, ?, ?, ?, ?, ?)", (channel.guild.id, channel.id, *row))
+    _db().commit()
+    _touch(snapshot)
+
+
+def onChannelDelete(channel):
+    snapshot = _snapshots.get(channel.guild.id)
+    if snapshot is None:
+        return
+    snapshot.channels.pop(channel.id, None)
+    _db().execute("DELETE FROM cache_channels WHERE guild_id = ? AND id = ?", (channel.guild.id, channel.id))
+    _db().commit()
+    _touch(snapshot)
+
+
+def onRoleChange(role:discord.Role):
+    snapshot = _snapshots.get(role.guild.id)
+    if snapshot is None:
+        return
+    snapshot.roles[role.id] = row = _roleRow(role)
+    _db().execute("INSERT OR REPLACE INTO cache_roles (guild_id, id, name, position, color) VALUES (?, ?, ?, ?, ?)", (role.guild.id, role.id, *row))
+    _db().commit()
+    _touch(snapshot)
+
+
+def onRoleDelete(role:discord.Role):
+    snapshot = _snapshots.get(role.guild.id)
+    if snapshot is None:
+        return
+    snapshot.roles.pop(role.id, None)
+    for roleIds in snapshot.memberRoles.values():
+        roleIds.discard(role.id)
+    db = _db()
+    db.execute("DELETE FROM cache_roles WHERE guild_id = ? AND id = ?", (role.guild.id, role.id))
+    db.execute("DELETE FROM cache_role_members WHERE guild_id = ? AND role_id = ?", (role.guild.id, role.id))
+    db.commit()
+    _touch(snapshot)
+
+
+def onMemberChange(member:discord.Member):
+    snapshot = _snapshots.get(member.guild.id)
+    if snapshot is None:
+        return
+    live = _memberRoleIds(member)
+    db = _db()
+    db.execute("INSERT OR REPLACE INTO cache_members (guild_id, id, name) VALUES (?, ?, ?)", (member.guild.id, member.id, member.name))
+    _writeEdges(db, member.guild.id, member.id, snapshot.memberRoles.get(member.id, set()), live)
+    db.commit()
+    snapshot.members[member.id] = (member.name,)
+    snapshot.memberRoles[member.id] = live
+    _touch(snapshot)
+
+
+def onMemberRemove(member:discord.Member):
+    snapshot = _snapshots.get(member.guild.id)
+    if snapshot is None:
+        return
+    snapshot.members.pop(member.id, None)
+    snapshot.memberRoles.pop(member.id, None)
+    db = _db()
+    db.execute("DELETE FROM cache_members WHERE guild_id = ? AND id = ?", (member.guild.id, member.id))
+    db.execute("DELETE FROM cache_role_members WHERE guild_id = ? AND member_id = ?", (member.guild.id, member.id))
+    db.commit()
+    _touch(snapshot)
@@ -0,0 +1,276 @@
+import csv
+import gzip
+import io
+import itertools
+import json
+import tempfile
+import aiohttp
+import discord
+import changes
+
+# Input for the reorganization commands, from message text or an uploaded CSV, TSV or XLSX file.
+# Uploads are spooled to a temp file and parsed row by row, every row carries its line number so
+# validation can point at the exact line. Everything is validated before a plan is compiled.
+
+SPOOL_SIZE = 1024 * 1024
+DOWNLOAD_CHUNK = 64 * 1024
+MAX_ROWS = 100000
+MAX_NAME_LENGTH = 100  # Discord's limit for role and channel names
+MAX_ERRORS = 20  # Errors listed in the reply, the rest are counted
+
+
+class IngestError(Exception):
+    pass
+
+
+# A /get changes patch, recognised by its header row instead of the command's usual layout
+class Patch:
+    def __init__(self, entries:list):
+        self.changes = entries  # dicts with the PATCH_HEADER keys and the line they came from
+
+
+# Cells are strings without surrounding whitespace, trailing empty cells (spreadsheet padding) are dropped
+def _clean(cells):
+    cells = ["" if cell is None else str(cell).strip() for cell in cells]
+    while cells and not cells[-1]:
+        cells.pop()
+    return cells
+
+
+def _limited(rows):
+    for number, cells in rows:
+        if number > MAX_ROWS:
+            raise IngestError(f"line {number}: input is longer than {MAX_ROWS} lines")
+        yield number, cells
+
+
+def _delimitedRows(text, delimiter:str):
+    reader = csv.reader(text, delimiter=delimiter)
+    try:
+        for cells in reader:
+            yield reader.line_num, _clean(cells)
+    except csv.Error as e:
+        raise IngestError(f"line {reader.line_num}: {e}")
+    except UnicodeDecodeError:
+        raise IngestError("The file is not UTF-8 text, save it as CSV UTF-8 and upload it again")
+    except (OSError, EOFError) as e:
+        raise IngestError(f"Could not read the file: {e}")  # Corrupt or truncated gzip
+
+
+def _xlsxCell(value):
+    # Whole numbers come back as floats, keep IDs from turning into 1.23e+17
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _xlsxRows(raw):
+    try:
+        import openpyxl
+    except ImportError:
+        raise IngestError("Reading .xlsx files needs the openpyxl package, upload a CSV instead")
+    try:
+        workbook = openpyxl.load_workbook(raw, read_only=True, data_only=True)
+    except Exception as e:
+        raise IngestError(f"Could not open the spreadsheet: {e}")
+    try:
+        for number, values in enumerate(workbook.active.iter_rows(values_only=True), 1):
+            yield number, _clean(map(_xlsxCell, values))
+    finally:
+        workbook.close()
+
+
+# A /get changes JSON patch as rows in the CSV patch layout, line numbers count changes after the header
+def _jsonRows(raw, compressed:bool):
+    try:
+        document = json.load(gzip.GzipFile(fileobj=raw, mode='rb') if compressed else raw)
+        entries = document['changes']
+    except (ValueError, KeyError, TypeError, OSError, EOFError) as e:
+        raise IngestError(f"Not a /get changes JSON patch: {e}")
+    yield 1, list(changes.PATCH_HEADER)
+    for number, entry in enumerate(entries, 2):
+        yield number, _clean(entry.get(column) if isinstance(entry, dict) else None for column in changes.PATCH_HEADER)
+
+
+# Message text. columns=1 reads one name per line, columns=2 splits 'old,new' on the first comma,
+# None parses the text as CSV
+def readText(text:str, columns:int=None):
+    if text.lstrip().casefold().startswith(",".join(changes.PATCH_HEADER)):
+        columns = None  # Patches are always CSV
+    if columns is None:
+        return _limited(_delimitedRows(io.StringIO(text), ","))
+    lines = text.splitlines()
+    if columns == 1:
+        return _limited((number, _clean([line])) for number, line in enumerate(lines, 1))
+    return _limited((number, _clean(line.split(",", columns - 1))) for number, line in enumerate(lines, 1))
+
+
+# An uploaded .csv, .tsv, .txt, .xlsx or .json (patch) file, optionally gzipped (as /get exports them)
+async def readAttachment(attachment:discord.Attachment):
+    name = attachment.filename.lower()
+    compressed = name.endswith(".gz")
+    if compressed:
+        name = name[:-3]
+    if name.endswith(".xlsx"):
+        kind = "xlsx"
+    elif name.endswith(".json"):
+        kind = "json"
+    elif name.endswith(".tsv"):
+        kind = "\t"
+    elif name.endswith(".csv") or name.endswith(".txt"):
+        kind = ","
+    else:
+        raise IngestError(f"Unsupported file '{attachment.filename}', upload a .csv, .tsv or .xlsx file")
+    if kind == "xlsx" and compressed:
+        raise IngestError("Upload .xlsx files without compressing them")
+
+    raw = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE, mode='w+b')
+    await _download(attachment, raw)
+    if kind == "xlsx":
+        return _limited(_xlsxRows(raw))
+    if kind == "json":
+        return _limited(_jsonRows(raw, compressed))
+    binary = gzip.GzipFile(fileobj=raw, mode='rb') if compressed else raw
+    return _limited(_delimitedRows(io.TextIOWrapper(binary, encoding='utf-8-sig', newline=''), kind))
+
+
+# Stream the upload from the CDN into the spooled file chunk by chunk. Attachment.read and
+# Attachment.save both buffer the whole body in memory first.
+async def _download(attachment:discord.Attachment, raw):
+    async with aiohttp.ClientSession() as session:
+        async with session.get(attachment.url) as response:
+            if response.status != 200:
+                raise IngestError(f"Could not download '{attachment.filename}' (HTTP {response.status}), upload it again")
+            async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK):
+                raw.write(chunk)
+    raw.seek(0)
+
+
+def _checkName(errors:list, number:int, name:str):
+    if len(name) > MAX_NAME_LENGTH:
+        errors.append(f"line {number}: '{name[:20]}...' is longer than {MAX_NAME_LENGTH} characters")
+        return False
+    return True
+
+
+# Validators take (line number, cells) rows and return the parsed input and a list of errors
+
+# One name per row (first column), for /role and /channel
+def parseNames(rows):
+    names, errors, seen = [], [], {}
+    for number, cells in rows:
+        if not cells or not cells[0]:
+            continue
+        name = cells[0]
+        if name in seen:
+            errors.append(f"line {number}: '{name}' is already listed on line {seen[name]}")
+        elif _checkName(errors, number, name):
+            seen[name] = number
+            names.append(name)
+    return names, errors
+
+
+# A role name followed by member identifiers, for /assign. Same layout as the /get role export.
+# Rows without members are skipped, an empty member list would otherwise strip the role from everyone.
+def parseAssignments(rows):
+    assignments, errors = {}, []
+    for number, cells in rows:
+        roleName, identifiers = (cells[0], [cell for cell in cells[1:] if cell]) if cells else ("", [])
+        if not identifiers:
+            continue
+        if not roleName:
+            errors.append(f"line {number}: members listed without a role name")
+            continue
+        if _checkName(errors, number, roleName):
+            assignments.setdefault(roleName, []).extend(identifiers)
+    return assignments, errors
+
+
+# Two names per row
+def _parsePairs(rows, expected:str):
+    pairs, errors = [], []
+    for number, cells in rows:
+        if not cells:
+            continue
+        if len(cells) < 2 or not cells[0] or not cells[1]:
+            errors.append(f"line {number}: expected '{expected}'")
+        elif len(cells) > 2:
+            errors.append(f"line {number}: expected 2 columns, found {len(cells)} (quote names that contain commas)")
+        elif _checkName(errors, number, cells[1]):
+            pairs.append((cells[0], cells[1]))
+    return pairs, errors
+
+
+# Old name and new name per row, for /rename
+def parseRenames(rows):
+    return _parsePairs(rows, "old name,new name")
+
+
+# Channel and role pairs for /permissions
+def parseChannelRoles(rows):
+    return _parsePairs(rows, "channel,role")
+
+
+# Student roster rows: student ID, first name, last name, Discord ID or username (may be empty), then
+# one course role name per remaining column. A header row is skipped.
+def parseRoster(rows):
+    entries, errors, seen = [], [], {}
+    for number, cells in rows:
+        if not cells:
+            continue
+        if not entries and not errors and cells[0].casefold().replace("_", " ") in ("student id", "studentid", "id"):
+            continue
+        cells += [""] * (4 - len(cells))
+        studentId, firstName, lastName, discordUser = cells[:4]
+        if not studentId:
+            errors.append(f"line {number}: the student ID is missing")
+        elif studentId in seen:
+            errors.append(f"line {number}: student '{studentId}' is already listed on line {seen[studentId]}")
+        elif all(_checkName(errors, number, course) for course in cells[4:] if course):
+            seen[studentId] = number
+            entries.append((studentId, firstName, lastName, discordUser, [course for course in cells[4:] if course]))
+    return entries, errors
+
+
+# Change rows of a /get changes patch, after its header row
+def parsePatch(rows):
+    entries, errors = [], []
+    for number, cells in rows:
+        if not cells:
+            continue
+        entry = dict(itertools.zip_longest(changes.PATCH_HEADER, cells[:len(changes.PATCH_HEADER)], fillvalue=""))
+        entry['line'] = number
+        if entry['kind'] not in changes.KINDS or entry['change'] not in changes.CHANGES:
+            errors.append(f"line {number}: unknown change '{entry['kind']} {entry['change']}'")
+            continue
+        if entry['id'] and not entry['id'].isdigit():
+            errors.append(f"line {number}: '{entry['id']}' is not an ID")
+            continue
+        entry['id'] = int(entry['id']) if entry['id'] else None
+        if not entry['name'] and entry['id'] is None:
+            errors.append(f"line {number}: a name or an ID is needed")
+        elif entry['kind'] == "member" and not entry['target']:
+            errors.append(f"line {number}: the role name is missing")
+        elif entry['change'] == "renamed" and not (entry['name'] and (entry['target'] or entry['id'])):
+            errors.append(f"line {number}: a rename needs the new name and the ID or old name")
+        elif not entry['name'] or _checkName(errors, number, entry['name']):
+            entries.append(entry)
+    return Patch(entries), errors
+
+
+# Wraps a validator so the command also accepts a patch, told apart by its header row
+def patchOr(parse):
+    def parseInput(rows):
+        rows = iter(rows)
+        first = next(((number, cells) for number, cells in rows if cells), None)
+        if first is not None and [cell.casefold() for cell in first[1]] == changes.PATCH_HEADER:
+            return parsePatch(rows)
+        return parse(itertools.chain([first] if first else [], rows))
+    return parseInput
+
+
+def errorReport(errors:list):
+    report = "\n".join(errors[:MAX_ERRORS])
+    if len(errors) > MAX_ERRORS:
+        report += f"\n...and {len(errors) - MAX_ERRORS} more"
+    return report
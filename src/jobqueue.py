@@ -0,0 +1,248 @@
+import asyncio
+import itertools
+import os
+import time
+from collections import deque
+import discord
+import metrics
+
+# Background jobs. Heavy work (reorganization plans) is submitted per guild and runs one job at a time
+# within a guild, while different guilds run side by side, at most MAX_WORKERS jobs at once. Each
+# guild gets a worker task while it has jobs queued, so an idle guild costs nothing.
+#
+# Commands return as soon as their job is queued. A job reports to a regular message in the channel it
+# came from, not to the interaction, because interaction followups expire after 15 minutes. Bulk
+# progress is only recorded in memory, and a separate reporter edits the message at most once per
+# PROGRESS_INTERVAL, so operations never wait on a progress edit.
+MAX_WORKERS = int(os.getenv('JOB_WORKERS', '4'))
+PROGRESS_INTERVAL = 5  # Seconds between progress message edits
+KEEP_FINISHED = 50  # Finished jobs remembered for /jobs
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    _ids = itertools.count(1)
+
+    def __init__(self, guildId:int, label:str, factory, key=None, channel=None, report=None):
+        self.id = next(Job._ids)
+        self.guildId = guildId
+        self.label = label
+        self.key = key  # Identifies the work, e.g. ('plan', 12), so it is not queued twice
+        self.factory = factory  # Coroutine function taking the job, doing the work
+        # Metrics name, the command that queued the job, whose invocation has ended by the time it runs
+        invocation = metrics._current.get()
+        self.command = invocation.command if invocation is not None else label
+        self.channel = channel  # Where progress and the outcome are posted, None to stay silent
+        self.report = report  # Optional function turning the result into the final message
+        self.status = 'queued'
+        self.queuedAt = time.time()
+        self.startedAt = None
+        self.finishedAt = None
+        self.done = 0
+        self.total = 0
+        self.failed = 0
+        self.result = None
+        self.error = None
+        self.message = None
+        self.task = None
+        self.finished = asyncio.Event()
+        self._cancelRequested = False
+
+    def __await__(self):
+        return self._wait().__await__()
+
+    async def _wait(self):
+        await self.finished.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    # bulk.runBulk onProgress callback, only records the counts
+    async def progress(self, result):
+        self.done, self.total, self.failed = result.done, result.total, len(result.failed)
+
+    def describe(self):
+        counts = f" {self.done}/{self.total}" + (f" ({self.failed} failed)" if self.failed else "") if self.total else ""
+        if self.status == 'queued':
+            waiting = ahead(self)
+            state = f"queued, {waiting} ahead" if waiting else "queued"
+        elif self.status == 'running':
+            state = f"running{counts}, {_duration(time.time() - self.startedAt)}"
+        else:
+            state = f"{self.status}{counts}"
+        return f"#{self.id} {self.label}: {state}"
+
+    # The final message, from the report function when the job succeeded
+    def outcome(self):
+        if self.status == 'done' and self.report is not None:
+            return self.report(self.result)
+        if self.status == 'failed':
+            return f"Job #{self.id} {self.label} failed: {self.error}"
+        if self.status == 'cancelled':
+            return f"Job #{self.id} {self.label} was cancelled" + (f" after {self.done}/{self.total} operations." if self.total else ".")
+        return f"Job #{self.id} {self.label} finished."
+
+
+def _duration(seconds:float):
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes}m{seconds:02d}s" if minutes else f"{seconds}s"
+
+
+class GuildQueue:
+    def __init__(self):
+        self.jobs = deque()
+        self.current = None
+        self.worker = None
+
+
+_queues = {}
+_finished = deque(maxlen=KEEP_FINISHED)
+_slots = asyncio.Semaphore(MAX_WORKERS)
+_reporters = set()  # Progress reporter tasks, referenced so they are not garbage collected
+
+
+def submit(guildId:int, label:str, factory, key=None, channel=None, report=None):
+    job = Job(guildId, label, factory, key, channel, report)
+    queue = _queues.get(guildId)
+    if queue is None:
+        queue = _queues[guildId] = GuildQueue()
+    queue.jobs.append(job)
+    if queue.worker is None:
+        queue.worker = asyncio.create_task(_work(guildId, queue))
+    return job
+
+
+async def _work(guildId:int, queue:GuildQueue):
+    while queue.jobs:
+        job = queue.jobs[0]
+        async with _slots:
+            if not queue.jobs or queue.jobs[0] is not job:
+                continue  # Cancelled while waiting for a free worker
+            queue.jobs.popleft()
+            queue.current = job
+            await _run(job)
+            queue.current = None
+    del _queues[guildId]
+
+
+async def _run(job:Job):
+    job.status = 'running'
+    job.startedAt = time.time()
+    # The worker task inherited the context of whichever command first queued work for the guild,
+    # the job's tasks copy a fresh invocation instead so its HTTP calls are counted for its command
+    invocation = metrics.Invocation(job.command)
+    token = metrics._current.set(invocation)
+    reporter = None
+    if job.channel is not None:
+        reporter = asyncio.create_task(_report(job))
+        _reporters.add(reporter)
+        reporter.add_done_callback(_reporters.discard)
+    job.task = asyncio.create_task(job.factory(job))
+    metrics._current.reset(token)
+    try:
+        job.result = await job.task
+        job.status = 'done'
+    except asyncio.CancelledError:
+        if not job._cancelRequested:
+            raise  # The worker itself is being cancelled, e.g. on shutdown
+        job.status = 'cancelled'
+        job.error = JobCancelled(f"job #{job.id} was cancelled")
+    except Exception as e:
+        job.status = 'failed'
+        job.error = e
+    finally:
+        _finish(job)
+        metrics.record(invocation, job.status == 'failed')
+    if reporter is not None:
+        await reporter
+
+
+def _finish(job:Job):
+    job.finishedAt = time.time()
+    job.finished.set()
+    _finished.append(job)
+
+
+# Post the job's progress message and keep it current until the job finishes
+async def _report(job:Job):
+    try:
+        job.message = await job.channel.send(f"{job.label}: started as job #{job.id}...")
+    except discord.HTTPException:
+        return  # Progress is best-effort, never fail the job over it
+    shown = None
+    while not job.finished.is_set():
+        try:
+            await asyncio.wait_for(job.finished.wait(), PROGRESS_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        counts = (job.done, job.total, job.failed)
+        if job.finished.is_set() or counts == shown or not job.total:
+            continue
+        shown = counts
+        try:
+            await job.message.edit(content=job.describe())
+        except discord.HTTPException:
+            pass
+    try:
+        await job.message.edit(content=job.outcome()[:2000])
+    except discord.HTTPException:
+        pass
+
+
+# Stop a queued or running job, returns False if it is not queued or running in the guild
+def cancel(guildId:int, jobId:int):
+    queue = _queues.get(guildId)
+    if queue is None:
+        return False
+    if queue.current is not None and queue.current.id == jobId:
+        job = queue.current
+        job._cancelRequested = True
+        job.task.cancel()
+        return True
+    for job in queue.jobs:
+        if job.id == jobId:
+            queue.jobs.remove(job)
+            job.status = 'cancelled'
+            job.error = JobCancelled(f"job #{job.id} was cancelled")
+            _finish(job)
+            return True
+    return False
+
+
+# Jobs that will run before this one, including the one currently running
+def ahead(job:Job):
+    queue = _queues.get(job.guildId)
+    if queue is None or queue.current is job:
+        return 0
+    return (queue.current is not None) + (queue.jobs.index(job) if job in queue.jobs else 0)
+
+
+# Whether work with this key is queued or running in the guild
+def contains(guildId:int, key):
+    queue = _queues.get(guildId)
+    if queue is None:
+        return False
+    return any(job.key == key for job in queue.jobs) or (queue.current is not None and queue.current.key == key)
+
+
+def depth(guildId:int):
+    queue = _queues.get(guildId)
+    if queue is None:
+        return 0
+    return len(queue.jobs) + (queue.current is not None)
+
+
+def active():
+    return {guildId: depth(guildId) for guildId in _queues}
+
+
+# The guild's running and queued jobs, then its recently finished ones, newest first
+def jobs(guildId:int):
+    queue = _queues.get(guildId)
+    listed = []
+    if queue is not None:
+        listed += ([queue.current] if queue.current is not None else []) + list(queue.jobs)
+    listed += [job for job in reversed(_finished) if job.guildId == guildId]
+    return listed
@@ -0,0 +1,151 @@
+import bisect
+import discord
+
+# Per-guild member lookup tables so resolving a username is a dict hit instead of a scan of guild.members.
+# Built lazily from the member cache the first time a guild is queried, then kept in sync by gateway events.
+_indexes = {}
+
+
+def parseMention(identifier:str):
+    identifier = identifier.strip()
+    if identifier.startswith("<@") and identifier.endswith(">"):
+        identifier = identifier[2:-1].lstrip('!')
+    return int(identifier) if identifier.isdigit() else None
+
+
+class MemberIndex:
+    def __init__(self, members=()):
+        self.byId = {}
+        self.byUsername = {}
+        self._sorted = []  # sorted (casefolded name, member id) pairs for prefix lookups
+        self._names = {}  # member id -> names it is currently indexed under
+        self.sync(members)
+
+    def __len__(self):
+        return len(self.byId)
+
+    # Single gateway events, the sorted list is kept in order with an insort per name
+    def add(self, member:discord.Member):
+        if member.id in self.byId:
+            self.remove(member.id)
+        for pair in self._index(member):
+            bisect.insort(self._sorted, pair)
+
+    def remove(self, memberId:int):
+        for pair in self._unindex(memberId):
+            position = bisect.bisect_left(self._sorted, pair)
+            if position < len(self._sorted) and self._sorted[position] == pair:
+                del self._sorted[position]
+
+    # Bring the index in line with a complete member list, e.g. after a chunk, without rebuilding it:
+    # only new, renamed and departed members are touched and the sorted list is sorted once, so
+    # building the index for 100k members stays linearithmic instead of one insort per name
+    def sync(self, members):
+        present = set()
+        changed = []
+        for member in members:
+            present.add(member.id)
+            if self._names.get(member.id) == _memberNames(member):
+                self.byId[member.id] = member  # Same names, only the object is newer
+                self.byUsername[member.name] = member
+            else:
+                changed.append(member)
+        stale = {memberId for memberId in self.byId if memberId not in present}
+        stale.update(member.id for member in changed if member.id in self.byId)
+        for memberId in stale:
+            self._unindex(memberId)
+        if stale:
+            self._sorted = [pair for pair in self._sorted if pair[1] not in stale]
+        pairs = [pair for member in changed for pair in self._index(member)]
+        if pairs:
+            self._sorted.extend(pairs)
+            self._sorted.sort()
+
+    # Add a member to the lookup tables, returns its (casefolded name, id) pairs for the sorted list
+    def _index(self, member:discord.Member):
+        names = _memberNames(member)
+        self.byId[member.id] = member
+        self.byUsername[member.name] = member
+        self._names[member.id] = names
+        return [(name, member.id) for name in {name.casefold() for name in names if name}]
+
+    # Remove a member from the lookup tables, returns the pairs to drop from the sorted list
+    def _unindex(self, memberId:int):
+        member = self.byId.pop(memberId, None)
+        if member is None:
+            return []
+        if self.byUsername.get(member.name) is member:
+            del self.byUsername[member.name]
+        names = self._names.pop(memberId)
+        return [(name, memberId) for name in {name.casefold() for name in names if name}]
+
+    # Resolve a mention, ID or exact username, None when nothing matches. Display and global names are
+    # chosen by members themselves, so they only feed autocomplete suggestions (see prefix), never a
+    # lookup that grants roles: anyone could take the nickname of a listed user who is not in the server.
+    def get(self, identifier:str):
+        memberId = parseMention(identifier)
+        if memberId is not None and memberId in self.byId:
+            return self.byId[memberId]
+        return self.byUsername.get(identifier.strip())
+
+    # Members whose username, display name or global name starts with the query, case-insensitive
+    def prefix(self, query:str, limit:int=25):
+        query = query.casefold()
+        matches = []
+        position = bisect.bisect_left(self._sorted, (query,))
+        while position < len(self._sorted) and len(matches) < limit:
+            folded, memberId = self._sorted[position]
+            if not folded.startswith(query):
+                break
+            member = self.byId[memberId]
+            if member not in matches:
+                matches.append(member)
+            position += 1
+        return matches
+
+
+def _memberNames(member:discord.Member):
+    return (member.name, member.display_name, member.global_name)
+
+
+
+def forGuild(guild:discord.Guild):
+    index = _indexes.get(guild.id)
+    if index is None:
+        index = _indexes[guild.id] = MemberIndex(guild.members)
+    return index
+
+
+def dropGuild(guild:discord.Guild):
+    _indexes.pop(guild.id, None)
+
+
+# After a chunk, apply the complete member list to an index that was already built
+def syncGuild(guild:discord.Guild):
+    index = _indexes.get(guild.id)
+    if index is not None:
+        index.sync(guild.members)
+
+
+# Gateway event hooks, only touch guilds whose index has already been built
+def onMemberJoin(member:discord.Member):
+    index = _indexes.get(member.guild.id)
+    if index is not None:
+        index.add(member)
+
+
+def onMemberUpdate(before:discord.Member, after:discord.Member):
+    onMemberJoin(after)
+
+
+def onMemberRemove(member:discord.Member):
+    index = _indexes.get(member.guild.id)
+    if index is not None:
+        index.remove(member.id)
+
+
+def onUserUpdate(before:discord.User, after:discord.User):
+    for index in _indexes.values():
+        member = index.byId.get(after.id)
+        if member is not None:
+            index.add(member)
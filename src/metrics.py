@@ -0,0 +1,268 @@
+import asyncio
+import contextvars
+import functools
+import os
+import re
+import time
+from collections import defaultdict, deque
+import aiohttp
+import discord
+import gateway
+import shards
+
+# Instrumentation for every outgoing Discord API call and every slash command invocation.
+# HTTP calls are observed through an aiohttp trace config handed to the client, commands through
+# the @timed decorator. The current invocation travels in a context variable, so HTTP calls made
+# by a command (including from bulk runner workers it spawns) are attributed to it. Background jobs
+# run in their own invocation, recorded under the command that queued them (see jobqueue).
+# Everything is exposed in Prometheus text format on METRICS_HOST:METRICS_PORT and through /stats.
+
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))  # 0 disables the endpoint
+SAMPLES = 1000  # Latency samples kept per route / command for percentiles
+QUANTILES = (0.5, 0.95, 0.99)
+
+_SNOWFLAKE = re.compile(r'/\d{15,21}')
+_API_PREFIX = re.compile(r'^/api/v\d+')
+
+_current = contextvars.ContextVar('invocation', default=None)
+
+
+class Series:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.samples = deque(maxlen=SAMPLES)
+
+    def observe(self, value:float):
+        self.count += 1
+        self.total += value
+        self.samples.append(value)
+
+    def quantiles(self):
+        ordered = sorted(self.samples)
+        if not ordered:
+            return {q: 0.0 for q in QUANTILES}
+        return {q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] for q in QUANTILES}
+
+
+class RouteStats:
+    def __init__(self):
+        self.latency = Series()
+        self.statuses = defaultdict(int)
+        self.buckets = set()
+        self.rateLimited = 0
+        self.retryAfter = 0.0
+        self.errors = 0
+
+
+class CommandStats:
+    def __init__(self):
+        self.wall = Series()
+        self.httpTime = 0.0
+        self.httpCalls = 0
+        self.rateLimited = 0
+        self.retryAfter = 0.0
+        self.gatewayLag = Series()
+        self.failures = 0
+
+
+class Invocation:
+    def __init__(self, command:str):
+        self.command = command
+        self.started = time.perf_counter()
+        self.httpTime = 0.0
+        self.httpCalls = 0
+        self.rateLimited = 0
+        self.retryAfter = 0.0
+        self.gatewayLag = None  # Only set for slash commands, jobs have no interaction
+
+
+routes = defaultdict(RouteStats)
+commands = defaultdict(CommandStats)
+
+
+def normalizeRoute(method:str, url) -> str:
+    if url.host and not url.host.endswith('discord.com'):
+        return f"{method} {url.host}"
+    path = _API_PREFIX.sub('', url.path)
+    return f"{method} {_SNOWFLAKE.sub('/{id}', path)}"
+
+
+async def _onRequestStart(session, context, params):
+    context.started = time.perf_counter()
+
+
+async def _onRequestEnd(session, context, params):
+    elapsed = time.perf_counter() - context.started
+    stats = routes[normalizeRoute(params.method, params.url)]
+    response = params.response
+    stats.latency.observe(elapsed)
+    stats.statuses[response.status] += 1
+    bucket = response.headers.get('X-RateLimit-Bucket')
+    if bucket:
+        stats.buckets.add(bucket)
+    retryAfter = 0.0
+    if response.status == 429:
+        stats.rateLimited += 1
+        try:
+            retryAfter = float(response.headers.get('Retry-After', 0))
+        except ValueError:
+            pass
+        stats.retryAfter += retryAfter
+
+    invocation = _current.get()
+    if invocation is not None:
+        invocation.httpTime += elapsed
+        invocation.httpCalls += 1
+        if response.status == 429:
+            invocation.rateLimited += 1
+            invocation.retryAfter += retryAfter
+
+
+async def _onRequestException(session, context, params):
+    routes[normalizeRoute(params.method, params.url)].errors += 1
+
+
+def traceConfig():
+    config = aiohttp.TraceConfig()
+    config.on_request_start.append(_onRequestStart)
+    config.on_request_end.append(_onRequestEnd)
+    config.on_request_exception.append(_onRequestException)
+    return config
+
+
+# Wrap a slash command callback to record its wall time and the HTTP work done on its behalf
+def timed(function):
+    @functools.wraps(function)
+    async def wrapper(interaction:discord.Interaction, *args, **kwargs):
+        invocation = Invocation(function.__name__)
+        # Time between the user invoking the command and the bot starting to handle it
+        invocation.gatewayLag = max(0.0, time.time() - interaction.created_at.timestamp())
+        token = _current.set(invocation)
+        failed = False
+        try:
+            return await function(interaction, *args, **kwargs)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            _current.reset(token)
+            record(invocation, failed)
+    return wrapper
+
+
+# Add a finished invocation to its command's totals, background jobs record theirs the same way
+def record(invocation:Invocation, failed:bool=False):
+    stats = commands[invocation.command]
+    stats.wall.observe(time.perf_counter() - invocation.started)
+    stats.httpTime += invocation.httpTime
+    stats.httpCalls += invocation.httpCalls
+    stats.rateLimited += invocation.rateLimited
+    stats.retryAfter += invocation.retryAfter
+    stats.failures += failed
+    if invocation.gatewayLag is not None:
+        stats.gatewayLag.observe(invocation.gatewayLag)
+
+
+def _labels(**labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{str(value).replace(chr(34), chr(39))}"' for key, value in labels.items()) + "}"
+
+
+# Prometheus text exposition format, samples are grouped per metric family
+def render(client:discord.Client=None):
+    families = {}
+
+    def sample(name:str, kind:str, labels:dict, value, suffix:str=""):
+        families.setdefault((name, kind), []).append(f"{name}{suffix}{_labels(**labels)} {value}")
+
+    def summary(name:str, labels:dict, series:Series):
+        for q, value in series.quantiles().items():
+            sample(name, "summary", {**labels, 'quantile': q}, f"{value:.6f}")
+        sample(name, "summary", labels, f"{series.total:.6f}", "_sum")
+        sample(name, "summary", labels, series.count, "_count")
+
+    for route, stats in sorted(routes.items()):
+        for status, count in sorted(stats.statuses.items()):
+            sample("valley_http_requests_total", "counter", {'route': route, 'status': status}, count)
+        summary("valley_http_request_duration_seconds", {'route': route}, stats.latency)
+        sample("valley_http_ratelimited_total", "counter", {'route': route}, stats.rateLimited)
+        sample("valley_http_retry_after_seconds_total", "counter", {'route': route}, f"{stats.retryAfter:.3f}")
+        sample("valley_http_errors_total", "counter", {'route': route}, stats.errors)
+        sample("valley_http_buckets", "gauge", {'route': route}, len(stats.buckets))
+
+    for command, stats in sorted(commands.items()):
+        summary("valley_command_duration_seconds", {'command': command}, stats.wall)
+        summary("valley_command_gateway_lag_seconds", {'command': command}, stats.gatewayLag)
+        sample("valley_command_http_seconds_total", "counter", {'command': command}, f"{stats.httpTime:.6f}")
+        sample("valley_command_http_requests_total", "counter", {'command': command}, stats.httpCalls)
+        sample("valley_command_ratelimited_total", "counter", {'command': command}, stats.rateLimited)
+        sample("valley_command_failures_total", "counter", {'command': command}, stats.failures)
+
+    if client is not None and client.latency == client.latency:  # NaN before the first heartbeat
+        sample("valley_gateway_latency_seconds", "gauge", {}, f"{client.latency:.6f}")
+    if gateway.startup:
+        sample("valley_startup_seconds", "gauge", {}, f"{gateway.startup['seconds']:.3f}")
+    resident = gateway.rss()
+    if resident is not None:
+        sample("valley_process_resident_memory_bytes", "gauge", {}, resident)
+    if client is not None:
+        for row in shards.report(client):
+            labels = {'shard': row['shard']}
+            sample("valley_shard_up", "gauge", labels, int(row['up']))
+            if row['latency'] is not None:
+                sample("valley_shard_latency_seconds", "gauge", labels, f"{row['latency']:.6f}")
+            sample("valley_shard_guilds", "gauge", labels, row['guilds'])
+            sample("valley_shard_queued_jobs", "gauge", labels, row['jobs'])
+            sample("valley_shard_disconnects_total", "counter", labels, row['disconnects'])
+            sample("valley_shard_resumes_total", "counter", labels, row['resumes'])
+
+    lines = []
+    for (name, kind), samples in families.items():
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+
+# Human-readable summary for /stats
+def summary(limit:int=10):
+    def fmt(series:Series):
+        q = series.quantiles()
+        return f"p50 {q[0.5] * 1000:.0f}ms / p95 {q[0.95] * 1000:.0f}ms / p99 {q[0.99] * 1000:.0f}ms"
+
+    lines = ["**Commands**"]
+    for command, stats in sorted(commands.items(), key=lambda item: -item[1].wall.total)[:limit]:
+        lines.append(
+            f"`/{command}` x{stats.wall.count}: {fmt(stats.wall)}, lag {fmt(stats.gatewayLag)}, "
+            f"{stats.httpCalls} calls / {stats.httpTime:.1f}s HTTP, {stats.rateLimited} 429s ({stats.retryAfter:.1f}s)"
+        )
+    lines.append("**Routes**")
+    for route, stats in sorted(routes.items(), key=lambda item: -item[1].latency.total)[:limit]:
+        lines.append(f"`{route}` x{stats.latency.count}: {fmt(stats.latency)}, {stats.rateLimited} 429s ({stats.retryAfter:.1f}s)")
+    return "\n".join(lines)
+
+
+# Minimal HTTP server for Prometheus scrapes, every path returns the metrics page
+async def serve(client:discord.Client):
+    if not METRICS_PORT:
+        return None
+
+    async def handle(reader:asyncio.StreamReader, writer:asyncio.StreamWriter):
+        try:
+            await reader.readuntil(b"\r\n\r\n")
+            body = render(client).encode()
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                + f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, METRICS_HOST, METRICS_PORT)
+    print(f"Serving metrics on http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+    return server
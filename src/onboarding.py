@@ -0,0 +1,125 @@
+import asyncio
+import discord
+import bulk
+import roster
+
+# Automatic course roles for members on the guild's roster. Joins are not handled one by one: at the
+# start of a semester hundreds of students arrive within minutes, so joins are collected per guild for
+# a short window and each batch resolves its roles once and runs through the bulk runner, one role
+# edit per member. Onboarding does not go through the plan queue, so it is never stuck behind a
+# long reorganization.
+
+BATCH_WINDOW = 2.0  # Seconds to collect joins before assigning roles
+BATCH_SIZE = 200  # A full batch is assigned right away
+
+_pending = {}  # Guild ID -> {member ID: member} waiting for the next batch
+_timers = {}  # Guild ID -> task flushing the guild's batch when the window ends
+_running = set()  # Flush tasks in flight, referenced so they are not garbage collected
+
+
+class Assignment:
+    def __init__(self, member:discord.Member, row:int, roles:list, missing:list):
+        self.member = member
+        self.row = row
+        self.roles = roles  # Course roles the member still lacks
+        self.missing = missing  # Course names with no matching role in the guild
+
+
+# Course roles the members on the roster are missing, resolving role names once for the whole batch
+def assignments(guild:discord.Guild, members):
+    guildRoster = roster.forGuild(guild.id)
+    if guildRoster is None:
+        return []
+    byName = {role.name: role for role in guild.roles}
+    result = []
+    for member in members:
+        row = guildRoster.forMember(member)
+        if row is None:
+            continue
+        roles, missing = [], []
+        for course in guildRoster.courses(row):
+            role = byName.get(course)
+            if role is None:
+                missing.append(course)
+            elif role not in member.roles:
+                roles.append(role)
+        result.append(Assignment(member, row, roles, missing))
+    return result
+
+
+async def assign(guild:discord.Guild, members, onProgress=None):
+    planned = [assignment for assignment in assignments(guild, members) if assignment.roles]
+    operations = [
+        bulk.BulkOperation(
+            assignment.member.name, f"onboarding:{guild.id}",
+            lambda assignment=assignment: assignment.member.edit(
+                roles=bulk.mergeRoles(assignment.member, set(assignment.roles), set()), reason="Roster onboarding"
+            )
+        )
+        for assignment in planned
+    ]
+    return await bulk.runBulk(operations, onProgress=onProgress) if operations else bulk.BulkResult(0)
+
+
+# Called from on_member_join, returns whether the member is on the roster and was queued
+def enqueue(member:discord.Member):
+    guildRoster = roster.forGuild(member.guild.id)
+    if guildRoster is None or guildRoster.forMember(member) is None:
+        return False
+    pending = _pending.setdefault(member.guild.id, {})
+    pending[member.id] = member
+    if len(pending) >= BATCH_SIZE:
+        _spawn(_run(member.guild, list(_pending.pop(member.guild.id).values())))
+    elif member.guild.id not in _timers:
+        _timers[member.guild.id] = _spawn(_flushLater(member.guild))
+    return True
+
+
+def _spawn(coroutine):
+    task = asyncio.create_task(coroutine)
+    _running.add(task)
+    task.add_done_callback(_running.discard)
+    return task
+
+
+async def _flushLater(guild:discord.Guild):
+    await asyncio.sleep(BATCH_WINDOW)
+    _timers.pop(guild.id, None)
+    await flush(guild)
+
+
+async def flush(guild:discord.Guild):
+    members = list(_pending.pop(guild.id, {}).values())
+    return await _run(guild, members) if members else None
+
+
+async def _run(guild:discord.Guild, members:list):
+    result = await assign(guild, members)
+    print(f"Onboarded {len(members)} members in {guild.name}: {result.summary()} role edits")
+    if result.failed:
+        print(result.failureReport())
+    return result
+
+
+# Link a member to their roster row by student ID and assign their course roles right away
+async def verify(member:discord.Member, studentId:str):
+    guildRoster = roster.forGuild(member.guild.id)
+    if guildRoster is None:
+        return None
+    row = guildRoster.find(studentId)
+    if row is None:
+        return None
+    linked = guildRoster.linkedTo(row)
+    if linked is not None and linked != member.id:
+        raise ValueError(f"Student ID {studentId} is already linked to another account")
+    if guildRoster.byDiscord.get(member.id, row) != row:
+        raise ValueError("Your account is already linked to another student ID")
+    guildRoster.link(row, member.id)
+    assignment = assignments(member.guild, [member])[0]
+    if assignment.roles:
+        await member.edit(roles=bulk.mergeRoles(member, set(assignment.roles), set()), reason="Student ID verified")
+    return assignment
+
+
+def pending():
+    return {guildId: len(members) for guildId, members in _pending.items()}
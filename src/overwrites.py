@@ -0,0 +1,158 @@
+import difflib
+import re
+import discord
+
+# Permission overwrite templates for /permissions. A template is a list of rules, one per target role,
+# separated by semicolons or new lines:
+#   @everyone: -view_channel; {role}: +view_channel +send_messages; Staff: +manage_messages
+# '+' allows a permission, '-' denies it and '~' resets it to inherit. Permissions a rule does not
+# mention keep whatever the channel already has. '{role}' is the role paired with each channel.
+
+PAIRED = "{role}"
+EVERYONE = "@everyone"
+
+PRESETS = {
+    'private': "@everyone: -view_channel; {role}: +view_channel",
+    'readonly': "@everyone: -view_channel; {role}: +view_channel -send_messages",
+    'public': "@everyone: ~view_channel; {role}: ~view_channel",
+}
+
+# Channel/role pairing rules, each maps a name to the key both sides must share
+PAIRINGS = {
+    'name': lambda name: name.casefold(),
+    # Case, spaces and punctuation ignored: 'cs-3162✎cole' pairs with 'CS 3162 Cole'
+    'normalized': lambda name: _normalize(name),
+    # The course code before '✎': 'cs-3162✎cole' pairs with 'CS 3162'
+    'course': lambda name: _normalize(name.split("✎", 1)[0]),
+}
+
+
+def _normalize(name:str):
+    return re.sub(r'[\W_]+', '', name.casefold())
+
+
+class Rule:
+    def __init__(self, target:str):
+        self.target = target  # PAIRED, EVERYONE or a role name
+        self.allow = 0
+        self.deny = 0
+        self.clear = 0
+
+    def touched(self):
+        return self.allow | self.deny | self.clear
+
+    # The (allow, deny) pair after applying this rule on top of an existing overwrite
+    def apply(self, allow:int, deny:int):
+        touched = self.touched()
+        return (allow & ~touched) | self.allow, (deny & ~touched) | self.deny
+
+
+# Several rules for the same role folded into one, later rules win where they overlap
+def combine(rules:list):
+    combined = Rule(rules[0].target)
+    for rule in rules:
+        touched = rule.touched()
+        combined.allow = (combined.allow & ~touched) | rule.allow
+        combined.deny = (combined.deny & ~touched) | rule.deny
+        combined.clear = (combined.clear & ~touched) | rule.clear
+    return combined
+
+
+# Returns the rules and a list of errors, like the ingest validators
+def parseTemplate(text:str):
+    text = PRESETS.get(text.strip().casefold(), text)
+    flags = discord.Permissions.VALID_FLAGS
+    rules, errors = {}, []
+    for number, part in enumerate(re.split(r'[;\n]', text), start=1):
+        if not part.strip():
+            continue
+        target, separator, permissions = part.rpartition(":")
+        target = target.strip()
+        if not separator or not target:
+            errors.append(f"rule {number}: expected 'role: +permission -permission'")
+            continue
+        rule = rules.setdefault(target, Rule(target))
+        for token in permissions.split():
+            sign, name = token[0], token[1:].casefold().replace("-", "_")
+            if sign not in "+-~" or not name:
+                errors.append(f"rule {number}: '{token}' must start with +, - or ~")
+            elif name not in flags:
+                close = difflib.get_close_matches(name, flags, n=1)
+                errors.append(f"rule {number}: unknown permission '{name}'" + (f", did you mean '{close[0]}'?" if close else ""))
+            else:
+                bit = flags[name]
+                rule.allow &= ~bit
+                rule.deny &= ~bit
+                rule.clear &= ~bit
+                if sign == "+":
+                    rule.allow |= bit
+                elif sign == "-":
+                    rule.deny |= bit
+                else:
+                    rule.clear |= bit
+    if not rules and not errors:
+        errors.append("the template has no rules")
+    return list(rules.values()), errors
+
+
+# Pair channels with roles by a PAIRINGS rule, returns the pairs and the channels left without a role
+def pairChannels(channels:list, roles:list, pairing:str):
+    key = PAIRINGS[pairing]
+    byKey = {}
+    for role in roles:
+        if not role.is_default():
+            byKey.setdefault(key(role.name), role)
+    pairs, unpaired = [], []
+    for channel in channels:
+        role = byKey.get(key(channel.name))
+        if role is None:
+            unpaired.append(channel.name)
+        else:
+            pairs.append((channel, role))
+    return pairs, unpaired
+
+
+# The channel's current overwrite for a role as an (allow, deny) pair of permission bits
+def current(channel, role:discord.Role):
+    allow, deny = channel.overwrites_for(role).pair()
+    return allow.value, deny.value
+
+
+def build(allow:int, deny:int):
+    if not allow and not deny:
+        return None  # Nothing left to override, the overwrite is removed
+    return discord.PermissionOverwrite.from_pair(discord.Permissions(allow), discord.Permissions(deny))
+
+
+def _names(bits:int):
+    return [name for name, bit in discord.Permissions.VALID_FLAGS.items() if bits & bit]
+
+
+# What changes between two (allow, deny) pairs, e.g. 'allow view_channel, deny send_messages'
+def describe(old:tuple, new:tuple):
+    (oldAllow, oldDeny), (newAllow, newDeny) = old, new
+    parts = []
+    for verb, bits in (("allow", newAllow & ~oldAllow), ("deny", newDeny & ~oldDeny), ("reset", (oldAllow | oldDeny) & ~(newAllow | newDeny))):
+        if bits:
+            parts.append(f"{verb} {', '.join(_names(bits))}")
+    return "; ".join(parts)
+
+
+# Pair channels with roles from explicit (channel name, role name) rows, returns the pairs and the
+# names that matched nothing
+def pairMapping(guild:discord.Guild, rows:list):
+    channels, roles = {}, {}
+    for channel in guild.channels:
+        channels.setdefault(channel.name, channel)
+    for role in guild.roles:
+        roles.setdefault(role.name, role)
+    pairs, missing = [], []
+    for channelName, roleName in rows:
+        channel, role = channels.get(channelName), roles.get(roleName)
+        if channel is None:
+            missing.append(f"#{channelName}")
+        elif role is None:
+            missing.append(roleName)
+        else:
+            pairs.append((channel, role))
+    return pairs, missing
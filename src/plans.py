@@ -0,0 +1,221 @@
+import asyncio
+import json
+import time
+from collections import Counter
+import discord
+import bulk
+import storage
+
+# Reorganization commands compile their input into a Plan of operations before touching the guild.
+# Plans are journaled to SQLite as they run, so a crashed or rate-limited run can be resumed and
+# only the operations that have not completed yet are issued again.
+# Operations run phase by phase (e.g. create roles, then assign them); operations within a phase run
+# concurrently through the bulk runner, and a phase with failures stops the plan before the next one.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS plans (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    guild_id INTEGER NOT NULL,
+    command TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS plan_operations (
+    plan_id INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    phase INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    label TEXT NOT NULL,
+    args TEXT NOT NULL,
+    status TEXT NOT NULL,
+    error TEXT,
+    PRIMARY KEY (plan_id, seq)
+);
+"""
+
+RESUMABLE = ('draft', 'running', 'failed', 'cancelled')
+PREVIEW_LINES = 15
+
+# kind -> async executor(guild, args, context), registered with @executor
+EXECUTORS = {}
+# kind -> function(args) naming the rate-limit bucket, operations default to one bucket per kind
+BUCKETS = {}
+
+_running = set()  # Plan IDs currently executing in this process
+
+
+def executor(kind:str, bucket=None):
+    def register(function):
+        EXECUTORS[kind] = function
+        if bucket is not None:
+            BUCKETS[kind] = bucket
+        return function
+    return register
+
+
+def bucketFor(operation):
+    bucket = BUCKETS.get(operation.kind)
+    return bucket(operation.args) if bucket else operation.kind
+
+
+class Operation:
+    def __init__(self, seq:int, phase:int, kind:str, label:str, args:dict, status:str='pending', error:str=None):
+        self.seq = seq
+        self.phase = phase
+        self.kind = kind
+        self.label = label
+        self.args = args
+        self.status = status
+        self.error = error
+
+
+class Plan:
+    def __init__(self, guildId:int, command:str, planId:int=None, status:str='draft'):
+        self.id = planId
+        self.guildId = guildId
+        self.command = command
+        self.status = status
+        self.operations = []
+
+    def add(self, kind:str, phase:int, label:str, **args):
+        self.operations.append(Operation(len(self.operations), phase, kind, label, args))
+
+    def pending(self):
+        return [operation for operation in self.operations if operation.status != 'done']
+
+    def preview(self, limit:int=PREVIEW_LINES):
+        if not self.operations:
+            return "Nothing to change."
+        counts = Counter(operation.kind for operation in self.operations)
+        lines = [", ".join(f"{count} {kind}" for kind, count in counts.items())]
+        lines += [f"- {operation.label}" for operation in self.operations[:limit]]
+        if len(self.operations) > limit:
+            lines.append(f"- ...and {len(self.operations) - limit} more")
+        return "\n".join(lines)
+
+
+# Per-run scratch space, e.g. objects created earlier in the run that the gateway has not delivered yet
+class RunContext:
+    def __init__(self, guild:discord.Guild):
+        self.guild = guild
+        self.roles = {}
+        self.channels = {}  # (category ID or None, name) -> channel
+        self.categories = {}
+
+    def role(self, name:str):
+        return self.roles.get(name) or discord.utils.get(self.guild.roles, name=name)
+
+    def channel(self, name:str, category:discord.CategoryChannel=None):
+        key = (category.id if category else None, name)
+        if key in self.channels:
+            return self.channels[key]
+        return discord.utils.get(category.channels if category else self.guild.channels, name=name)
+
+    def category(self, name:str):
+        return self.categories.get(name) or discord.utils.get(self.guild.categories, name=name)
+
+
+class Journal:
+    def __init__(self):
+        self.db = storage.ensureSchema(SCHEMA)
+
+    def save(self, plan:Plan, status:str):
+        cursor = self.db.execute(
+            "INSERT INTO plans (guild_id, command, status, created_at) VALUES (?, ?, ?, ?)",
+            (plan.guildId, plan.command, status, time.time())
+        )
+        plan.id = cursor.lastrowid
+        plan.status = status
+        self.db.executemany(
+            "INSERT INTO plan_operations (plan_id, seq, phase, kind, label, args, status) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(plan.id, op.seq, op.phase, op.kind, op.label, json.dumps(op.args), op.status) for op in plan.operations]
+        )
+        self.db.commit()
+        return plan.id
+
+    def setStatus(self, plan:Plan, status:str):
+        plan.status = status
+        self.db.execute("UPDATE plans SET status = ? WHERE id = ?", (status, plan.id))
+        self.db.commit()
+
+    def markOperation(self, plan:Plan, operation:Operation, status:str, error:str=None):
+        operation.status = status
+        operation.error = error
+        self.db.execute(
+            "UPDATE plan_operations SET status = ?, error = ? WHERE plan_id = ? AND seq = ?",
+            (status, error, plan.id, operation.seq)
+        )
+        self.db.commit()
+
+    def load(self, planId:int):
+        row = self.db.execute("SELECT * FROM plans WHERE id = ?", (planId,)).fetchone()
+        if row is None:
+            return None
+        plan = Plan(row['guild_id'], row['command'], planId=row['id'], status=row['status'])
+        for op in self.db.execute("SELECT * FROM plan_operations WHERE plan_id = ? ORDER BY seq", (planId,)):
+            plan.operations.append(Operation(op['seq'], op['phase'], op['kind'], op['label'], json.loads(op['args']), op['status'], op['error']))
+        return plan
+
+    # Most recent plan of a guild that can still be resumed
+    def latestResumable(self, guildId:int):
+        row = self.db.execute(
+            f"SELECT id FROM plans WHERE guild_id = ? AND status IN ({','.join('?' * len(RESUMABLE))}) ORDER BY id DESC LIMIT 1",
+            (guildId, *RESUMABLE)
+        ).fetchone()
+        return self.load(row['id']) if row else None
+
+
+_journal = None
+
+
+def journal():
+    global _journal
+    if _journal is None:
+        _journal = Journal()
+    return _journal
+
+
+def isRunning(plan:Plan):
+    return plan.id in _running
+
+
+# Execute every operation that has not completed yet, returns the aggregated BulkResult
+async def runPlan(plan:Plan, guild:discord.Guild, onProgress=None):
+    log = journal()
+    if plan.id is None:
+        log.save(plan, 'running')
+    else:
+        log.setStatus(plan, 'running')
+    _running.add(plan.id)
+    context = RunContext(guild)
+    pending = plan.pending()
+    result = bulk.BulkResult(len(pending))
+
+    def operationAction(operation:Operation):
+        async def action():
+            try:
+                value = await EXECUTORS[operation.kind](guild, operation.args, context)
+            except Exception as e:
+                log.markOperation(plan, operation, 'failed', str(e))
+                raise
+            log.markOperation(plan, operation, 'done')
+            return value
+        return action
+
+    try:
+        for phase in sorted({operation.phase for operation in pending}):
+            failedBefore = len(result.failed)
+            await bulk.runBulk(
+                [bulk.BulkOperation(op.label, bucketFor(op), operationAction(op)) for op in pending if op.phase == phase],
+                onProgress=onProgress,
+                result=result
+            )
+            if len(result.failed) > failedBefore:
+                break
+        log.setStatus(plan, 'failed' if result.failed or result.done < result.total else 'done')
+    except asyncio.CancelledError:
+        log.setStatus(plan, 'cancelled')  # Stopped by /cancel, /resume picks up the remaining operations
+        raise
+    finally:
+        _running.discard(plan.id)
+    return result
@@ -0,0 +1,622 @@
+import discord
+import bulk
+import overwrites
+from plans import Plan, executor
+
+# Compilers turn command input into plans, executors apply a single operation.
+# Executors resolve everything by ID or name when they run and skip work that is already in place,
+# so re-running an operation after a resume is harmless.
+
+
+# A role that a plan creates before it is assigned, stands in for the role while diffing
+class PendingRole:
+    def __init__(self, name:str):
+        self.name = name
+        self.members = []
+
+
+# Returns the plan and the listed roles that sit at or above the bot's top role and cannot be moved
+def compileRole(guild:discord.Guild, names:list):
+    plan = Plan(guild.id, "role")
+    roles = guild.roles
+    byName = {}
+    for role in roles:
+        byName.setdefault(role.name, role)
+    ceiling = guild.me.top_role.position
+
+    movable, unmovable = [], []
+    for name in dict.fromkeys(names):
+        role = byName.get(name)
+        if role is None:
+            plan.add("create_role", 0, f"Create role {name}", name=name)
+        elif role.is_default() or role.position >= ceiling:
+            unmovable.append(name)
+            continue
+        movable.append(name)
+
+    hierarchy = [role for role in roles if not role.is_default() and role.position < ceiling]
+    if plan.operations:
+        plan.add("role_positions", 1, f"Reorder {len(hierarchy) + len(plan.operations)} roles below the bot", names=movable)
+    elif movable:
+        moves = bulk.planRolePositions(hierarchy, [byName[name] for name in movable])
+        if moves:
+            plan.add("role_positions", 1, f"Reorder roles below the bot, {len(moves)} move", names=movable)
+    return plan, unmovable
+
+
+# rows maps role names to member identifiers, returns the plan and the identifiers that matched nobody
+def compileAssign(guild:discord.Guild, rows:dict, index):
+    plan = Plan(guild.id, "assign")
+    desired = {}
+    unresolved = []
+    for roleName, identifiers in rows.items():
+        role = discord.utils.get(guild.roles, name=roleName)
+        if role is None:
+            role = PendingRole(roleName)
+            plan.add("create_role", 0, f"Create role {roleName}", name=roleName)
+        members = desired.setdefault(role, set())
+        for identifier in identifiers:
+            # Mentions, IDs and exact usernames only, see MemberIndex.get
+            member = index.get(identifier)
+            if member:
+                members.add(member)
+            else:
+                unresolved.append(identifier)
+
+    # Collapse every role change into one edit per member
+    for member, (toAdd, toRemove) in bulk.planRoleDiff(desired).items():
+        plan.add(
+            "member_roles", 1, member.display_name,
+            member=member.id, add=sorted(role.name for role in toAdd), remove=sorted(role.name for role in toRemove)
+        )
+    return plan, unresolved
+
+
+def compileChannel(guild:discord.Guild, category:discord.CategoryChannel, names:list):
+    plan = Plan(guild.id, "channel")
+    existing = {channel.name for channel in category.channels}
+    for name in dict.fromkeys(names):
+        if name not in existing:
+            plan.add("create_channel", 0, f"Create #{name}", name=name, category=category.id)
+    if names:
+        plan.add("channel_positions", 1, f"Reorder {category.name}", names=names, category=category.id)
+    return plan
+
+
+def normalizeName(name:str):
+    return name.strip()
+
+
+# pairs are (old name, new name) tuples, returns the plan, a list of conflict messages and a list of
+# chained renames. Sources are bound by ID when compiling, so chained (a->b, b->c) and swapped renames
+# apply each item exactly once. Sources listed twice with different targets, targets claimed twice and
+# targets already taken by a channel or role that keeps its name are conflicts and skipped.
+def compileRename(guild:discord.Guild, pairs:list):
+    plan = Plan(guild.id, "rename")
+    conflicts = []
+
+    # Build the name lookups once instead of scanning every channel and role per line
+    channelsByName = {}
+    for channel in guild.channels:
+        channelsByName.setdefault(normalizeName(channel.name), []).append(channel)
+    rolesByName = {}
+    for role in guild.roles:
+        rolesByName.setdefault(normalizeName(role.name), []).append(role)
+
+    renames = {}
+    for oldName, newName in pairs:
+        oldName, newName = normalizeName(oldName), normalizeName(newName)
+        if not oldName or not newName or oldName == newName:
+            continue
+        if oldName in renames and renames[oldName] != newName:
+            conflicts.append(f"'{oldName}' is renamed to both '{renames[oldName]}' and '{newName}', skipped")
+            renames[oldName] = None
+        elif oldName not in renames:
+            renames[oldName] = newName
+
+    targets = {}
+    for oldName, newName in renames.items():
+        if newName is not None:
+            targets.setdefault(newName, []).append(oldName)
+    for newName, oldNames in targets.items():
+        if len(oldNames) > 1:
+            conflicts.append(f"{', '.join(repr(name) for name in oldNames)} would all be renamed to '{newName}', skipped")
+            for oldName in oldNames:
+                renames[oldName] = None
+
+    chained = []
+    for oldName, newName in renames.items():
+        if newName is None:
+            continue
+        # Whatever holds the new name now is renamed away in this batch, so it is free once applied
+        freed = renames.get(newName) is not None
+        if freed:
+            chained.append(f"'{oldName}' -> '{newName}' chains into '{newName}' -> '{renames[newName]}', each item is renamed once")
+        channels, roles = channelsByName.get(oldName, ()), rolesByName.get(oldName, ())
+        if channels and newName in channelsByName and not freed:
+            conflicts.append(f"a channel named '{newName}' already exists, renaming '{oldName}' would duplicate it, skipped")
+            channels = ()
+        if roles and newName in rolesByName and not freed:
+            conflicts.append(f"a role named '{newName}' already exists, renaming '{oldName}' would duplicate it, skipped")
+            roles = ()
+        for channel in channels:
+            plan.add("rename_channel", 0, f"Channel '{oldName}' -> '{newName}'", id=channel.id, name=newName)
+        for role in roles:
+            plan.add("rename_role", 0, f"Role '{oldName}' -> '{newName}'", id=role.id, name=newName)
+    return plan, conflicts, chained
+
+
+# Applies a /get changes patch (see ingest.parsePatch) without diffing the whole guild: each row
+# becomes at most one operation and membership rows are folded into one role edit per member.
+# Returns the plan and messages for the rows that were skipped (deletions and moves are never applied).
+def compilePatch(guild:discord.Guild, changes:list, index):
+    plan = Plan(guild.id, "patch")
+    skipped = []
+    roles = {}
+    for role in guild.roles:
+        roles.setdefault(role.name, role)
+    channels = {}
+    for channel in guild.channels:
+        channels.setdefault(channel.name, channel)
+    pending = set()  # Role names the plan creates or renames roles to
+    edits = {}  # member -> (role names to add, role names to remove)
+
+    for change in changes:
+        kind, what, itemId, name, target = change['kind'], change['change'], change['id'], change['name'], change['target']
+        where = f"line {change['line']}"
+        if kind == "role" and what == "added":
+            if name not in roles and name not in pending:
+                pending.add(name)
+                plan.add("create_role", 0, f"Create role {name}", name=name)
+        elif kind == "role" and what == "renamed":
+            role = (guild.get_role(itemId) if itemId else None) or roles.get(target)
+            if role is None:
+                skipped.append(f"{where}: role '{target or itemId}' not found")
+            elif role.name != name:
+                pending.add(name)
+                plan.add("rename_role", 0, f"Role '{role.name}' -> '{name}'", id=role.id, name=name)
+        elif kind == "channel" and what == "added":
+            category = channels.get(target) if target else None
+            if target and (category is None or str(category.type) != "category"):
+                skipped.append(f"{where}: category '{target}' not found")
+            elif discord.utils.get(category.channels if category else guild.channels, name=name) is None:
+                plan.add("create_channel", 0, f"Create #{name}", name=name, category=category.id if category else None)
+        elif kind in ("channel", "category") and what == "renamed":
+            channel = (guild.get_channel(itemId) if itemId else None) or channels.get(target)
+            if channel is None:
+                skipped.append(f"{where}: {kind} '{target or itemId}' not found")
+            elif channel.name != name:
+                plan.add("rename_channel", 0, f"Channel '{channel.name}' -> '{name}'", id=channel.id, name=name)
+        elif kind == "member" and what in ("added", "removed"):
+            member = (guild.get_member(itemId) if itemId else None) or (index.get(name) if name else None)
+            if member is None:
+                skipped.append(f"{where}: member '{name or itemId}' not found")
+                continue
+            if target not in roles and target not in pending:
+                skipped.append(f"{where}: role '{target}' not found")
+                continue
+            toAdd, toRemove = edits.setdefault(member, (set(), set()))
+            (toAdd if what == "added" else toRemove).add(target)
+        else:
+            skipped.append(f"{where}: {kind} {what} changes are not applied from patches")
+
+    for member, (toAdd, toRemove) in edits.items():
+        plan.add("member_roles", 1, member.display_name, member=member.id, add=sorted(toAdd - toRemove), remove=sorted(toRemove - toAdd))
+    return plan, skipped
+
+
+# pairs are (channel, paired role or None) tuples and rules come from overwrites.parseTemplate. Only
+# overwrites that would change get an operation, so the plan doubles as the dry-run diff. Returns the
+# plan and the template's role names that matched no role.
+def compileOverwrites(guild:discord.Guild, pairs:list, rules:list):
+    plan = Plan(guild.id, "permissions")
+    byName = {}
+    for role in guild.roles:
+        byName.setdefault(role.name, role)
+    missing = []
+    fixed = []  # (rule, role) for rules naming the same role on every channel
+    for rule in rules:
+        if rule.target == overwrites.PAIRED:
+            continue
+        role = guild.default_role if rule.target == overwrites.EVERYONE else byName.get(rule.target)
+        if role is None:
+            missing.append(rule.target)
+        else:
+            fixed.append((rule, role))
+    pairedRules = [rule for rule in rules if rule.target == overwrites.PAIRED]
+
+    for channel, paired in pairs:
+        targets = {}  # role -> rules in template order, several rules on one role are folded together
+        for rule, role in fixed:
+            targets.setdefault(role, []).append(rule)
+        if paired is not None:
+            for rule in pairedRules:
+                targets.setdefault(paired, []).append(rule)
+        for role, roleRules in targets.items():
+            rule = overwrites.combine(roleRules)
+            old = overwrites.current(channel, role)
+            new = rule.apply(*old)
+            if new != old:
+                plan.add(
+                    "set_overwrite", 0, f"#{channel.name} {role.name}: {overwrites.describe(old, new)}",
+                    channel=channel.id, role=role.id, allow=rule.allow, deny=rule.deny, clear=rule.clear
+                )
+    return plan, missing
+
+
+# Rebuilds the structure recorded by archive.capture. Roles, categories and channels are matched by ID
+# when restoring into the same guild, then by name (channels by name within their category), so only
+# what differs gets an operation and a fresh guild gets everything created. Nothing is deleted.
+# Returns the plan and notes about what is left out.
+def compileRestore(guild:discord.Guild, state:dict):
+    plan = Plan(guild.id, "restore")
+    notes = []
+    sameGuild = state['guild'] == guild.id
+    ceiling = guild.me.top_role.position
+    rolesByName = {}
+    for role in guild.roles:
+        rolesByName.setdefault(role.name, role)
+
+    # Roles, bottom to top
+    roleNames = {}  # archived role ID -> name, to resolve overwrite targets
+    desired = {}  # role -> members it should have
+    restoredNames = {}  # role -> the name it has once the restore ran
+    listed = []
+    rolesCreated = False
+    skippedMembers = 0
+    for roleId, name, colour, permissions, hoist, mentionable, memberIds in state['roles']:
+        roleNames[roleId] = name
+        attributes = {'colour': colour, 'permissions': permissions, 'hoist': hoist, 'mentionable': mentionable}
+        role = (guild.get_role(roleId) if sameGuild else None) or rolesByName.get(name)
+        if role is None:
+            plan.add("create_role", 0, f"Create role {name}", name=name, **attributes)
+            role = PendingRole(name)
+            rolesCreated = True
+        elif role.is_default() or role.managed or role.position >= ceiling:
+            notes.append(f"role '{name}' is managed or not below the bot's top role, left as is")
+            continue
+        else:
+            if role.name != name:
+                plan.add("rename_role", 0, f"Role '{role.name}' -> '{name}'", id=role.id, name=name)
+            current = _roleAttributes(role)
+            changed = {key: value for key, value in attributes.items() if current[key] != value}
+            if changed:
+                plan.add("edit_role", 0, f"Update role {name}: {', '.join(changed)}", id=role.id, **changed)
+        members = {member for member in map(guild.get_member, memberIds) if member is not None}
+        skippedMembers += len(memberIds) - len(members)
+        desired[role] = members
+        restoredNames[role] = name
+        listed.append(name)
+    everyone = state.get('everyone')
+    if everyone is not None and guild.default_role.permissions.value != everyone:
+        plan.add("edit_role", 0, "Update @everyone permissions", id=guild.default_role.id, permissions=everyone)
+    if rolesCreated:
+        plan.add("role_positions", 1, f"Reorder {len(listed)} restored roles", names=listed)
+    elif listed:
+        hierarchy = [role for role in guild.roles if not role.is_default() and role.position < ceiling]
+        if bulk.planRolePositions(hierarchy, list(desired)):
+            plan.add("role_positions", 1, f"Reorder {len(listed)} restored roles", names=listed)
+
+    # Overwrite targets by the name their role will have, so they resolve once created or renamed
+    def overwriteSpecs(rows:list):
+        specs = []
+        for kind, targetId, allow, deny in rows:
+            if kind == "member":
+                specs.append(["member", targetId, allow, deny])
+            elif targetId == state['guild']:
+                specs.append(["role", overwrites.EVERYONE, allow, deny])
+            elif targetId in roleNames:
+                specs.append(["role", roleNames[targetId], allow, deny])
+            elif sameGuild and guild.get_role(targetId) is not None:
+                specs.append(["role", guild.get_role(targetId).name, allow, deny])  # Managed roles are not archived
+        return specs
+
+    def changedOverwrites(channel, specs:list):
+        changed = []
+        for spec in specs:
+            kind, key, allow, deny = spec
+            if kind == "member":
+                target = guild.get_member(key)
+                if target is None:
+                    continue
+            else:
+                target = guild.default_role if key == overwrites.EVERYONE else rolesByName.get(key)
+            if target is None or overwrites.current(channel, target) != (allow, deny):
+                changed.append(spec)
+        return changed
+
+    # Categories, then channels within them
+    categoriesByName = {}
+    for category in guild.categories:
+        categoriesByName.setdefault(category.name, category)
+    categoryNames = {}  # archived category ID -> name
+    matchedCategories = {}  # name -> existing category
+    restoredCategories = []
+    structureCreated = False
+    for categoryId, name, rows in state['categories']:
+        categoryNames[categoryId] = name
+        restoredCategories.append(name)
+        category = guild.get_channel(categoryId) if sameGuild else None
+        if category is None or str(category.type) != "category":
+            category = categoriesByName.get(name)
+        specs = overwriteSpecs(rows)
+        if category is None:
+            plan.add("create_category", 1, f"Create category {name}", name=name, overwrites=specs)
+            structureCreated = True
+            continue
+        matchedCategories[name] = category
+        if category.name != name:
+            plan.add("rename_channel", 0, f"Category '{category.name}' -> '{name}'", id=category.id, name=name)
+        changed = changedOverwrites(category, specs)
+        if changed:
+            plan.add("channel_overwrites", 1, f"Overwrites of category {name}: {len(changed)} targets", channel=category.id, overwrites=changed)
+
+    categoryIds = {category.id: category.name for category in guild.categories}
+    channelsByKey = {}
+    for channel in guild.channels:
+        if str(channel.type) != "category":
+            channelsByKey.setdefault((categoryIds.get(channel.category_id), channel.name), channel)
+    positions = []  # (existing channel ID or None, category name, name) in archive order
+    for channelId, name, kind, categoryId, topic, rows in state['channels']:
+        categoryName = categoryNames.get(categoryId)
+        channel = guild.get_channel(channelId) if sameGuild else None
+        if channel is None or str(channel.type) == "category":
+            channel = channelsByKey.get((categoryName, name))
+        specs = overwriteSpecs(rows)
+        if channel is None:
+            if kind not in ("text", "voice"):
+                notes.append(f"#{name}: {kind} channels are not restored")
+                continue
+            plan.add(
+                "create_channel", 2, f"Create #{name}" + (f" in {categoryName}" if categoryName else ""),
+                name=name, category=None, category_name=categoryName, channel_type=kind, topic=topic, overwrites=specs
+            )
+            structureCreated = True
+            positions.append([None, categoryName, name])
+            continue
+        if channel.name != name:
+            plan.add("rename_channel", 0, f"Channel '{channel.name}' -> '{name}'", id=channel.id, name=name)
+        changed = changedOverwrites(channel, specs)
+        if changed:
+            plan.add("channel_overwrites", 1, f"Overwrites of #{name}: {len(changed)} targets", channel=channel.id, overwrites=changed)
+        positions.append([channel.id, categoryName, name])
+    if structureCreated or restorePositions(guild, restoredCategories, positions, matchedCategories.get, lambda channelId, name, category: guild.get_channel(channelId)):
+        plan.add("restore_positions", 3, f"Order {len(restoredCategories)} categories and {len(positions)} channels", categories=restoredCategories, channels=positions)
+
+    # Membership of the restored roles, one edit per member. Only missing roles are given back, members
+    # who hold a role without being in the snapshot (e.g. given it since) keep it
+    for member, (toAdd, _) in bulk.planRoleDiff(desired).items():
+        if toAdd:
+            plan.add("member_roles", 3, member.display_name, member=member.id, add=sorted(restoredNames[role] for role in toAdd), remove=[])
+    if skippedMembers:
+        notes.append(f"{skippedMembers} role memberships of members no longer in the server are skipped")
+    return plan, notes
+
+
+# Role attributes a restore compares, as plain values
+def _roleAttributes(role:discord.Role):
+    return {'colour': role.color.value, 'permissions': role.permissions.value, 'hoist': role.hoist, 'mentionable': role.mentionable}
+
+
+# create_role and Role.edit keyword arguments from plain role attributes
+def _roleFields(args:dict):
+    fields = {key: args[key] for key in ('hoist', 'mentionable') if key in args}
+    if 'colour' in args:
+        fields['colour'] = discord.Colour(args['colour'])
+    if 'permissions' in args:
+        fields['permissions'] = discord.Permissions(args['permissions'])
+    return fields
+
+
+def _overwriteTarget(guild:discord.Guild, context, kind:str, key):
+    if kind == "member":
+        return guild.get_member(key)
+    return guild.default_role if key == overwrites.EVERYONE else context.role(key)
+
+
+# Overwrites for creating a channel, from [kind, role name or member ID, allow, deny] specs
+def _resolveOverwrites(guild:discord.Guild, context, specs:list):
+    resolved = {}
+    for kind, key, allow, deny in specs:
+        target = _overwriteTarget(guild, context, kind, key)
+        overwrite = overwrites.build(allow, deny)
+        if target is not None and overwrite is not None:
+            resolved[target] = overwrite
+    return resolved
+
+
+# Bulk position payload putting categories and channels in archive order. channels are (channel ID or
+# None, category name, name) entries; a category's channels that are not listed keep their relative
+# order after the listed ones, and listed channels found in another category are moved.
+def restorePositions(guild:discord.Guild, categories:list, channels:list, findCategory, findChannel):
+    payload = []
+    ordered = list(dict.fromkeys(category for category in map(findCategory, categories) if category is not None))
+    ordered += [category for category in sorted(guild.categories, key=lambda category: (category.position, category.id)) if category not in ordered]
+    for position, category in enumerate(ordered):
+        if category.position != position:
+            payload.append({'id': category.id, 'position': position})
+
+    groups, placed = {}, set()
+    for channelId, categoryName, name in channels:
+        category = findCategory(categoryName) if categoryName else None
+        if categoryName and category is None:
+            continue  # The category is missing, leave its channels where they are
+        channel = findChannel(channelId, name, category)
+        if channel is not None and channel not in placed:
+            placed.add(channel)
+            groups.setdefault(category, []).append(channel)
+    for category, listed in groups.items():
+        current = category.channels if category else [channel for channel in guild.channels if channel.category_id is None and str(channel.type) != "category"]
+        parentId = category.id if category else None
+        listed += [channel for channel in sorted(current, key=lambda channel: (channel.position, channel.id)) if channel not in placed]
+        for position, channel in enumerate(listed):
+            entry = {'id': channel.id, 'position': position}
+            if channel.category_id != parentId:
+                entry['parent_id'] = parentId
+            if channel.position != position or 'parent_id' in entry:
+                payload.append(entry)
+    return payload
+
+
+@executor("create_role")
+async def createRole(guild:discord.Guild, args:dict, context):
+    role = context.role(args['name'])
+    if role is None:
+        role = context.roles[args['name']] = await guild.create_role(name=args['name'], **_roleFields(args))
+    return role
+
+
+@executor("edit_role")
+async def editRole(guild:discord.Guild, args:dict, context):
+    role = guild.get_role(args['id'])
+    if role is None:
+        raise ValueError("role no longer exists")
+    current = _roleAttributes(role)
+    fields = _roleFields({key: value for key, value in args.items() if key in current and current[key] != value})
+    if fields:
+        await role.edit(**fields)
+
+
+# The whole hierarchy below the bot is reordered in one request, only roles that move are sent
+@executor("role_positions")
+async def rolePositions(guild:discord.Guild, args:dict, context):
+    # Creating roles shifts positions before the gateway reports it, so read them back from the API then
+    roles = await guild.fetch_roles() if context.roles else guild.roles
+    topRoleId = guild.me.top_role.id
+    ceiling = next((role.position for role in roles if role.id == topRoleId), guild.me.top_role.position)
+    hierarchy = [role for role in roles if not role.is_default() and role.position < ceiling]
+    byName = {}
+    for role in hierarchy:
+        byName.setdefault(role.name, role)
+    listed = list(dict.fromkeys(byName[name] for name in args['names'] if name in byName))
+    positions = bulk.planRolePositions(hierarchy, listed)
+    if positions:
+        await guild.edit_role_positions(positions=positions)
+    return len(positions)
+
+
+@executor("member_roles")
+async def memberRoles(guild:discord.Guild, args:dict, context):
+    member = guild.get_member(args['member']) or await guild.fetch_member(args['member'])
+    toAdd = set(map(context.role, args['add']))
+    if None in toAdd:
+        # A role created by this plan is found through context.roles, never wait for the gateway to cache it
+        missing = [name for name in args['add'] if context.role(name) is None]
+        raise ValueError(f"roles not found: {', '.join(missing)}")
+    toRemove = {role for role in map(context.role, args['remove']) if role is not None}
+    roles = bulk.mergeRoles(member, toAdd, toRemove)
+    if set(roles) != {role for role in member.roles if not role.is_default()}:
+        await member.edit(roles=roles)
+
+
+@executor("create_category")
+async def createCategory(guild:discord.Guild, args:dict, context):
+    category = context.category(args['name'])
+    if category is None:
+        category = context.categories[args['name']] = await guild.create_category(
+            args['name'], overwrites=_resolveOverwrites(guild, context, args.get('overwrites', []))
+        )
+    return category
+
+
+# Plans from /channel name the category by ID, restores by name since it may be created in the same run
+@executor("create_channel")
+async def createChannel(guild:discord.Guild, args:dict, context):
+    if args.get('category_name'):
+        category = context.category(args['category_name'])
+        if category is None:
+            raise ValueError(f"category '{args['category_name']}' not found")
+    else:
+        category = guild.get_channel(args['category'])
+    channel = context.channel(args['name'], category)
+    if channel is None:
+        fields = {}
+        if args.get('overwrites'):
+            fields['overwrites'] = _resolveOverwrites(guild, context, args['overwrites'])
+        if args.get('channel_type') == "voice":
+            create = guild.create_voice_channel
+        else:
+            create = guild.create_text_channel
+            if args.get('topic'):
+                fields['topic'] = args['topic']
+        channel = context.channels[(category.id if category else None, args['name'])] = await create(args['name'], category=category, **fields)
+    return channel
+
+
+@executor("channel_positions")
+async def channelPositions(guild:discord.Guild, args:dict, context):
+    category = guild.get_channel(args['category'])
+    # Listed channels first in the given order, then any unlisted channels keep their relative order
+    listed = [context.channel(name, category) for name in args['names']]
+    ordered = list(dict.fromkeys(channel for channel in listed if channel is not None))
+    ordered += [channel for channel in sorted(category.channels, key=lambda c: c.position) if channel not in ordered]
+    return await bulk.editChannelPositions(guild, ordered)
+
+
+@executor("rename_channel", bucket=lambda args: f"channel:{args['id']}")
+async def renameChannel(guild:discord.Guild, args:dict, context):
+    channel = guild.get_channel(args['id'])
+    if channel is None:
+        raise ValueError("channel no longer exists")
+    if channel.name != args['name']:
+        await channel.edit(name=args['name'])
+    # Later phases find it by its new name before the gateway catches up
+    if str(channel.type) == "category":
+        context.categories[args['name']] = channel
+    else:
+        context.channels[(channel.category_id, args['name'])] = channel
+
+
+@executor("rename_role")
+async def renameRole(guild:discord.Guild, args:dict, context):
+    role = guild.get_role(args['id'])
+    if role is None:
+        raise ValueError("role no longer exists")
+    if role.name != args['name']:
+        await role.edit(name=args['name'])
+    context.roles[args['name']] = role  # Later phases find it by its new name before the gateway catches up
+
+
+# Overwrites of different channels are separate rate-limit buckets, so a template applies to every
+# channel concurrently
+@executor("set_overwrite", bucket=lambda args: f"overwrites:{args['channel']}")
+async def setOverwrite(guild:discord.Guild, args:dict, context):
+    channel = guild.get_channel(args['channel'])
+    if channel is None:
+        raise ValueError("channel no longer exists")
+    role = guild.get_role(args['role'])
+    if role is None:
+        raise ValueError("role no longer exists")
+    rule = overwrites.Rule(role.name)
+    rule.allow, rule.deny, rule.clear = args['allow'], args['deny'], args['clear']
+    old = overwrites.current(channel, role)
+    new = rule.apply(*old)
+    if new != old:
+        await channel.set_permissions(role, overwrite=overwrites.build(*new), reason="Permission template")
+
+
+# Restores a channel's archived overwrites, each target is only written when it differs
+@executor("channel_overwrites", bucket=lambda args: f"overwrites:{args['channel']}")
+async def channelOverwrites(guild:discord.Guild, args:dict, context):
+    channel = guild.get_channel(args['channel'])
+    if channel is None:
+        raise ValueError("channel no longer exists")
+    written = 0
+    for kind, key, allow, deny in args['overwrites']:
+        target = _overwriteTarget(guild, context, kind, key)
+        if target is not None and overwrites.current(channel, target) != (allow, deny):
+            await channel.set_permissions(target, overwrite=overwrites.build(allow, deny), reason="Snapshot restore")
+            written += 1
+    return written
+
+
+# Category order, channel order and channel categories in a single bulk request
+@executor("restore_positions")
+async def restoredPositions(guild:discord.Guild, args:dict, context):
+    def findChannel(channelId, name, category):
+        return guild.get_channel(channelId) if channelId else context.channel(name, category)
+
+    payload = restorePositions(guild, args['categories'], args['channels'], context.category, findChannel)
+    if payload:
+        await guild._state.http.bulk_channel_update(guild.id, payload, reason="Snapshot restore")
+    return len(payload)
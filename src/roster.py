@@ -0,0 +1,169 @@
+from array import array
+import storage
+from structs import Person
+
+# Student rosters for onboarding, one per guild. A roster of tens of thousands of students is held
+# column-wise: parallel lists for the strings, an array of Discord IDs and the course roles as
+# interned indexes in one flat array (CSR layout), with dict indexes by student ID, Discord ID and
+# username. Rosters are persisted to SQLite and loaded lazily on first use.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS roster (
+    guild_id INTEGER NOT NULL,
+    row INTEGER NOT NULL,
+    student_id TEXT NOT NULL,
+    first_name TEXT NOT NULL,
+    last_name TEXT NOT NULL,
+    discord_id INTEGER,
+    username TEXT,
+    courses TEXT NOT NULL,
+    PRIMARY KEY (guild_id, row)
+);
+"""
+
+COURSE_SEPARATOR = "\x1f"  # Joins course names in the courses column
+
+_rosters = {}
+
+
+class Roster:
+    __slots__ = (
+        'guildId', 'studentIds', 'firstNames', 'lastNames', 'discordIds', 'usernames',
+        'courseNames', 'courseStarts', 'courseRefs', 'byStudent', 'byDiscord', 'byUsername'
+    )
+
+    def __init__(self, guildId:int):
+        self.guildId = guildId
+        self.studentIds = []
+        self.firstNames = []
+        self.lastNames = []
+        self.discordIds = array('Q')  # 0 until the student is linked to a Discord account
+        self.usernames = {}  # row -> Discord username from the roster file, only rows that have one
+        self.courseNames = []  # Interned course role names
+        self.courseStarts = array('I', [0])  # Row i's courses are courseRefs[courseStarts[i]:courseStarts[i + 1]]
+        self.courseRefs = array('I')
+        self.byStudent = {}
+        self.byDiscord = {}
+        self.byUsername = {}
+
+    def __len__(self):
+        return len(self.studentIds)
+
+    def append(self, studentId:str, firstName:str, lastName:str, discordId:int, username:str, courses:list, interned:dict):
+        row = len(self.studentIds)
+        self.studentIds.append(studentId)
+        self.firstNames.append(firstName)
+        self.lastNames.append(lastName)
+        self.discordIds.append(discordId or 0)
+        self.byStudent[studentId] = row
+        if discordId:
+            self.byDiscord[discordId] = row
+        if username:
+            self.usernames[row] = username
+            self.byUsername[username.casefold()] = row
+        for course in courses:
+            index = interned.get(course)
+            if index is None:
+                index = interned[course] = len(self.courseNames)
+                self.courseNames.append(course)
+            self.courseRefs.append(index)
+        self.courseStarts.append(len(self.courseRefs))
+        return row
+
+    def courses(self, row:int):
+        return [self.courseNames[index] for index in self.courseRefs[self.courseStarts[row]:self.courseStarts[row + 1]]]
+
+    def person(self, row:int):
+        return Person(self.firstNames[row], self.lastNames[row], self.studentIds[row])
+
+    def find(self, studentId:str):
+        return self.byStudent.get(studentId.strip())
+
+    # The roster row of a guild member, by linked Discord ID or the username given in the roster file
+    def forMember(self, member):
+        row = self.byDiscord.get(member.id)
+        if row is None:
+            row = self.byUsername.get(member.name.casefold())
+        return row
+
+    def linkedTo(self, row:int):
+        return self.discordIds[row] or None
+
+    # Tie a roster row to a Discord account, e.g. after the member verified their student ID. An account
+    # is linked to at most one row, otherwise one member could collect every student's course roles.
+    def link(self, row:int, discordId:int):
+        previous = self.discordIds[row]
+        if previous == discordId:
+            return
+        if self.byDiscord.get(discordId, row) != row:
+            raise ValueError("This account is already linked to another student ID")
+        if previous:
+            self.byDiscord.pop(previous, None)
+        self.discordIds[row] = discordId
+        self.byDiscord[discordId] = row
+        db = storage.ensureSchema(SCHEMA)
+        db.execute("UPDATE roster SET discord_id = ? WHERE guild_id = ? AND row = ?", (discordId, self.guildId, row))
+        db.commit()
+
+    def stats(self):
+        return {
+            'students': len(self),
+            'linked': len(self.byDiscord),
+            'courses': len(self.courseNames),
+            'enrollments': len(self.courseRefs),
+        }
+
+
+def _discordColumn(value:str):
+    value = value.strip()
+    if value.startswith("<@") and value.endswith(">"):
+        value = value[2:-1].lstrip("!")
+    return (int(value), None) if value.isdigit() else (None, value or None)
+
+
+# Replace the guild's roster with parsed entries (see ingest.parseRoster). Links made by verification
+# are kept for students that are still on the new roster, unless the new file gives that Discord account
+# to another student. Returns the roster and a note for every link that was dropped.
+def replace(guildId:int, entries:list):
+    previous = forGuild(guildId)
+    roster = Roster(guildId)
+    interned = {}
+    notes = []
+    columns = [_discordColumn(entry[3]) for entry in entries]
+    listed = {discordId for discordId, _ in columns if discordId is not None}
+    for (studentId, firstName, lastName, _, courses), (discordId, username) in zip(entries, columns):
+        if discordId is None and previous is not None and studentId in previous.byStudent:
+            linked = previous.linkedTo(previous.byStudent[studentId])
+            if linked is not None and (linked in listed or linked in roster.byDiscord):
+                notes.append(f"student '{studentId}': the linked account <@{linked}> now belongs to another student, verify again")
+            else:
+                discordId = linked
+        roster.append(studentId, firstName, lastName, discordId, username, courses, interned)
+
+    db = storage.ensureSchema(SCHEMA)
+    with db:
+        db.execute("DELETE FROM roster WHERE guild_id = ?", (guildId,))
+        db.executemany(
+            "INSERT INTO roster (guild_id, row, student_id, first_name, last_name, discord_id, username, courses) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                (guildId, row, roster.studentIds[row], roster.firstNames[row], roster.lastNames[row],
+                 roster.linkedTo(row), roster.usernames.get(row), COURSE_SEPARATOR.join(roster.courses(row)))
+                for row in range(len(roster))
+            )
+        )
+    _rosters[guildId] = roster
+    return roster, notes
+
+
+# The guild's roster, loaded from disk the first time, None when no roster was uploaded
+def forGuild(guildId:int):
+    if guildId in _rosters:
+        return _rosters[guildId]
+    db = storage.ensureSchema(SCHEMA)
+    roster = Roster(guildId)
+    interned = {}
+    for row in db.execute("SELECT * FROM roster WHERE guild_id = ? ORDER BY row", (guildId,)):
+        courses = row['courses'].split(COURSE_SEPARATOR) if row['courses'] else []
+        roster.append(row['student_id'], row['first_name'], row['last_name'], row['discord_id'], row['username'], courses, interned)
+    _rosters[guildId] = roster if len(roster) else None
+    return _rosters[guildId]
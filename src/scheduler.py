@@ -0,0 +1,143 @@
+import asyncio
+import heapq
+import json
+import time
+import discord
+import broadcast
+import shards
+import storage
+
+# Durable message scheduler. Jobs live in SQLite and survive restarts; in memory only a min-heap of
+# (due time, job ID) pairs is kept, and a single timer loop sleeps until the earliest one is due.
+# A job can fan out to many channels and can repeat at a fixed interval.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scheduled_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    guild_id INTEGER,
+    channel_ids TEXT NOT NULL,
+    message TEXT NOT NULL,
+    due_at REAL NOT NULL,
+    interval_seconds REAL,
+    status TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS scheduled_jobs_pending ON scheduled_jobs (status, due_at);
+"""
+
+REPEATS = {'none': None, 'hourly': 3600, 'daily': 86400, 'weekly': 604800}
+
+
+class Scheduler:
+    def __init__(self, client:discord.Client):
+        self.client = client
+        self.db = storage.ensureSchema(SCHEMA)
+        self.heap = []
+        self.wake = asyncio.Event()
+        self.task = None
+        self.firing = set()  # Delivery tasks in flight, referenced so they are not garbage collected
+        self.conditions = {}  # Job ID -> in-process condition callable, not persisted
+
+    # Reload every pending job of the guilds this process serves and start the timer loop
+    def start(self):
+        self.heap = [
+            (row['due_at'], row['id']) for row in self.db.execute("SELECT id, guild_id, due_at FROM scheduled_jobs WHERE status = 'pending'")
+            if shards.ownsGuild(self.client, row['guild_id'])
+        ]
+        heapq.heapify(self.heap)
+        self.task = asyncio.create_task(self.run())
+        return len(self.heap)
+
+    def schedule(self, guildId:int, channelIds:list, message:str, dueAt:float, interval:float=None, condition=None):
+        cursor = self.db.execute(
+            "INSERT INTO scheduled_jobs (guild_id, channel_ids, message, due_at, interval_seconds, status) VALUES (?, ?, ?, ?, ?, 'pending')",
+            (guildId, json.dumps(channelIds), message, dueAt, interval)
+        )
+        self.db.commit()
+        if condition is not None:
+            self.conditions[cursor.lastrowid] = condition
+        self._push(dueAt, cursor.lastrowid)
+        return cursor.lastrowid
+
+    # Cancelled jobs stay in the heap and are dropped when they come due
+    def cancel(self, jobId:int, guildId:int):
+        cursor = self.db.execute("UPDATE scheduled_jobs SET status = 'cancelled' WHERE id = ? AND guild_id = ? AND status = 'pending'", (jobId, guildId))
+        self.db.commit()
+        self.conditions.pop(jobId, None)
+        return cursor.rowcount > 0
+
+    def pending(self, guildId:int, limit:int=25):
+        return self.db.execute(
+            "SELECT * FROM scheduled_jobs WHERE guild_id = ? AND status = 'pending' ORDER BY due_at LIMIT ?", (guildId, limit)
+        ).fetchall()
+
+    def _push(self, dueAt:float, jobId:int):
+        heapq.heappush(self.heap, (dueAt, jobId))
+        if self.heap[0][1] == jobId:
+            self.wake.set()  # New earliest job, re-arm the timer
+
+    async def run(self):
+        while True:
+            if not self.heap:
+                self.wake.clear()
+                await self.wake.wait()
+                continue
+            dueAt, jobId = self.heap[0]
+            delay = dueAt - time.time()
+            if delay > 0:
+                self.wake.clear()
+                try:
+                    await asyncio.wait_for(self.wake.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heapq.heappop(self.heap)
+            task = asyncio.create_task(self.fire(jobId, dueAt))
+            self.firing.add(task)
+            task.add_done_callback(self.firing.discard)
+
+    async def fire(self, jobId:int, dueAt:float):
+        job = self.db.execute("SELECT * FROM scheduled_jobs WHERE id = ?", (jobId,)).fetchone()
+        if job is None or job['status'] != 'pending' or job['due_at'] != dueAt:
+            return  # Cancelled or rescheduled since it was queued
+        condition = self.conditions.get(jobId)
+        failed = False
+        try:
+            if condition is None or condition():
+                await self.deliver(json.loads(job['channel_ids']), job['message'])
+        except Exception as e:
+            # Recurring jobs are still rescheduled, one-shot jobs are marked failed rather than retried
+            print(f"Scheduled message #{jobId} failed: {e!r}")
+            failed = True
+
+        if job['interval_seconds']:
+            # Next occurrence in the future, missed occurrences (e.g. while offline) are skipped
+            interval = job['interval_seconds']
+            nextDue = dueAt + interval * (int((time.time() - dueAt) // interval) + 1)
+            self.db.execute("UPDATE scheduled_jobs SET due_at = ? WHERE id = ?", (nextDue, jobId))
+            self.db.commit()
+            self._push(nextDue, jobId)
+        else:
+            self.db.execute("UPDATE scheduled_jobs SET status = ? WHERE id = ?", ('failed' if failed else 'sent', jobId))
+            self.db.commit()
+            self.conditions.pop(jobId, None)
+
+    async def deliver(self, channelIds:list, message:str):
+        result = await broadcast.sendToChannels(self.client, channelIds, message)
+        if result.failed:
+            print(f"Scheduled message failed for {len(result.failed)} channels:\n{result.failureReport()}")
+        return result
+
+
+_scheduler = None
+
+
+def start(client:discord.Client):
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = Scheduler(client)
+        print(f"Loaded {_scheduler.start()} scheduled messages")
+    return _scheduler
+
+
+def get():
+    return _scheduler
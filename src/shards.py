@@ -0,0 +1,107 @@
+import os
+import time
+import discord
+import jobqueue
+
+# Sharded deployment. SHARD_COUNT unset runs a plain unsharded client, 'auto' uses Discord's
+# recommended shard count and a number fixes it. SHARD_IDS (e.g. '0,1') limits this process to some
+# of the shards, so the shards can be split over several processes sharing the same database.
+SHARD_COUNT = os.getenv('SHARD_COUNT')
+SHARD_IDS = os.getenv('SHARD_IDS')
+
+
+def createClient(intents:discord.Intents, **options):
+    if not SHARD_COUNT:
+        return discord.Client(intents=intents, **options)
+    shardCount = None if SHARD_COUNT == 'auto' else int(SHARD_COUNT)
+    shardIds = [int(shardId) for shardId in SHARD_IDS.split(',')] if SHARD_IDS else None
+    if shardIds is not None and shardCount is None:
+        raise ValueError("SHARD_IDS needs a numeric SHARD_COUNT")
+    return discord.AutoShardedClient(intents=intents, shard_count=shardCount, shard_ids=shardIds, **options)
+
+
+def isSharded(client:discord.Client):
+    return isinstance(client, discord.AutoShardedClient)
+
+
+# Whether a guild is served by this process, e.g. for work persisted in the shared database. Work
+# without a guild (scheduled DMs) belongs to shard 0, which is also the shard Discord sends DMs to.
+def ownsGuild(client:discord.Client, guildId:int):
+    if not isSharded(client) or client.shard_count is None:
+        return True
+    shardId = (guildId >> 22) % client.shard_count if guildId is not None else 0
+    return client.shard_ids is None or shardId in client.shard_ids
+
+
+class ShardHealth:
+    def __init__(self):
+        self.connectedAt = None
+        self.disconnects = 0
+        self.resumes = 0
+
+
+_health = {}
+
+
+def health(shardId:int):
+    shard = _health.get(shardId)
+    if shard is None:
+        shard = _health[shardId] = ShardHealth()
+    return shard
+
+
+# Gateway event hooks, the unsharded client reports as shard 0
+def onConnect(shardId:int):
+    health(shardId).connectedAt = time.time()
+
+
+def onDisconnect(shardId:int):
+    health(shardId).disconnects += 1
+
+
+def onResumed(shardId:int):
+    health(shardId).resumes += 1
+
+
+# One dict per shard this process runs: connection state, latency, guilds and queued jobs
+def report(client:discord.Client):
+    if isSharded(client):
+        connections = {shardId: (info.is_closed(), info.latency, info.is_ws_ratelimited()) for shardId, info in client.shards.items()}
+    else:
+        connections = {0: (client.is_closed(), client.latency, client.is_ws_ratelimited())}
+    guilds = {shardId: 0 for shardId in connections}
+    jobs = {shardId: 0 for shardId in connections}
+    for guild in client.guilds:
+        guilds[guild.shard_id] = guilds.get(guild.shard_id, 0) + 1
+        jobs[guild.shard_id] = jobs.get(guild.shard_id, 0) + jobqueue.depth(guild.id)
+
+    rows = []
+    for shardId, (closed, latency, ratelimited) in sorted(connections.items()):
+        shard = health(shardId)
+        rows.append({
+            'shard': shardId,
+            'up': not closed and latency == latency,  # Latency is NaN until the first heartbeat
+            'latency': latency if latency == latency else None,
+            'ratelimited': ratelimited,
+            'guilds': guilds[shardId],
+            'jobs': jobs[shardId],
+            'disconnects': shard.disconnects,
+            'resumes': shard.resumes,
+            'uptime': time.time() - shard.connectedAt if shard.connectedAt else None,
+        })
+    return rows
+
+
+# Human-readable summary for /shards
+def summary(client:discord.Client):
+    rows = report(client)
+    lines = [f"**Shards** ({client.shard_count or 1} total, {len(rows)} in this process)"]
+    for row in rows:
+        latency = f"{row['latency'] * 1000:.0f}ms" if row['latency'] is not None else "n/a"
+        uptime = f"{row['uptime'] / 3600:.1f}h" if row['uptime'] is not None else "n/a"
+        lines.append(
+            f"Shard {row['shard']}: {'up' if row['up'] else 'DOWN'}{' (gateway rate limited)' if row['ratelimited'] else ''}, "
+            f"{latency}, {row['guilds']} guilds, {row['jobs']} queued jobs, "
+            f"{row['disconnects']} disconnects / {row['resumes']} resumes, up {uptime}"
+        )
+    return "\n".join(lines)
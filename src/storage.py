@@ -0,0 +1,24 @@
+import os
+import sqlite3
+
+# Local SQLite database shared by everything the bot persists (plan journal, caches, schedules)
+DB_PATH = os.getenv('VALLEY_DB', 'valley.db')
+
+_connection = None
+
+
+def connect():
+    global _connection
+    if _connection is None:
+        _connection = sqlite3.connect(DB_PATH)
+        _connection.row_factory = sqlite3.Row
+        _connection.execute("PRAGMA journal_mode=WAL")
+        _connection.execute("PRAGMA synchronous=NORMAL")
+    return _connection
+
+
+def ensureSchema(schema:str):
+    connection = connect()
+    connection.executescript(schema)
+    connection.commit()
+    return connection
@@ -1,5 +1,7 @@
 class Person:
+    __slots__ = ('firstName', 'lastName', 'studentId')
+
     def __init__(self, firstName, lastName, studentId):
         self.firstName = firstName
         self.lastName = lastName
-        self.studentId = studentId
\ No newline at end of file
+        self.studentId = studentId
@@ -1,57 +1,95 @@
-import asyncio
 from datetime import datetime, timedelta
 import discord
+import gateway
+import memberindex
+import scheduler
 
+WEEKDAYS = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+RELATIVE_UNITS = {'m': 'minutes', 'h': 'hours', 'd': 'days', 'w': 'weeks'}
+
+# Accepts a time of day ("9am", "14:30"), optionally prefixed by a date ("2024-09-01 9am") or
+# weekday ("mon 9am"), or a relative time ("in 30m", "in 2h", "in 1d")
 def parseTimeString(currentTime, timeStr):
+    timeStr = timeStr.strip()
+    lowered = timeStr.lower()
     try:
-        # Attempt to parse time with AM/PM
-        if any(x in timeStr.lower() for x in ['am', 'pm']):
-            time = datetime.strptime(timeStr, "%I:%M%p" if ':' in timeStr else "%I%p")
-        else:
-            # Preliminary check for invalid hour ranges before attempting to parse
-            if ':' in timeStr:
-                hour, _, minute = timeStr.partition(':')
-                hour = int(hour)
-                minute = int(minute)
-            else:
-                hour = int(timeStr)
-                minute = 0
-            
-            if hour < 0 or hour > 23:
-                raise ValueError("Hour must be between 0 and 23 for 24-hour time format.")
-            if minute < 0 or minute > 59:
-                raise ValueError("Minute must be between 0 and 59.")
-            
-            # Create a datetime object using the valid hour and minute
-            if (hour > 0 and (hour < 8 or (hour == 8 and minute == 0))):
-                hour += 12
-            time = datetime.now().replace(hour=hour, minute=minute, second=0, microsecond=0)
-
-        # Replace the date part with today's date
-        nextTime = time.replace(year=currentTime.year, month=currentTime.month, day=currentTime.day)
-        
-        # Check if the parsed time is in the past; if so, add one day
-        if nextTime <= currentTime:
-            nextTime += timedelta(days=1)
+        if lowered.startswith('in '):
+            amount = lowered[3:].replace(' ', '')
+            if amount[-1:] not in RELATIVE_UNITS:
+                raise ValueError("Relative times must end in m, h, d or w.")
+            return currentTime + timedelta(**{RELATIVE_UNITS[amount[-1]]: int(amount[:-1])})
 
+        datePart, _, rest = timeStr.partition(' ')
+        day = parseDay(currentTime, datePart) if rest else None
+        if day is None:
+            return parseTimeOfDay(currentTime, timeStr)
+
+        nextTime = parseTimeOfDay(currentTime, rest.strip()).replace(year=day.year, month=day.month, day=day.day)
+        if nextTime <= currentTime:
+            if datePart.lower()[:3] not in WEEKDAYS:
+                raise ValueError("That date and time is in the past.")
+            nextTime += timedelta(days=7)
         return nextTime
     except ValueError as e:
         raise ValueError(f"Error parsing time: {str(e)}")
-    
-    
+
+
+# A "YYYY-MM-DD" date or the next occurrence (including today) of a weekday, None if it is neither
+def parseDay(currentTime, dayStr):
+    weekday = dayStr.lower()[:3]
+    if weekday in WEEKDAYS:
+        return currentTime + timedelta(days=(WEEKDAYS.index(weekday) - currentTime.weekday()) % 7)
+    try:
+        return datetime.strptime(dayStr, "%Y-%m-%d")
+    except ValueError:
+        return None
+
+
+def parseTimeOfDay(currentTime, timeStr):
+    # Attempt to parse time with AM/PM
+    if any(x in timeStr.lower() for x in ['am', 'pm']):
+        time = datetime.strptime(timeStr, "%I:%M%p" if ':' in timeStr else "%I%p")
+    else:
+        # Preliminary check for invalid hour ranges before attempting to parse
+        if ':' in timeStr:
+            hour, _, minute = timeStr.partition(':')
+            hour = int(hour)
+            minute = int(minute)
+        else:
+            hour = int(timeStr)
+            minute = 0
+
+        if hour < 0 or hour > 23:
+            raise ValueError("Hour must be between 0 and 23 for 24-hour time format.")
+        if minute < 0 or minute > 59:
+            raise ValueError("Minute must be between 0 and 59.")
+
+        # Create a datetime object using the valid hour and minute
+        if (hour > 0 and (hour < 8 or (hour == 8 and minute == 0))):
+            hour += 12
+        time = datetime.now().replace(hour=hour, minute=minute, second=0, microsecond=0)
+
+    # Replace the date part with today's date
+    nextTime = time.replace(year=currentTime.year, month=currentTime.month, day=currentTime.day)
+
+    # Check if the parsed time is in the past; if so, add one day
+    if nextTime <= currentTime:
+        nextTime += timedelta(days=1)
+
+    return nextTime
+
+
+# Schedules through the durable scheduler, the condition is only checked while this process runs
 async def scheduleMessageAt(sendTime:datetime, client:discord.Client, channelId:int, message:str, condition=None):
-    now = datetime.now()
-    delay = (sendTime - now).total_seconds()
-    await asyncio.sleep(delay)  # Wait until the scheduled time
-    if (condition != None and not condition()): # Check if the condition is met
-        return
     channel = client.get_channel(channelId)
-    return await channel.send(message)
+    guildId = channel.guild.id if channel is not None and hasattr(channel, 'guild') else None
+    return scheduler.start(client).schedule(guildId, [channelId], message, sendTime.timestamp(), condition=condition)
 
 
 async def getUser(username:str, client:discord.Client):
-    try:
-        user = discord.utils.get(client.get_all_members(), name="username").id
-    except discord.errors.NotFound:
-        user = None
-    return user
\ No newline at end of file
+    for guild in client.guilds:
+        await gateway.ensureMembers(guild)
+        member = memberindex.forGuild(guild).get(username)
+        if member is not None:
+            return member.id
+    return None
\ No newline at end of file